@@ -0,0 +1,184 @@
+"""Admission control, so that one client cannot tie up the server with huge scans.
+
+Every scan is given an estimated cost before it runs: its number of points, times
+the measured time taken to solve each point. The measurement starts from the
+scan_point_cost setting, and follows the scans actually solved as an exponentially
+weighted moving average.
+
+Scans are admitted while the estimated cost of all admitted scans in the same
+collection stays within the scan_budget setting, in seconds. Setting it to zero
+admits every scan. Rejected scans can be resubmitted as background jobs, which
+queue for a worker instead.
+
+Scans also run on the event loops of background jobs, so all of this state is
+updated under a lock.
+"""
+
+import threading
+from typing import Dict, Optional, Tuple
+
+from diffcalc_api.config import settings
+from diffcalc_api.errors.hkl import ScanBudgetExceededError
+from diffcalc_api.models.hkl import ScanEstimate
+
+# weight given to each new measurement of the time taken to solve a point
+SMOOTHING = 0.2
+
+_seconds_per_point: Optional[float] = None
+_in_flight: Dict[str, float] = {}
+_stats = {"admitted": 0, "rejected": 0}
+_lock = threading.RLock()
+
+
+def seconds_per_point() -> float:
+    """Current estimate of the time taken to solve one scan point."""
+    if _seconds_per_point is None:
+        return settings.scan_point_cost
+    return _seconds_per_point
+
+
+def record(points: int, seconds: float) -> None:
+    """Update the estimated cost of a scan point from a scan which has been solved.
+
+    Args:
+        points: number of points solved
+        seconds: time taken to solve them
+    """
+    global _seconds_per_point
+
+    if points <= 0:
+        return
+
+    measured = seconds / points
+    with _lock:
+        _seconds_per_point = (
+            measured
+            if _seconds_per_point is None
+            else (1 - SMOOTHING) * _seconds_per_point + SMOOTHING * measured
+        )
+
+
+def estimate(points: int, collection: Optional[str]) -> ScanEstimate:
+    """Estimate the cost of a scan, and whether it would be admitted now.
+
+    Args:
+        points: number of points in the scan
+        collection: the collection the scan is run in
+
+    Returns:
+        The estimate.
+    """
+    key = collection if collection else "default"
+    with _lock:
+        per_point = seconds_per_point()
+        in_flight = _in_flight.get(key, 0.0)
+    cost = points * per_point
+
+    return ScanEstimate(
+        points=points,
+        seconds_per_point=per_point,
+        estimated_seconds=cost,
+        in_flight_seconds=in_flight,
+        budget_seconds=settings.scan_budget,
+        admitted=settings.scan_budget <= 0 or in_flight + cost <= settings.scan_budget,
+    )
+
+
+class Admission:
+    """A scan admitted to run, holding its share of its collection's budget.
+
+    Used as a context manager, releasing the budget at the end of the block. Scans
+    which outlive the block, such as streamed responses, detach from it and
+    release the budget themselves once finished.
+    """
+
+    def __init__(self, key: str, cost: float) -> None:
+        """Hold a share of the budget.
+
+        Args:
+            key: the collection the scan is run in
+            cost: estimated cost of the scan, in seconds
+        """
+        self.key = key
+        self.cost = cost
+        self.released = False
+        self.detached = False
+        with _lock:
+            _in_flight[key] = _in_flight.get(key, 0.0) + cost
+
+    def detach(self) -> "Admission":
+        """Keep holding the budget after the block, unless it raises an exception.
+
+        Returns:
+            This admission, which must be released once the scan is finished.
+        """
+        self.detached = True
+        return self
+
+    def release(self) -> None:
+        """Return the share of the budget, if not already returned."""
+        with _lock:
+            if self.released:
+                return
+
+            self.released = True
+            remaining = _in_flight.get(self.key, 0.0) - self.cost
+            if remaining > 1e-9:
+                _in_flight[self.key] = remaining
+            else:
+                _in_flight.pop(self.key, None)
+
+    def __enter__(self) -> "Admission":
+        """Hold the budget for the duration of the block."""
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        """Return the budget at the end of the block, unless detached from it."""
+        if exc_type is not None or not self.detached:
+            self.release()
+
+
+def admit(points: int, collection: Optional[str]) -> Admission:
+    """Admit a scan, if its collection has enough budget left.
+
+    Args:
+        points: number of points in the scan
+        collection: the collection the scan is run in
+
+    Returns:
+        The admission, which must be released once the scan is finished.
+    """
+    with _lock:
+        scan = estimate(points, collection)
+        if not scan.admitted:
+            _stats["rejected"] += 1
+            raise ScanBudgetExceededError(
+                scan.estimated_seconds, scan.in_flight_seconds, scan.budget_seconds
+            )
+
+        _stats["admitted"] += 1
+        return Admission(
+            collection if collection else "default", scan.estimated_seconds
+        )
+
+
+def metrics() -> Tuple[Dict[str, float], Dict[str, float]]:
+    """Summarise admission decisions, and the budget currently in use.
+
+    Returns:
+        Dictionary of admission counts and the estimated cost of a point, and
+        dictionary of each collection and its estimated seconds of admitted scans.
+    """
+    with _lock:
+        return {**_stats, "seconds_per_point": seconds_per_point()}, dict(_in_flight)
+
+
+def reset() -> None:
+    """Forget all measurements, admitted scans and statistics."""
+    global _seconds_per_point
+
+    with _lock:
+        _seconds_per_point = None
+        _in_flight.clear()
+        for stat in _stats:
+            _stats[stat] = 0
@@ -1,6 +1,7 @@
 """API configuration options."""
 
 import logging
+from typing import Dict, Optional
 
 from pydantic import BaseSettings
 
@@ -24,9 +25,38 @@ class Settings(BaseSettings):
     """
 
     mongo_url: str = "localhost:27017"
+    mongo_database: str = "test_db"
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_max_idle_time: Optional[float] = None
+    mongo_wait_queue_timeout: Optional[float] = None
+    mongo_server_selection_timeout: float = 30.0
+    mongo_connect_timeout: float = 20.0
+    mongo_socket_timeout: Optional[float] = None
+    mongo_read_preference: str = "primary"
+    mongo_write_concern: str = ""
+    store_binary: bool = False
     api_version = version
     logging_level: str = "WARN"
     logging_format: str = "[%(asctime)s] %(levelname)s:%(message)s"
+    cache_max_size: int = 0
+    cache_ttl: float = 30.0
+    shared_cache_url: str = ""
+    shared_cache_ttl: float = 300.0
+    thread_workers: int = 4
+    process_workers: int = 0
+    executor_routes: Dict[str, str] = {"hkl.scan": "process"}
+    scan_parallel_min_points: int = 100
+    scan_cache_max_points: int = 100000
+    scan_max_points: int = 1000000
+    scan_point_cost: float = 0.005
+    scan_budget: float = 0.0
+    job_workers: int = 2
+    job_retention: float = 3600.0
+    job_max_finished: int = 100
+    job_max_unfinished: int = 100
+    import_max_size: int = 64 * 1024 * 1024
+    import_max_member_size: int = 1024 * 1024
 
 
 settings = Settings()
@@ -45,7 +75,8 @@ CONSTRAINTS_WITH_NO_VALUE = {"a_eq_b", "bin_eq_bout", "mu_is_gam", "bisect"}
 
 ALL_CONSTRAINTS = {
     "delta",
-    "gam" "qaz",
+    "gam",
+    "qaz",
     "naz",
     "a_eq_b",
     "alpha",
@@ -1,11 +1,148 @@
-"""Mongo database configuration options."""
+"""Mongo database configuration options.
+
+The connection pool, timeouts, read preference, write concern and database name are
+all taken from diffcalc_api.config.Settings. Use of the connection pool is recorded
+by a pymongo event listener, and summarised by diffcalc_api.database.metrics.
+"""
+
+import threading
+from typing import Any, Dict, Optional
 
 import motor.motor_asyncio
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
 
 from diffcalc_api.config import Settings
 
 settings = Settings()
 
-client: AsyncIOMotorClient = motor.motor_asyncio.AsyncIOMotorClient(settings.mongo_url)
-database: AsyncIOMotorDatabase = client.test_db
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Counts connection pool events, across every server the client talks to."""
+
+    def __init__(self) -> None:
+        """Start with no connections."""
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checkouts_started = 0
+        self.checked_out = 0
+        self.checked_in = 0
+        self.checkout_failures = 0
+        self.cleared = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _count(self, counter: str, wait: Optional[float] = None) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            if wait is not None:
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        pass
+
+    def pool_ready(self, event: monitoring.PoolReadyEvent) -> None:
+        pass
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        self._count("cleared")
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        pass
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        self._count("created")
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        pass
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        self._count("closed")
+
+    def connection_check_out_started(
+        self, event: monitoring.ConnectionCheckOutStartedEvent
+    ) -> None:
+        self._count("checkouts_started")
+
+    def connection_check_out_failed(
+        self, event: monitoring.ConnectionCheckOutFailedEvent
+    ) -> None:
+        self._count("checkout_failures", getattr(event, "duration", None))
+
+    def connection_checked_out(
+        self, event: monitoring.ConnectionCheckedOutEvent
+    ) -> None:
+        self._count("checked_out", getattr(event, "duration", None))
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:
+        self._count("checked_in")
+
+    def stats(self) -> Dict[str, float]:
+        """Summarise use of the connection pool.
+
+        Returns:
+            Dictionary of pool size, connections open, in use and waiting, event
+            counts, and checkout wait times in seconds.
+        """
+        with self._lock:
+            finished = self.checked_out + self.checkout_failures
+            return {
+                "max_pool_size": settings.mongo_max_pool_size,
+                "open": self.created - self.closed,
+                "in_use": self.checked_out - self.checked_in,
+                "waiting": self.checkouts_started - finished,
+                "created": self.created,
+                "closed": self.closed,
+                "checked_out": self.checked_out,
+                "checkout_failures": self.checkout_failures,
+                "cleared": self.cleared,
+                "mean_wait": self.total_wait / finished if finished else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+
+def _milliseconds(seconds: Optional[float]) -> Optional[int]:
+    return int(seconds * 1000) if seconds is not None else None
+
+
+def client_options() -> Dict[str, Any]:
+    """Build the keyword arguments used to create the motor client.
+
+    Returns:
+        Dictionary of pymongo client options, without those left unset.
+    """
+    options: Dict[str, Any] = {
+        "maxPoolSize": settings.mongo_max_pool_size,
+        "minPoolSize": settings.mongo_min_pool_size,
+        "maxIdleTimeMS": _milliseconds(settings.mongo_max_idle_time),
+        "waitQueueTimeoutMS": _milliseconds(settings.mongo_wait_queue_timeout),
+        "serverSelectionTimeoutMS": _milliseconds(
+            settings.mongo_server_selection_timeout
+        ),
+        "connectTimeoutMS": _milliseconds(settings.mongo_connect_timeout),
+        "socketTimeoutMS": _milliseconds(settings.mongo_socket_timeout),
+        "readPreference": settings.mongo_read_preference,
+    }
+    if settings.mongo_write_concern:
+        write_concern = settings.mongo_write_concern
+        options["w"] = int(write_concern) if write_concern.isdigit() else write_concern
+    return {key: value for key, value in options.items() if value is not None}
+
+
+pool_metrics = PoolMetrics()
+
+client: AsyncIOMotorClient = motor.motor_asyncio.AsyncIOMotorClient(
+    settings.mongo_url, event_listeners=[pool_metrics], **client_options()
+)
+database: AsyncIOMotorDatabase = client[settings.mongo_database]
+
+
+def metrics() -> Dict[str, Dict[str, float]]:
+    """Summarise use of the mongo connection pool.
+
+    Returns:
+        Dictionary of pool statistics, under "pool".
+    """
+    return {"pool": pool_metrics.stats()}
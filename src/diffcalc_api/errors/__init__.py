@@ -5,6 +5,6 @@ Because some errors arise from persistence retrieval, those are defined in
 structures within diffcalc_api.stores instead.
 """
 
-from diffcalc_api.errors import constraints, hkl, ub
+from diffcalc_api.errors import collections, constraints, hkl, jobs, ub
 
-__all__ = ["hkl", "ub", "constraints"]
+__all__ = ["hkl", "ub", "constraints", "jobs", "collections"]
@@ -0,0 +1,37 @@
+"""Errors that can be raised when accessing /collections/ endpoints."""
+
+import numpy as np
+
+from diffcalc_api.errors.definitions import (
+    ALL_RESPONSES,
+    DiffcalcAPIException,
+    ErrorCodesBase,
+)
+
+
+class ErrorCodes(ErrorCodesBase):
+    """All error codes which collections routes can raise."""
+
+    INVALID_ARCHIVE = 400
+    ARCHIVE_TOO_LARGE = 400
+
+
+responses = {code: ALL_RESPONSES[code] for code in np.unique(ErrorCodes.all_codes())}
+
+
+class InvalidArchiveError(DiffcalcAPIException):
+    """Error that gets thrown when an imported archive cannot be read."""
+
+    def __init__(self, reason: str) -> None:
+        """Set detail and status code."""
+        self.detail = f"archive cannot be imported: {reason}"
+        self.status_code = ErrorCodes.INVALID_ARCHIVE
+
+
+class ArchiveTooLargeError(DiffcalcAPIException):
+    """Error that gets thrown when an imported archive or crystal is too large."""
+
+    def __init__(self, what: str, max_size: int) -> None:
+        """Set detail and status code."""
+        self.detail = f"{what} exceeds the maximum of {max_size} bytes"
+        self.status_code = ErrorCodes.ARCHIVE_TOO_LARGE
@@ -45,5 +45,7 @@ ALL_RESPONSES: Dict[Union[int, str], Dict[str, Any]] = {
     403: {"model": DiffcalcExceptionModel, "description": "Forbidden Request"},
     404: {"model": DiffcalcExceptionModel, "description": "Resource Not Found"},
     405: {"model": DiffcalcExceptionModel, "description": "Request disabled"},
+    409: {"model": DiffcalcExceptionModel, "description": "Conflicting Request"},
+    429: {"model": DiffcalcExceptionModel, "description": "Too Many Requests"},
     500: {"model": DiffcalcExceptionModel, "description": "Internal Server Error"},
 }
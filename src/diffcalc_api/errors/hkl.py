@@ -16,6 +16,9 @@ class ErrorCodes(ErrorCodesBase):
     INVALID_MILLER_INDICES = 400
     INVALID_SCAN_BOUNDS = 400
     INVALID_SOLUTION_BOUNDS = 400
+    INVALID_BATCH = 400
+    SCAN_TOO_LARGE = 400
+    SCAN_BUDGET_EXCEEDED = 429
 
 
 responses = {code: ALL_RESPONSES[code] for code in np.unique(ErrorCodes.all_codes())}
@@ -44,6 +47,30 @@ class InvalidScanBoundsError(DiffcalcAPIException):
         self.status_code = ErrorCodes.INVALID_SCAN_BOUNDS
 
 
+class ScanTooLargeError(DiffcalcAPIException):
+    """Error that gets thrown when a scan has more points than allowed."""
+
+    def __init__(self, points: int, max_points: int) -> None:
+        """Set detail and status code."""
+        self.detail = (
+            f"scan of {points} points exceeds the maximum of {max_points} points"
+        )
+        self.status_code = ErrorCodes.SCAN_TOO_LARGE
+
+
+class ScanBudgetExceededError(DiffcalcAPIException):
+    """Error that gets thrown when a scan would exceed its collection's budget."""
+
+    def __init__(self, estimate: float, in_flight: float, budget: float) -> None:
+        """Set detail and status code."""
+        self.detail = (
+            f"scan estimated to take {estimate:.3g}s would exceed the budget of "
+            f"{budget:.3g}s for its collection, with {in_flight:.3g}s already "
+            "running. Try again later, or submit it as a background job."
+        )
+        self.status_code = ErrorCodes.SCAN_BUDGET_EXCEEDED
+
+
 class InvalidSolutionBoundsError(DiffcalcAPIException):
     """Error that gets thrown when provided solution bounds are invalid.
 
@@ -56,3 +83,12 @@ class InvalidSolutionBoundsError(DiffcalcAPIException):
         """Set detail and status code."""
         self.detail = detail
         self.status_code = ErrorCodes.INVALID_SOLUTION_BOUNDS
+
+
+class InvalidBatchError(DiffcalcAPIException):
+    """Error that gets thrown when a batch request body is inconsistent."""
+
+    def __init__(self, detail: str) -> None:
+        """Set detail and status code."""
+        self.detail = detail
+        self.status_code = ErrorCodes.INVALID_BATCH
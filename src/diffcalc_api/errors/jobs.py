@@ -0,0 +1,40 @@
+"""Errors that can be raised when accessing /jobs/ endpoints."""
+
+import numpy as np
+
+from diffcalc_api.errors.definitions import (
+    ALL_RESPONSES,
+    DiffcalcAPIException,
+    ErrorCodesBase,
+)
+
+
+class ErrorCodes(ErrorCodesBase):
+    """All error codes which job routes can raise."""
+
+    JOB_NOT_FOUND = 404
+    TOO_MANY_JOBS = 429
+
+
+responses = {code: ALL_RESPONSES[code] for code in np.unique(ErrorCodes.all_codes())}
+
+
+class JobNotFoundError(DiffcalcAPIException):
+    """Error that gets thrown when a job does not exist, or has expired."""
+
+    def __init__(self, job_id: str) -> None:
+        """Set detail and status code."""
+        self.detail = f"job {job_id} does not exist, or has expired"
+        self.status_code = ErrorCodes.JOB_NOT_FOUND
+
+
+class TooManyJobsError(DiffcalcAPIException):
+    """Error that gets thrown when too many jobs are already waiting or running."""
+
+    def __init__(self, max_jobs: int) -> None:
+        """Set detail and status code."""
+        self.detail = (
+            f"{max_jobs} jobs are already waiting or running. Try again once some "
+            "have finished."
+        )
+        self.status_code = ErrorCodes.TOO_MANY_JOBS
@@ -1,5 +1,5 @@
 """Examples to use in endpoints for fastAPI docs, to make it easier to read."""
 
-from diffcalc_api.examples import ub
+from diffcalc_api.examples import hkl, ub
 
-__all__ = ["ub"]
+__all__ = ["ub", "hkl"]
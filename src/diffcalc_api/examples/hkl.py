@@ -0,0 +1,17 @@
+"""API examples used in diffcalc_api.routes.hkl."""
+
+from diffcalc_api.models.hkl import BatchLabPositionParams, BatchMillerIndicesParams
+
+batch_lab_position: BatchLabPositionParams = BatchLabPositionParams(
+    hkl=[(0, 0, 1), (1, 0, 1), (0, 1, 1)], wavelength=1.0
+)
+
+batch_miller_indices: BatchMillerIndicesParams = BatchMillerIndicesParams(
+    mu=[7.31, 7.31],
+    delta=[0.0, 0.0],
+    nu=[10.62, 10.62],
+    eta=[0.0, 5.0],
+    chi=[0.0, 0.0],
+    phi=[0.0, 0.0],
+    wavelength=1.0,
+)
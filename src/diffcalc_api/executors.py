@@ -0,0 +1,247 @@
+"""Executors used to run CPU bound diffcalc-core calls away from the event loop.
+
+Services submit work under a route name, such as "hkl.scan". Each route is mapped
+to one of three kinds of executor through the executor_routes setting:
+
+- "thread": a shared thread pool, sized by the thread_workers setting.
+- "process": a shared process pool, sized by the process_workers setting. Arguments
+  and results must be picklable, and any changes made to arguments are lost.
+- "inline": run directly on the event loop.
+
+Routes which are not configured use the thread pool. A pool sized to zero workers
+falls back to the next kind down, process to thread to inline.
+
+Executors are used from the event loop of every background job as well as the
+server's, so their metrics are updated under a lock.
+"""
+
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor as PoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from diffcalc_api.config import settings
+
+T = TypeVar("T")
+
+KINDS = ("inline", "thread", "process")
+
+
+def _timed_call(
+    func: Callable[..., T], *args: Any
+) -> Tuple[float, Optional[T], Optional[BaseException]]:
+    """Call a function inside a worker, recording when the call started.
+
+    Exceptions are returned rather than raised so that the start time is always
+    reported back to the event loop.
+    """
+    started_at = time.time()
+    try:
+        return started_at, func(*args), None
+    except Exception as e:
+        return started_at, None, e
+
+
+class Executor:
+    """A sized pool of workers, with metrics about the work submitted to it."""
+
+    def __init__(self, kind: str, workers: int) -> None:
+        """Set up the executor, without starting any workers yet.
+
+        Args:
+            kind: either "thread" or "process"
+            workers: maximum number of calls running at once
+        """
+        self.kind = kind
+        self.workers = workers
+        self._pool: Optional[PoolExecutor] = None
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def pool(self) -> PoolExecutor:
+        """The underlying pool, started on first use."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = (
+                    ThreadPoolExecutor(self.workers, thread_name_prefix="diffcalc")
+                    if self.kind == "thread"
+                    else ProcessPoolExecutor(
+                        self.workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                )
+            return self._pool
+
+    @property
+    def in_flight(self) -> int:
+        """Number of calls submitted which have not yet returned."""
+        return self.submitted - self.completed
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of calls waiting for a free worker."""
+        return max(0, self.in_flight - self.workers)
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """Run a function on a worker, waiting for its result.
+
+        Args:
+            func: the function to call
+            args: arguments to call it with
+
+        Returns:
+            Whatever the function returns. Any exception it raises is re-raised.
+        """
+        loop = asyncio.get_running_loop()
+        submitted_at = time.time()
+        with self._lock:
+            self.submitted += 1
+        try:
+            started_at, result, error = await loop.run_in_executor(
+                self.pool, _timed_call, func, *args
+            )
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+                self.completed += 1
+            raise
+
+        wait = max(0.0, started_at - submitted_at)
+        with self._lock:
+            self.completed += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if error is not None:
+                self.failed += 1
+
+        if error is not None:
+            raise error
+        return result  # type: ignore
+
+    def stats(self) -> Dict[str, float]:
+        """Summarise the work submitted to this executor.
+
+        Returns:
+            Dictionary of worker count, queue depth and wait times in seconds.
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                "queue_depth": self.queue_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "mean_wait": (
+                    self.total_wait / self.completed if self.completed else 0.0
+                ),
+                "max_wait": self.max_wait,
+            }
+
+    def shutdown(self) -> None:
+        """Stop the underlying pool, waiting for running work to finish."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+
+_executors: Dict[str, Executor] = {}
+_lock = threading.Lock()
+
+
+def get_executor(kind: str) -> Optional[Executor]:
+    """Retrieve the shared executor of a given kind, creating it on first use.
+
+    Args:
+        kind: either "thread" or "process"
+
+    Returns:
+        The executor, or None if it is configured with no workers.
+    """
+    with _lock:
+        if kind not in _executors:
+            workers = (
+                settings.thread_workers
+                if kind == "thread"
+                else settings.process_workers
+            )
+            if workers <= 0:
+                return None
+            _executors[kind] = Executor(kind, workers)
+
+        return _executors[kind]
+
+
+def resolve(route: str, allow_process: bool = True) -> Optional[Executor]:
+    """Find the executor a route should run on.
+
+    Args:
+        route: name of the route, e.g. "hkl.scan"
+        allow_process: whether the work may run in another process. Work which
+            modifies its arguments must not.
+
+    Returns:
+        The executor, or None if the work should run inline.
+    """
+    kind = settings.executor_routes.get(route, "thread")
+    if kind not in KINDS:
+        raise ValueError(f"executor {kind} for route {route} must be one of {KINDS}")
+
+    position = KINDS.index(kind) if allow_process else min(KINDS.index(kind), 1)
+    for fallback in reversed(KINDS[1 : position + 1]):
+        executor = get_executor(fallback)
+        if executor is not None:
+            return executor
+
+    return None
+
+
+async def run(
+    route: str, func: Callable[..., T], *args: Any, allow_process: bool = True
+) -> T:
+    """Run a function on the executor configured for a route.
+
+    Args:
+        route: name of the route, e.g. "hkl.scan"
+        func: the function to call
+        args: arguments to call it with
+        allow_process: whether the work may run in another process. Work which
+            modifies its arguments must not.
+
+    Returns:
+        Whatever the function returns.
+    """
+    executor = resolve(route, allow_process)
+    if executor is None:
+        return func(*args)
+
+    return await executor.run(func, *args)
+
+
+def metrics() -> Dict[str, Dict[str, float]]:
+    """Summarise the work submitted to every executor in use.
+
+    Returns:
+        Dictionary of executor kinds, and their statistics.
+    """
+    with _lock:
+        executors = dict(_executors)
+    return {kind: executor.stats() for kind, executor in executors.items()}
+
+
+def shutdown() -> None:
+    """Shut down all shared executors, waiting for running work to finish."""
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown()
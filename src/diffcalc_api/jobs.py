@@ -0,0 +1,211 @@
+"""Background jobs, for scans too large to wait on within a single request.
+
+A job consumes an asynchronous iterable of scan results, such as a ScanStream from
+diffcalc_api.services.hkl, on a local pool of worker threads sized by the
+job_workers setting. Each worker runs its own event loop, so jobs outlive the
+request which submitted them. Results are kept as they are solved, so they can
+be read while the job is still running. Jobs which have finished are kept for
+job_retention seconds, then forgotten. At most job_max_finished of them are kept,
+so that their results cannot build up in memory, forgetting the oldest first.
+
+At most job_max_unfinished jobs can be waiting or running at once, further
+submissions being rejected until some have finished. Setting it to zero lifts the
+limit.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterable, Dict, List, Optional, Tuple
+
+from diffcalc.util import DiffcalcException
+
+from diffcalc_api.config import settings
+from diffcalc_api.errors.jobs import JobNotFoundError, TooManyJobsError
+from diffcalc_api.models.hkl import ScanJobModel, ScanJobStatus
+
+logger = logging.getLogger(__name__)
+
+ScanResults = AsyncIterable[Tuple[str, List[Dict[str, float]]]]
+
+
+class ScanJob:
+    """A scan running in the background, with the results solved so far."""
+
+    def __init__(self, total: int) -> None:
+        """Set up the job, without starting it.
+
+        Args:
+            total: number of points in the scan
+        """
+        self.id = uuid.uuid4().hex
+        self.status = ScanJobStatus.pending
+        self.total = total
+        self.results: List[Tuple[str, List[Dict[str, float]]]] = []
+        self.error: Optional[str] = None
+        self.finished_at: Optional[float] = None
+
+        self._cancelled = threading.Event()
+        self._future: Optional["Future[None]"] = None
+
+    @property
+    def finished(self) -> bool:
+        """Whether the job has stopped, for whatever reason."""
+        return self.finished_at is not None
+
+    def run(self, results: ScanResults) -> None:
+        """Solve the scan, storing each result as soon as it arrives.
+
+        Args:
+            results: asynchronous iterable of each scan point and its positions
+        """
+        asyncio.run(self._consume(results))
+
+    async def _consume(self, results: ScanResults) -> None:
+        self.status = ScanJobStatus.running
+        try:
+            if not self._cancelled.is_set():
+                async for result in results:
+                    self.results.append(result)
+                    if self._cancelled.is_set():
+                        break
+        except DiffcalcException as e:
+            self.error = str(e)
+            self.status = ScanJobStatus.failed
+        except Exception as e:
+            logger.exception(f"Background scan {self.id} failed")
+            self.error = str(e)
+            self.status = ScanJobStatus.failed
+        else:
+            self.status = (
+                ScanJobStatus.done
+                if len(self.results) == self.total
+                else ScanJobStatus.cancelled
+            )
+        finally:
+            self.finished_at = time.monotonic()
+            expire()
+
+    def cancel(self) -> None:
+        """Stop the job after the point currently being solved.
+
+        Results solved before the job was cancelled are kept.
+        """
+        self._cancelled.set()
+        if self._future is not None and self._future.cancel():
+            self.status = ScanJobStatus.cancelled
+            self.finished_at = time.monotonic()
+
+    def page(self, offset: int, limit: int) -> Dict[str, List[Dict[str, float]]]:
+        """Get a page of the results solved so far, in scan order.
+
+        Args:
+            offset: number of scan points to skip
+            limit: maximum number of scan points to return
+
+        Returns:
+            Dictionary of each scan point in the page, and its possible positions.
+        """
+        return dict(self.results[offset : offset + limit])
+
+    def model(self) -> ScanJobModel:
+        """Summarise the progress of the job.
+
+        Returns:
+            ScanJobModel with the status, and number of points done so far.
+        """
+        return ScanJobModel(
+            id=self.id,
+            status=self.status,
+            done=len(self.results),
+            total=self.total,
+            error=self.error,
+        )
+
+
+_jobs: Dict[str, ScanJob] = {}
+_pool: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def expire() -> None:
+    """Forget jobs which finished more than job_retention seconds ago.
+
+    The oldest finished jobs are also forgotten while more than job_max_finished
+    are kept.
+    """
+    cutoff = time.monotonic() - settings.job_retention
+    with _lock:
+        finished = sorted(
+            (job for job in _jobs.values() if job.finished_at is not None),
+            key=lambda job: job.finished_at or 0.0,
+        )
+        excess = len(finished) - max(0, settings.job_max_finished)
+        for i, job in enumerate(finished):
+            if i < excess or (job.finished_at or 0.0) < cutoff:
+                del _jobs[job.id]
+
+
+def submit(results: ScanResults, total: int) -> ScanJob:
+    """Start solving a scan in the background.
+
+    Jobs wait in a queue if every worker is busy, unless job_max_unfinished jobs
+    are already waiting or running.
+
+    Args:
+        results: asynchronous iterable of each scan point and its positions
+        total: number of points in the scan
+
+    Returns:
+        The job, which can later be retrieved by its id.
+    """
+    global _pool
+
+    expire()
+    job = ScanJob(total)
+    with _lock:
+        unfinished = sum(1 for other in _jobs.values() if not other.finished)
+        if 0 < settings.job_max_unfinished <= unfinished:
+            raise TooManyJobsError(settings.job_max_unfinished)
+
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max(1, settings.job_workers), thread_name_prefix="diffcalc-job"
+            )
+        _jobs[job.id] = job
+        job._future = _pool.submit(job.run, results)
+
+    return job
+
+
+def get(job_id: str) -> ScanJob:
+    """Retrieve a job which has not yet expired.
+
+    Args:
+        job_id: the id the job was submitted under
+
+    Returns:
+        The job.
+    """
+    expire()
+    try:
+        return _jobs[job_id]
+    except KeyError:
+        raise JobNotFoundError(job_id)
+
+
+def shutdown() -> None:
+    """Cancel all jobs, waiting for running jobs to stop."""
+    global _pool
+
+    with _lock:
+        for job in _jobs.values():
+            job.cancel()
+        pool, _pool = _pool, None
+
+    if pool is not None:
+        pool.shutdown()
+    _jobs.clear()
@@ -7,6 +7,6 @@ Module diffcalc_api.models.response defines general endpoint response models use
 all routes.
 """
 
-from diffcalc_api.models import hkl, response, ub
+from diffcalc_api.models import collections, hkl, response, ub
 
-__all__ = ["ub", "hkl", "response"]
+__all__ = ["ub", "hkl", "collections", "response"]
@@ -0,0 +1,39 @@
+"""Defines pydantic models relating to collections endpoints."""
+
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class CrystalSummary(BaseModel):
+    """Summary of one crystal in a collection.
+
+    crystal is the name of the lattice, if one has been set.
+    """
+
+    name: str
+    revision: int
+    crystal: Optional[str]
+    has_u_matrix: bool
+
+
+class CollectionPage(BaseModel):
+    """A page of the crystals in a collection, in order of name.
+
+    next is the cursor to pass as the after query of the next page, and is None on
+    the last page.
+    """
+
+    crystals: List[CrystalSummary]
+    next: Optional[str]
+
+
+class ImportSummary(BaseModel):
+    """Outcome of importing an archive into a collection.
+
+    Crystals which already existed in the collection are skipped, and left as they
+    were.
+    """
+
+    imported: int
+    skipped: List[str]
@@ -1,9 +1,11 @@
 """Defines pydantic models relating to hkl endpoints."""
 
 from dataclasses import dataclass
-from typing import Iterator, List, Optional, Union
+from enum import Enum
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 from diffcalc.hkl.geometry import Position
+from pydantic import BaseModel
 
 
 @dataclass
@@ -62,3 +64,132 @@ class SolutionConstraints:
         self.msg = msg
         if self.msg:
             self.valid = False
+
+
+class BatchLabPositionParams(BaseModel):
+    """Request body definition to convert many sets of miller indices at once.
+
+    Either a single wavelength for every set of miller indices, or one wavelength
+    per set of miller indices must be given.
+    """
+
+    hkl: List[Tuple[float, float, float]]
+    wavelength: Optional[float] = None
+    wavelengths: Optional[List[float]] = None
+
+
+class ColumnarPositions(BaseModel):
+    """Diffractometer positions for many sets of miller indices, stored by column.
+
+    Each solution is one row across the angle columns, and index maps every row
+    back to the position of its miller indices in the request. Miller indices which
+    could not be converted have their error message in errors instead.
+    """
+
+    index: List[int]
+    angles: Dict[str, List[float]]
+    errors: Dict[int, str]
+
+
+class BatchMillerIndicesParams(BaseModel):
+    """Request body definition to convert many diffractometer positions at once.
+
+    Each angle is given as a list, with one element per diffractometer position.
+    Either a single wavelength for every position, or one wavelength per position
+    must be given.
+    """
+
+    mu: List[float]
+    delta: List[float]
+    nu: List[float]
+    eta: List[float]
+    chi: List[float]
+    phi: List[float]
+    wavelength: Optional[float] = None
+    wavelengths: Optional[List[float]] = None
+
+
+class ColumnarMillerIndices(BaseModel):
+    """Miller indices for many diffractometer positions, stored by column."""
+
+    h: List[float]
+    k: List[float]
+    l: List[float]
+
+
+class ScanFormat(str, Enum):
+    """Encodings scan results can be returned in.
+
+    json: a ScanResponse, mapping each scan point to its list of positions.
+    columnar: a ColumnarScan as JSON, with one list per angle.
+    npz: a ColumnarScan as a numpy .npz archive of little-endian arrays.
+    """
+
+    json = "json"
+    columnar = "columnar"
+    npz = "npz"
+
+
+class ColumnarScan(BaseModel):
+    """Scan results stored by column.
+
+    points holds one column per value making up a scan point: h, k and l for hkl
+    scans, wavelength for wavelength scans, or the name of the scanned constraint.
+    Each solution is one row across the angle columns, and index maps every row
+    back to the row of its scan point in points.
+    """
+
+    points: Dict[str, List[float]]
+    index: List[int]
+    angles: Dict[str, List[float]]
+
+
+class ScanEstimate(BaseModel):
+    """Estimated cost of a scan, before it is run.
+
+    Costs are in seconds. A scan is admitted if the estimated cost of scans already
+    running in its collection, plus its own, is within the budget. A budget of zero
+    admits every scan.
+    """
+
+    points: int
+    seconds_per_point: float
+    estimated_seconds: float
+    in_flight_seconds: float
+    budget_seconds: float
+    admitted: bool
+
+
+class ScanTrajectory(BaseModel):
+    """A single continuous diffractometer trajectory through a scan.
+
+    positions holds one solution per scan point, with scan points without any
+    solution left out. branch_switches lists the scan points where even the closest
+    solution jumps away from the previous point.
+    """
+
+    positions: Dict[str, Dict[str, float]]
+    branch_switches: List[str]
+
+
+class ScanJobStatus(str, Enum):
+    """States a background scan job moves through."""
+
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+class ScanJobModel(BaseModel):
+    """Progress of a background scan job.
+
+    done counts the scan points solved so far, out of total.
+    """
+
+    id: str
+    status: ScanJobStatus
+    done: int
+    total: int
+    error: Optional[str]
@@ -1,9 +1,19 @@
 """Pydantic models relating to all endpoint responses."""
+
 from dataclasses import dataclass
 from typing import Dict, List, Optional
 
 from pydantic import BaseModel
 
+from diffcalc_api.models.collections import CollectionPage, ImportSummary
+from diffcalc_api.models.hkl import (
+    ColumnarMillerIndices,
+    ColumnarPositions,
+    ColumnarScan,
+    ScanEstimate,
+    ScanJobModel,
+    ScanTrajectory,
+)
 from diffcalc_api.models.ub import (
     HklModel,
     MiscutModel,
@@ -43,6 +53,48 @@ class ScanResponse(BaseModel):
     payload: Dict[str, List[Dict[str, float]]]
 
 
+class ColumnarScanResponse(BaseModel):
+    """Used for scans in hkl endpoints, with results stored by column."""
+
+    payload: ColumnarScan
+
+
+class ScanEstimateResponse(BaseModel):
+    """Used for dry runs of scan endpoints, estimating their cost."""
+
+    payload: ScanEstimate
+
+
+class TrajectoryResponse(BaseModel):
+    """Used for endpoints following one continuous trajectory through a scan."""
+
+    payload: ScanTrajectory
+
+
+class ScanJobResponse(BaseModel):
+    """Used for all endpoints submitting, polling or cancelling background scans."""
+
+    payload: ScanJobModel
+
+
+class CollectionPageResponse(BaseModel):
+    """Used for listing the crystals in a collection, a page at a time."""
+
+    payload: CollectionPage
+
+
+class ImportResponse(BaseModel):
+    """Used for importing an archive of crystals into a collection."""
+
+    payload: ImportSummary
+
+
+class MetricsResponse(BaseModel):
+    """Used for all endpoints exposing runtime metrics."""
+
+    payload: Dict[str, Dict[str, float]]
+
+
 class DiffractorAnglesResponse(BaseModel):
     """Diffractor Angles Response.
 
@@ -53,6 +105,15 @@ class DiffractorAnglesResponse(BaseModel):
     payload: List[Dict[str, float]]
 
 
+class BatchDiffractorAnglesResponse(BaseModel):
+    """Batch Diffractor Angles Response.
+
+    Used for endpoints converting many sets of miller indices at once.
+    """
+
+    payload: ColumnarPositions
+
+
 class SphericalResponse(BaseModel):
     """Spherical coordinate response model.
 
@@ -71,6 +132,15 @@ class ReciprocalSpaceResponse(BaseModel):
     payload: HklModel
 
 
+class BatchReciprocalSpaceResponse(BaseModel):
+    """Batch reciprocal space coordinate response model.
+
+    Returns a payload of many sets of miller indices, stored by column.
+    """
+
+    payload: ColumnarMillerIndices
+
+
 class RealSpaceResponse(BaseModel):
     """Reciprocal space coordinate response model.
 
@@ -1,5 +1,5 @@
 """Defines all endpoints for the API."""
 
-from diffcalc_api.routes import constraints, hkl, ub
+from diffcalc_api.routes import collections, constraints, hkl, jobs, metrics, ub
 
-__all__ = ["ub", "hkl", "constraints"]
+__all__ = ["ub", "hkl", "constraints", "jobs", "metrics", "collections"]
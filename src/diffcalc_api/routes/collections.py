@@ -0,0 +1,83 @@
+"""Endpoints for listing, exporting and importing whole collections of crystals."""
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+
+from diffcalc_api.models.response import CollectionPageResponse, ImportResponse
+from diffcalc_api.services import collections as service
+from diffcalc_api.stores.protocol import HklCalcStore, get_store
+
+router = APIRouter(prefix="/collections", tags=["collections"])
+
+
+@router.get("/{collection}", response_model=CollectionPageResponse)
+async def list_crystals(
+    collection: str,
+    store: HklCalcStore = Depends(get_store),
+    after: Optional[str] = Query(default=None, example="test"),
+    limit: int = Query(default=100, gt=0, le=1000),
+):
+    """List a page of the crystals in a collection, in order of name.
+
+    Args:
+        collection: the collection to list
+        store: accessor to the hkl objects
+        after: cursor returned with the previous page, if any
+        limit: maximum number of crystals to list
+
+    Returns:
+        CollectionPageResponse containing a summary of each crystal in the page, and
+        the cursor of the next page.
+    """
+    page = await service.list_crystals(store, collection, after, limit)
+    return CollectionPageResponse(payload=page)
+
+
+@router.get("/{collection}/export", response_class=StreamingResponse)
+async def export_collection(
+    collection: str,
+    store: HklCalcStore = Depends(get_store),
+):
+    """Export every crystal in a collection, as a gzip compressed tar archive.
+
+    Args:
+        collection: the collection to export
+        store: accessor to the hkl objects
+
+    Returns:
+        StreamingResponse streaming the archive, which can be imported with
+        POST /collections/{collection}/import.
+    """
+    return StreamingResponse(
+        service.export_collection(store, collection),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f"attachment; filename={collection}.tar.gz"},
+    )
+
+
+@router.post("/{collection}/import", response_model=ImportResponse)
+async def import_collection(
+    collection: str,
+    request: Request,
+    store: HklCalcStore = Depends(get_store),
+):
+    """Import every crystal in an archive exported from a collection.
+
+    The archive, as produced by GET /collections/{collection}/export, is sent as the
+    raw request body. Crystals which already exist in
+    the collection are skipped.
+
+    Args:
+        collection: the collection to import into
+        request: the request, with the archive as its body
+        store: accessor to the hkl objects
+
+    Returns:
+        ImportResponse containing the number of crystals imported, and the names of
+        those skipped.
+    """
+    with await service.spool_archive(request.stream()) as archive:
+        summary = await service.import_collection(store, collection, archive)
+    return ImportResponse(payload=summary)
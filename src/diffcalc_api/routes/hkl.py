@@ -1,15 +1,35 @@
 """Endpoints relating to calculating positions using constraints and the UB matrix."""
 
-from typing import List, Optional
+import json
+from typing import Any, AsyncIterable, Dict, List, Optional, Sequence, Tuple, Union
 
-from fastapi import APIRouter, Depends, Query
+from diffcalc.util import DiffcalcException
+from fastapi import APIRouter, Body, Depends, Header, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
 
+from diffcalc_api import admission, jobs
+from diffcalc_api.admission import Admission
+from diffcalc_api.config import ALL_CONSTRAINTS
+from diffcalc_api.errors.constraints import InvalidConstraintError
 from diffcalc_api.errors.hkl import InvalidSolutionBoundsError
-from diffcalc_api.models.hkl import SolutionConstraints
+from diffcalc_api.examples import hkl as examples
+from diffcalc_api.models.hkl import (
+    BatchLabPositionParams,
+    BatchMillerIndicesParams,
+    ScanFormat,
+    SolutionConstraints,
+)
 from diffcalc_api.models.response import (
+    BatchDiffractorAnglesResponse,
+    BatchReciprocalSpaceResponse,
+    ColumnarScanResponse,
     DiffractorAnglesResponse,
     ReciprocalSpaceResponse,
+    ScanEstimateResponse,
+    ScanJobResponse,
     ScanResponse,
+    TrajectoryResponse,
 )
 from diffcalc_api.models.ub import HklModel, PositionModel
 from diffcalc_api.services import hkl as service
@@ -17,6 +37,108 @@ from diffcalc_api.stores.protocol import HklCalcStore, get_store
 
 router = APIRouter(prefix="/hkl", tags=["hkl"])
 
+NDJSON = "application/x-ndjson"
+NPZ = "application/x-npz"
+
+# scans return a ScanResponse or a ColumnarScanResponse as JSON, or a .npz archive
+SCAN_RESPONSE_MODEL = Union[ScanResponse, ColumnarScanResponse]
+SCAN_RESPONSES: Dict[Union[int, str], Dict[str, Any]] = {
+    200: {"content": {NPZ: {"schema": {"type": "string", "format": "binary"}}}}
+}
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """A streamed response which releases a scan's admission once it is closed.
+
+    The admission is released however the response ends, including when the
+    client disconnects or sending fails before the first line is streamed.
+    """
+
+    def __init__(self, content: Any, scan: Admission, **kwargs: Any) -> None:
+        """Stream the content, holding the scan's admission until closed.
+
+        Args:
+            content: the content to stream
+            scan: the admission to release
+            kwargs: any other arguments to StreamingResponse
+        """
+        super().__init__(content, **kwargs)
+        self.scan = scan
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Send the response, then release the admission."""
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.scan.release()
+
+
+def ndjson_response(
+    results: AsyncIterable[Tuple[str, List[Dict[str, float]]]],
+    scan: Optional[Admission] = None,
+) -> StreamingResponse:
+    """Stream scan results as newline delimited JSON, one line per scan point.
+
+    Each line is an object with a single key, as in the payload of a ScanResponse.
+    As the response has already started, an error while solving a point is sent
+    as a final line containing the error message and type. The scan's admission,
+    if given, is released once the stream ends or the response is closed.
+    """
+
+    async def lines():
+        try:
+            async for key, positions in results:
+                yield json.dumps({key: positions}) + "\n"
+        except DiffcalcException as e:
+            yield json.dumps({"message": str(e), "type": str(type(e))}) + "\n"
+        finally:
+            if scan is not None:
+                scan.release()
+
+    if scan is None:
+        return StreamingResponse(lines(), media_type=NDJSON)
+    return AdmittedStreamingResponse(lines(), scan, media_type=NDJSON)
+
+
+def estimate_response(points: int, collection: Optional[str]) -> JSONResponse:
+    """Respond to a dry run of a scan with its estimated cost.
+
+    Args:
+        points: number of points in the scan
+        collection: the collection the scan would run in
+
+    Returns:
+        ScanEstimateResponse, already encoded.
+    """
+    estimate = admission.estimate(points, collection)
+    return JSONResponse(ScanEstimateResponse(payload=estimate).dict())
+
+
+def scan_response(
+    results: Dict[str, List[Dict[str, float]]],
+    output_format: ScanFormat,
+    variables: Sequence[str],
+) -> Union[ScanResponse, Response]:
+    """Encode scan results in the requested format.
+
+    Args:
+        results: dictionary of each scan point and its possible positions
+        output_format: the format to return the results in
+        variables: names of the values making up each scan point, for the columnar
+            formats
+
+    Returns:
+        ScanResponse for json, otherwise the already encoded response.
+    """
+    if output_format == ScanFormat.json:
+        return ScanResponse(payload=results)
+
+    columnar = service.columnar_scan_results(results, variables)
+    if output_format == ScanFormat.npz:
+        return Response(service.npz_scan_results(columnar), media_type=NPZ)
+
+    return JSONResponse({"payload": columnar.dict()})
+
 
 @router.get("/{name}/position/lab", response_model=DiffractorAnglesResponse)
 async def lab_position_from_miller_indices(
@@ -60,6 +182,41 @@ async def lab_position_from_miller_indices(
     return DiffractorAnglesResponse(payload=positions)
 
 
+@router.post("/{name}/position/lab", response_model=BatchDiffractorAnglesResponse)
+async def lab_positions_from_miller_indices_batch(
+    name: str,
+    params: BatchLabPositionParams = Body(..., example=examples.batch_lab_position),
+    axes: Optional[List[str]] = Query(default=None, example=["mu", "nu", "phi"]),
+    low_bound: Optional[List[float]] = Query(default=None, example=[0.0, 0.0, -90.0]),
+    high_bound: Optional[List[float]] = Query(default=None, example=[90.0, 90.0, 90.0]),
+    store: HklCalcStore = Depends(get_store),
+    collection: Optional[str] = Query(default=None, example="B07"),
+):
+    """Convert many sets of miller indices to diffractometer positions at once.
+
+    Args:
+        name: the name of the hkl object to access within the store
+        params: miller indices to be converted, and their wavelengths
+        axes: angles to constrain the solutions by
+        low_bounds: minimum values of constrained axes
+        high_bound: maximum values of constrained axes
+        store: accessor to the hkl object
+        collection: collection within which the hkl object resides
+
+    Returns:
+        BatchDiffractorAnglesResponse containing all possible diffractometer
+        positions by column, and any errors for individual miller indices.
+    """
+    solution_constraints = SolutionConstraints(axes, low_bound, high_bound)
+    if not solution_constraints.valid:
+        raise InvalidSolutionBoundsError(solution_constraints.msg)
+
+    positions = await service.lab_positions_from_miller_indices_batch(
+        name, params, solution_constraints, store, collection
+    )
+    return BatchDiffractorAnglesResponse(payload=positions)
+
+
 @router.get("/{name}/position/hkl", response_model=ReciprocalSpaceResponse)
 async def miller_indices_from_lab_position(
     name: str,
@@ -86,7 +243,33 @@ async def miller_indices_from_lab_position(
     return ReciprocalSpaceResponse(payload=hkl)
 
 
-@router.get("/{name}/scan/hkl", response_model=ScanResponse)
+@router.post("/{name}/position/hkl", response_model=BatchReciprocalSpaceResponse)
+async def miller_indices_from_lab_positions_batch(
+    name: str,
+    params: BatchMillerIndicesParams = Body(..., example=examples.batch_miller_indices),
+    store: HklCalcStore = Depends(get_store),
+    collection: Optional[str] = Query(default=None, example="B07"),
+):
+    """Convert many diffractometer positions to miller indices at once.
+
+    Args:
+        name: the name of the hkl object to access within the store
+        params: lists of diffractometer angles to be converted, and wavelengths
+        store: accessor to the hkl object.
+        collection: collection within which the hkl object resides.
+
+    Returns:
+        BatchReciprocalSpaceResponse containing the miller indices by column.
+    """
+    hkl = await service.miller_indices_from_lab_positions_batch(
+        name, params, store, collection
+    )
+    return BatchReciprocalSpaceResponse(payload=hkl)
+
+
+@router.get(
+    "/{name}/scan/hkl", response_model=SCAN_RESPONSE_MODEL, responses=SCAN_RESPONSES
+)
 async def scan_hkl(
     name: str,
     start: List[float] = Query(..., example=[1, 0, 1]),
@@ -98,6 +281,10 @@ async def scan_hkl(
     high_bound: Optional[List[float]] = Query(default=None, example=[90.0, 90.0, 90.0]),
     store: HklCalcStore = Depends(get_store),
     collection: Optional[str] = Query(default=None, example="B07"),
+    stream: bool = Query(default=False),
+    accept: Optional[str] = Header(default=None),
+    output_format: ScanFormat = Query(default=ScanFormat.json, alias="format"),
+    dry_run: bool = Query(default=False),
 ):
     """Retrieve possible diffractometer positions for a range of miller indices.
 
@@ -112,6 +299,10 @@ async def scan_hkl(
         high_bound: maximum values of constrained axes
         store: accessor to the hkl object.
         collection: collection within which the hkl object resides.
+        stream: whether to stream results as newline delimited JSON
+        accept: streams results if newline delimited JSON is accepted
+        output_format: json, columnar JSON, or a numpy .npz archive, if not streamed
+        dry_run: only estimate the cost of the scan, as a ScanEstimateResponse
 
     Returns:
         ScanResponse containing a dictionary of each set of miller indices and their
@@ -121,7 +312,76 @@ async def scan_hkl(
     if not solution_constraints.valid:
         raise InvalidSolutionBoundsError(solution_constraints.msg)
 
-    scan_results = await service.scan_hkl(
+    points = service.count_hkl_points(start, stop, inc)
+    if dry_run:
+        return estimate_response(points, collection)
+
+    with admission.admit(points, collection) as scan:
+        if stream or (accept is not None and NDJSON in accept):
+            return ndjson_response(
+                await service.stream_scan_hkl(
+                    name,
+                    start,
+                    stop,
+                    inc,
+                    wavelength,
+                    solution_constraints,
+                    store,
+                    collection,
+                ),
+                scan.detach(),
+            )
+
+        scan_results = await service.scan_hkl(
+            name,
+            start,
+            stop,
+            inc,
+            wavelength,
+            solution_constraints,
+            store,
+            collection,
+        )
+    return scan_response(scan_results, output_format, ("h", "k", "l"))
+
+
+@router.post("/{name}/scan/hkl", response_model=ScanJobResponse, status_code=202)
+async def submit_scan_hkl(
+    name: str,
+    start: List[float] = Query(..., example=[1, 0, 1]),
+    stop: List[float] = Query(..., example=[2, 0, 2]),
+    inc: List[float] = Query(..., example=[0.1, 0, 0.1]),
+    wavelength: float = Query(..., example=1),
+    axes: Optional[List[str]] = Query(default=None, example=["mu", "nu", "phi"]),
+    low_bound: Optional[List[float]] = Query(default=None, example=[0.0, 0.0, -90.0]),
+    high_bound: Optional[List[float]] = Query(default=None, example=[90.0, 90.0, 90.0]),
+    store: HklCalcStore = Depends(get_store),
+    collection: Optional[str] = Query(default=None, example="B07"),
+):
+    """Start a scan across a range of miller indices in the background.
+
+    Progress and results can be retrieved from the /jobs/ endpoints.
+
+    Args:
+        name: the name of the hkl object to access within the store
+        start: miller indices to start at
+        stop: miller indices to stop at
+        inc: miller indices to increment by
+        wavelength: wavelength of light used in the experiment
+        axes: angles to constrain the solutions by
+        low_bounds: minimum values of constrained axes
+        high_bound: maximum values of constrained axes
+        store: accessor to the hkl object.
+        collection: collection within which the hkl object resides.
+
+    Returns:
+        ScanJobResponse containing the id of the job running the scan.
+    """
+    solution_constraints = SolutionConstraints(axes, low_bound, high_bound)
+    if not solution_constraints.valid:
+        raise InvalidSolutionBoundsError(solution_constraints.msg)
+
+    scan = await service.stream_scan_hkl(
         name,
         start,
         stop,
@@ -131,10 +391,14 @@ async def scan_hkl(
         store,
         collection,
     )
-    return ScanResponse(payload=scan_results)
+    return ScanJobResponse(payload=jobs.submit(scan, len(scan)).model())
 
 
-@router.get("/{name}/scan/wavelength", response_model=ScanResponse)
+@router.get(
+    "/{name}/scan/wavelength",
+    response_model=SCAN_RESPONSE_MODEL,
+    responses=SCAN_RESPONSES,
+)
 async def scan_wavelength(
     name: str,
     start: float = Query(..., example=1.0),
@@ -146,6 +410,10 @@ async def scan_wavelength(
     high_bound: Optional[List[float]] = Query(default=None, example=[90.0, 90.0, 90.0]),
     store: HklCalcStore = Depends(get_store),
     collection: Optional[str] = Query(default=None, example="B07"),
+    stream: bool = Query(default=False),
+    accept: Optional[str] = Header(default=None),
+    output_format: ScanFormat = Query(default=ScanFormat.json, alias="format"),
+    dry_run: bool = Query(default=False),
 ):
     """Retrieve possible diffractometer positions for a range of wavelengths.
 
@@ -160,6 +428,10 @@ async def scan_wavelength(
         high_bound: maximum values of constrained axes
         store: accessor to the hkl object.
         collection: collection within which the hkl object resides.
+        stream: whether to stream results as newline delimited JSON
+        accept: streams results if newline delimited JSON is accepted
+        output_format: json, columnar JSON, or a numpy .npz archive, if not streamed
+        dry_run: only estimate the cost of the scan, as a ScanEstimateResponse
 
     Returns:
         ScanResponse containing a dictionary of each wavelength and the corresponding
@@ -169,13 +441,72 @@ async def scan_wavelength(
     if not solution_constraints.valid:
         raise InvalidSolutionBoundsError(solution_constraints.msg)
 
-    scan_results = await service.scan_wavelength(
+    points = service.count_axis_points(start, stop, inc)
+    if dry_run:
+        return estimate_response(points, collection)
+
+    with admission.admit(points, collection) as scan:
+        if stream or (accept is not None and NDJSON in accept):
+            return ndjson_response(
+                await service.stream_scan_wavelength(
+                    name, start, stop, inc, hkl, solution_constraints, store, collection
+                ),
+                scan.detach(),
+            )
+
+        scan_results = await service.scan_wavelength(
+            name, start, stop, inc, hkl, solution_constraints, store, collection
+        )
+    return scan_response(scan_results, output_format, ("wavelength",))
+
+
+@router.post("/{name}/scan/wavelength", response_model=ScanJobResponse, status_code=202)
+async def submit_scan_wavelength(
+    name: str,
+    start: float = Query(..., example=1.0),
+    stop: float = Query(..., example=2.0),
+    inc: float = Query(..., example=0.2),
+    hkl: HklModel = Depends(),
+    axes: Optional[List[str]] = Query(default=None, example=["mu", "nu", "phi"]),
+    low_bound: Optional[List[float]] = Query(default=None, example=[0.0, 0.0, -90.0]),
+    high_bound: Optional[List[float]] = Query(default=None, example=[90.0, 90.0, 90.0]),
+    store: HklCalcStore = Depends(get_store),
+    collection: Optional[str] = Query(default=None, example="B07"),
+):
+    """Start a scan across a range of wavelengths in the background.
+
+    Progress and results can be retrieved from the /jobs/ endpoints.
+
+    Args:
+        name: the name of the hkl object to access within the store
+        start: wavelength to start at
+        stop: wavelength to stop at
+        inc: wavelength to increment by
+        hkl: desired miller indices to use for the experiment
+        axes: angles to constrain the solutions by
+        low_bounds: minimum values of constrained axes
+        high_bound: maximum values of constrained axes
+        store: accessor to the hkl object.
+        collection: collection within which the hkl object resides.
+
+    Returns:
+        ScanJobResponse containing the id of the job running the scan.
+    """
+    solution_constraints = SolutionConstraints(axes, low_bound, high_bound)
+    if not solution_constraints.valid:
+        raise InvalidSolutionBoundsError(solution_constraints.msg)
+
+    scan = await service.stream_scan_wavelength(
         name, start, stop, inc, hkl, solution_constraints, store, collection
     )
-    return ScanResponse(payload=scan_results)
+    return ScanJobResponse(payload=jobs.submit(scan, len(scan)).model())
 
 
-@router.get("/{name}/scan/{constraint}", response_model=ScanResponse)
+@router.get(
+    "/{name}/scan/{constraint}",
+    response_model=SCAN_RESPONSE_MODEL,
+    responses=SCAN_RESPONSES,
+)
 async def scan_constraint(
     name: str,
     constraint: str,
@@ -189,6 +520,10 @@ async def scan_constraint(
     high_bound: Optional[List[float]] = Query(default=None, example=[90.0, 90.0, 90.0]),
     store: HklCalcStore = Depends(get_store),
     collection: Optional[str] = Query(default=None, example="B07"),
+    stream: bool = Query(default=False),
+    accept: Optional[str] = Header(default=None),
+    output_format: ScanFormat = Query(default=ScanFormat.json, alias="format"),
+    dry_run: bool = Query(default=False),
 ):
     """Retrieve possible diffractometer positions while scanning across a constraint.
 
@@ -205,6 +540,10 @@ async def scan_constraint(
         high_bound: maximum values of constrained axes
         store: accessor to the hkl object.
         collection: collection within which the hkl object resides.
+        stream: whether to stream results as newline delimited JSON
+        accept: streams results if newline delimited JSON is accepted
+        output_format: json, columnar JSON, or a numpy .npz archive, if not streamed
+        dry_run: only estimate the cost of the scan, as a ScanEstimateResponse
 
     Returns:
         ScanResponse containing a dictionary of each constraint value and the
@@ -213,8 +552,91 @@ async def scan_constraint(
     solution_constraints = SolutionConstraints(axes, low_bound, high_bound)
     if not solution_constraints.valid:
         raise InvalidSolutionBoundsError(solution_constraints.msg)
+    if constraint not in ALL_CONSTRAINTS:
+        raise InvalidConstraintError(constraint)
+
+    points = service.count_axis_points(start, stop, inc)
+    if dry_run:
+        return estimate_response(points, collection)
+
+    with admission.admit(points, collection) as scan:
+        if stream or (accept is not None and NDJSON in accept):
+            return ndjson_response(
+                await service.stream_scan_constraint(
+                    name,
+                    constraint,
+                    start,
+                    stop,
+                    inc,
+                    hkl,
+                    wavelength,
+                    solution_constraints,
+                    store,
+                    collection,
+                ),
+                scan.detach(),
+            )
+
+        scan_results = await service.scan_constraint(
+            name,
+            constraint,
+            start,
+            stop,
+            inc,
+            hkl,
+            wavelength,
+            solution_constraints,
+            store,
+            collection,
+        )
+    return scan_response(scan_results, output_format, (constraint,))
+
+
+@router.post(
+    "/{name}/scan/{constraint}", response_model=ScanJobResponse, status_code=202
+)
+async def submit_scan_constraint(
+    name: str,
+    constraint: str,
+    start: float = Query(..., example=1),
+    stop: float = Query(..., example=4),
+    inc: float = Query(..., example=1),
+    hkl: HklModel = Depends(),
+    wavelength: float = Query(..., example=1.0),
+    axes: Optional[List[str]] = Query(default=None, example=["mu", "nu", "phi"]),
+    low_bound: Optional[List[float]] = Query(default=None, example=[0.0, 0.0, -90.0]),
+    high_bound: Optional[List[float]] = Query(default=None, example=[90.0, 90.0, 90.0]),
+    store: HklCalcStore = Depends(get_store),
+    collection: Optional[str] = Query(default=None, example="B07"),
+):
+    """Start a scan across a constraint in the background.
+
+    Progress and results can be retrieved from the /jobs/ endpoints.
+
+    Args:
+        name: the name of the hkl object to access within the store
+        constraint: the name of the constraint to use.
+        start: constraint to start at
+        stop: constraint to stop at
+        inc: constraint to increment by
+        hkl: desired miller indices to use for the experiment
+        wavelength: wavelength of light used in the experiment
+        axes: angles to constrain the solutions by
+        low_bounds: minimum values of constrained axes
+        high_bound: maximum values of constrained axes
+        store: accessor to the hkl object.
+        collection: collection within which the hkl object resides.
+
+    Returns:
+        ScanJobResponse containing the id of the job running the scan.
+    """
+    solution_constraints = SolutionConstraints(axes, low_bound, high_bound)
+    if not solution_constraints.valid:
+        raise InvalidSolutionBoundsError(solution_constraints.msg)
+    if constraint not in ALL_CONSTRAINTS:
+        raise InvalidConstraintError(constraint)
 
-    scan_results = await service.scan_constraint(
+    scan = await service.stream_scan_constraint(
         name,
         constraint,
         start,
@@ -226,5 +648,66 @@ async def scan_constraint(
         store,
         collection,
     )
+    return ScanJobResponse(payload=jobs.submit(scan, len(scan)).model())
+
+
+@router.get("/{name}/scan/{constraint}/trajectory", response_model=TrajectoryResponse)
+async def scan_constraint_trajectory(
+    name: str,
+    constraint: str,
+    start: float = Query(..., example=1),
+    stop: float = Query(..., example=4),
+    inc: float = Query(..., example=1),
+    hkl: HklModel = Depends(),
+    wavelength: float = Query(..., example=1.0),
+    max_jump: float = Query(default=10.0, gt=0, example=10.0),
+    axes: Optional[List[str]] = Query(default=None, example=["mu", "nu", "phi"]),
+    low_bound: Optional[List[float]] = Query(default=None, example=[0.0, 0.0, -90.0]),
+    high_bound: Optional[List[float]] = Query(default=None, example=[90.0, 90.0, 90.0]),
+    store: HklCalcStore = Depends(get_store),
+    collection: Optional[str] = Query(default=None, example="B07"),
+):
+    """Follow one continuous diffractometer trajectory while scanning a constraint.
+
+    Args:
+        name: the name of the hkl object to access within the store
+        constraint: the name of the constraint to use.
+        start: constraint to start at
+        stop: constraint to stop at
+        inc: constraint to increment by
+        hkl: desired miller indices to use for the experiment
+        wavelength: wavelength of light used in the experiment
+        max_jump: largest change in any angle, in degrees, between neighbouring
+            constraint values before flagging a branch switch
+        axes: angles to constrain the solutions by
+        low_bounds: minimum values of constrained axes
+        high_bound: maximum values of constrained axes
+        store: accessor to the hkl object.
+        collection: collection within which the hkl object resides.
+
+    Returns:
+        TrajectoryResponse containing one diffractometer position for each
+        constraint value, and the constraint values where the trajectory switches
+        between branches of solutions.
+    """
+    solution_constraints = SolutionConstraints(axes, low_bound, high_bound)
+    if not solution_constraints.valid:
+        raise InvalidSolutionBoundsError(solution_constraints.msg)
+    if constraint not in ALL_CONSTRAINTS:
+        raise InvalidConstraintError(constraint)
 
-    return ScanResponse(payload=scan_results)
+    with admission.admit(service.count_axis_points(start, stop, inc), collection):
+        trajectory = await service.scan_constraint_trajectory(
+            name,
+            constraint,
+            start,
+            stop,
+            inc,
+            hkl,
+            wavelength,
+            solution_constraints,
+            max_jump,
+            store,
+            collection,
+        )
+    return TrajectoryResponse(payload=trajectory)
@@ -0,0 +1,65 @@
+"""Endpoints for following scans running in the background.
+
+Scans are submitted as jobs by the POST /hkl/{name}/scan/ endpoints.
+"""
+
+from fastapi import APIRouter, Query
+
+from diffcalc_api import jobs
+from diffcalc_api.models.response import ScanJobResponse, ScanResponse
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+@router.get("/{job_id}", response_model=ScanJobResponse)
+async def get_job(job_id: str):
+    """Get the progress of a background scan.
+
+    Args:
+        job_id: the id returned when the scan was submitted
+
+    Returns:
+        ScanJobResponse containing the status of the job, and the number of scan
+        points solved so far.
+    """
+    return ScanJobResponse(payload=jobs.get(job_id).model())
+
+
+@router.get("/{job_id}/results", response_model=ScanResponse)
+async def get_job_results(
+    job_id: str,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=1000, gt=0),
+):
+    """Get a page of the results of a background scan.
+
+    Results are available as soon as each scan point is solved, so pages of a
+    running job may be partial.
+
+    Args:
+        job_id: the id returned when the scan was submitted
+        offset: number of scan points to skip
+        limit: maximum number of scan points to return
+
+    Returns:
+        ScanResponse containing a dictionary of each scan point in the page and its
+        possible diffractometer positions.
+    """
+    return ScanResponse(payload=jobs.get(job_id).page(offset, limit))
+
+
+@router.delete("/{job_id}", response_model=ScanJobResponse)
+async def cancel_job(job_id: str):
+    """Cancel a background scan, once the point being solved is finished.
+
+    Results solved so far are kept until the job expires.
+
+    Args:
+        job_id: the id returned when the scan was submitted
+
+    Returns:
+        ScanJobResponse containing the status of the job.
+    """
+    job = jobs.get(job_id)
+    job.cancel()
+    return ScanJobResponse(payload=job.model())
@@ -0,0 +1,48 @@
+"""Endpoints exposing runtime metrics, for monitoring and sizing deployments."""
+
+from fastapi import APIRouter
+
+from diffcalc_api import admission, database, executors, scan_cache
+from diffcalc_api.models.response import MetricsResponse
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/executors", response_model=MetricsResponse)
+async def get_executor_metrics():
+    """Get queue depth and wait times of the executors running diffcalc-core calls.
+
+    Returns:
+        MetricsResponse containing statistics for each executor in use.
+    """
+    return MetricsResponse(payload=executors.metrics())
+
+
+@router.get("/scans", response_model=MetricsResponse)
+async def get_scan_metrics():
+    """Get statistics on the scan cache, and on admission of scans.
+
+    Returns:
+        MetricsResponse containing statistics for the scan cache, admission counts
+        with the estimated seconds to solve a point, and the estimated seconds of
+        scans currently running in each collection.
+    """
+    decisions, in_flight = admission.metrics()
+    return MetricsResponse(
+        payload={
+            "cache": scan_cache.metrics(),
+            "admission": decisions,
+            "in_flight": in_flight,
+        }
+    )
+
+
+@router.get("/mongo", response_model=MetricsResponse)
+async def get_mongo_metrics():
+    """Get use of the mongo connection pool, for sizing pools and replicas.
+
+    Returns:
+        MetricsResponse containing the size of the pool, connections open, in use
+        and waiting, and how long checkouts waited for a connection.
+    """
+    return MetricsResponse(payload=database.metrics())
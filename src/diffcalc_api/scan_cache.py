@@ -0,0 +1,220 @@
+"""In-memory cache of scan results, for scans which are repeated unchanged.
+
+Results are keyed by the crystal they were solved for, a hash of the serialized
+HklCalculation object, and a hash of the scan parameters. Saving any change to the
+object changes its hash, so stale results are never returned. They are also
+dropped as soon as the changed object is next scanned.
+
+The cache holds at most scan_cache_max_points scan points in total, evicting the
+least recently used results first. Setting it to zero disables the cache.
+
+Results can also be kept in a cache shared between replicas, see use_shared, so
+that a scan solved by one replica is not solved again by the others. Local results
+for a crystal are dropped whenever any replica publishes that it has changed.
+"""
+
+import hashlib
+import json
+import pickle
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from diffcalc.hkl.calc import HklCalculation
+
+from diffcalc_api.config import settings
+from diffcalc_api.stores.shared import (
+    INVALIDATION_CHANNEL,
+    SharedCache,
+    parse_invalidation,
+)
+
+ScanResults = Dict[str, List[Dict[str, float]]]
+
+# collection, name, hash of the object, hash of the scan parameters
+CacheKey = Tuple[str, str, str, str]
+
+_cache: "OrderedDict[CacheKey, ScanResults]" = OrderedDict()
+_states: Dict[Tuple[str, str], str] = {}
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "shared_hits": 0}
+# number of scan points in _cache, kept up to date as results come and go
+_points = 0
+
+_shared: Optional[SharedCache] = None
+_shared_ttl = 0.0
+_subscribed = False
+
+
+def key(
+    hklcalc: HklCalculation, name: str, collection: Optional[str], *params: Any
+) -> CacheKey:
+    """Build the key results of a scan are cached under.
+
+    Args:
+        hklcalc: the hkl object the scan is solved with
+        name: the name of the hkl object within the store
+        collection: the collection inside which it is stored.
+        params: every parameter which changes the results of the scan
+
+    Returns:
+        The key.
+    """
+    state = hashlib.sha256(pickle.dumps(hklcalc)).hexdigest()
+    scan = hashlib.sha256(repr(params).encode()).hexdigest()
+    return (collection if collection else "default", name, state, scan)
+
+
+def get(cache_key: CacheKey) -> Optional[ScanResults]:
+    """Retrieve cached scan results.
+
+    Returned results are shared with the cache, and must not be modified.
+
+    Args:
+        cache_key: the key from diffcalc_api.scan_cache.key
+
+    Returns:
+        The results, or None if they are not cached.
+    """
+    results = _cache.get(cache_key)
+    if results is None:
+        _stats["misses"] += 1
+        return None
+
+    _stats["hits"] += 1
+    _cache.move_to_end(cache_key)
+    return results
+
+
+def _drop(cache_key: CacheKey) -> None:
+    global _points
+    _points -= len(_cache.pop(cache_key))
+
+
+def put(cache_key: CacheKey, results: ScanResults) -> None:
+    """Cache the results of a scan.
+
+    Results cached for an earlier state of the same hkl object are dropped.
+
+    Args:
+        cache_key: the key from diffcalc_api.scan_cache.key
+        results: dictionary of each scan point and its possible positions
+    """
+    global _points
+
+    collection, name, state, _ = cache_key
+    if _states.get((collection, name), state) != state:
+        for stale in [k for k in _cache if k[:2] == (collection, name)]:
+            _drop(stale)
+    _states[(collection, name)] = state
+
+    if len(results) > settings.scan_cache_max_points:
+        return
+
+    if cache_key in _cache:
+        _drop(cache_key)
+    _cache[cache_key] = results
+    _points += len(results)
+    while _points > settings.scan_cache_max_points:
+        _drop(next(iter(_cache)))
+        _stats["evictions"] += 1
+
+
+def use_shared(cache: Optional[SharedCache], ttl: float = 300.0) -> None:
+    """Keep scan results in a cache shared between replicas, as well as locally.
+
+    Args:
+        cache: the shared cache, or None to stop using one
+        ttl: number of seconds results are kept in the shared cache
+    """
+    global _shared, _shared_ttl, _subscribed
+    _shared, _shared_ttl, _subscribed = cache, ttl, False
+
+
+def _shared_key(cache_key: CacheKey) -> str:
+    return "diffcalc:scan:" + json.dumps(list(cache_key))
+
+
+def _invalidated(message: str) -> None:
+    name, collection = parse_invalidation(message)
+    invalidate(name, collection)
+
+
+async def fetch(cache_key: CacheKey) -> Optional[ScanResults]:
+    """Retrieve cached scan results, from the shared cache if not held locally.
+
+    Returned results are shared with the cache, and must not be modified.
+
+    Args:
+        cache_key: the key from diffcalc_api.scan_cache.key
+
+    Returns:
+        The results, or None if they are not cached.
+    """
+    global _subscribed
+    results = get(cache_key)
+    if results is not None or _shared is None:
+        return results
+
+    if not _subscribed:
+        _subscribed = True
+        await _shared.subscribe(INVALIDATION_CHANNEL, _invalidated)
+
+    blob = await _shared.get(_shared_key(cache_key))
+    if blob is None:
+        return None
+
+    _stats["shared_hits"] += 1
+    results = json.loads(blob)
+    put(cache_key, results)
+    return results
+
+
+async def keep(cache_key: CacheKey, results: ScanResults) -> None:
+    """Cache the results of a scan locally, and in the shared cache if in use.
+
+    Args:
+        cache_key: the key from diffcalc_api.scan_cache.key
+        results: dictionary of each scan point and its possible positions
+    """
+    put(cache_key, results)
+    if _shared is not None and len(results) <= settings.scan_cache_max_points:
+        await _shared.set(
+            _shared_key(cache_key), json.dumps(results).encode(), _shared_ttl
+        )
+
+
+def invalidate(name: str, collection: Optional[str]) -> None:
+    """Drop the results cached locally for a crystal.
+
+    Args:
+        name: the name of the hkl object within the store
+        collection: the collection inside which it is stored.
+    """
+    crystal = (collection if collection else "default", name)
+    for stale in [k for k in _cache if k[:2] == crystal]:
+        _drop(stale)
+    _states.pop(crystal, None)
+
+
+def points() -> int:
+    """Number of scan points currently cached."""
+    return _points
+
+
+def clear() -> None:
+    """Remove all cached results, and reset the statistics."""
+    global _points
+
+    _cache.clear()
+    _points = 0
+    _states.clear()
+    for stat in _stats:
+        _stats[stat] = 0
+
+
+def metrics() -> Dict[str, float]:
+    """Summarise how well the cache is performing.
+
+    Returns:
+        Dictionary of hit, miss and eviction counts, and the current size.
+    """
+    return {**_stats, "entries": len(_cache), "points": points()}
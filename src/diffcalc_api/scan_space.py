@@ -0,0 +1,143 @@
+"""Lazy sequences of scan points, whose sizes are known before any are generated.
+
+ScanAxis reproduces numpy.arange(start, stop + inc, inc) exactly for floats, value
+for value, without allocating an array. ScanGrid is the cartesian product of
+several axes, in the order of itertools.product. Both compute their length
+arithmetically, so scans can be sized, and rejected, before any work is done.
+"""
+
+import math
+from itertools import product
+from typing import Iterator, List, Sequence, Tuple, Union, overload
+
+
+class ScanAxis(Sequence[float]):
+    """Evenly spaced values from start to stop inclusive, in increments of inc."""
+
+    def __init__(self, start: float, stop: float, inc: float) -> None:
+        """Size the axis, without generating any values.
+
+        Args:
+            start: value to start at
+            stop: value to stop at, included if reached exactly
+            inc: value to increment by
+        """
+        self.start = float(start)
+        self.stop = float(stop)
+        self.inc = float(inc)
+        self._length = self._arange_length(self.start, self.stop + self.inc, self.inc)
+        # numpy.arange fills every value after the second from these two
+        self._second = self.start + self.inc
+        self._delta = self._second - self.start
+
+    @staticmethod
+    def _arange_length(start: float, stop: float, step: float) -> int:
+        """Number of values numpy.arange would generate, or 0 if it cannot."""
+        if step == 0:
+            return 0
+
+        delta = stop - start
+        length = delta / step
+        if length == 0.0 and delta != 0.0:
+            return 0 if math.copysign(1.0, length) < 0 else 1
+        if not math.isfinite(length):
+            return 0
+
+        return max(0, math.ceil(length))
+
+    @property
+    def size(self) -> int:
+        """Number of values on the axis, even if too large for len()."""
+        return self._length
+
+    def __len__(self) -> int:
+        """Number of values on the axis."""
+        return self._length
+
+    def _value(self, i: int) -> float:
+        if i == 0:
+            return self.start
+        if i == 1:
+            return self._second
+        return self.start + i * self._delta
+
+    @overload
+    def __getitem__(self, index: int) -> float: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[float]: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[float, List[float]]:
+        """Get one value, or a list of values for a slice."""
+        if isinstance(index, slice):
+            return [self._value(i) for i in range(*index.indices(self._length))]
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("scan axis index out of range")
+        return self._value(index)
+
+    def __iter__(self) -> Iterator[float]:
+        """Generate each value in turn."""
+        return (self._value(i) for i in range(self._length))
+
+
+def _size(axis: Sequence[float]) -> int:
+    """Number of values on an axis, without calling len() on a ScanAxis."""
+    return axis.size if isinstance(axis, ScanAxis) else len(axis)
+
+
+class ScanGrid(Sequence[Tuple[float, ...]]):
+    """Every combination of the values of several axes.
+
+    The last axis varies fastest, as with itertools.product.
+    """
+
+    def __init__(self, *axes: Sequence[float]) -> None:
+        """Size the grid, without generating any points.
+
+        Args:
+            axes: the values of each axis
+        """
+        self.axes = axes
+        self._length = math.prod(_size(axis) for axis in axes)
+
+    @property
+    def size(self) -> int:
+        """Number of points in the grid, even if too large for len()."""
+        return self._length
+
+    def __len__(self) -> int:
+        """Number of points in the grid."""
+        return self._length
+
+    def _point(self, i: int) -> Tuple[float, ...]:
+        point = []
+        for axis in reversed(self.axes):
+            i, j = divmod(i, len(axis))
+            point.append(axis[j])
+        return tuple(reversed(point))
+
+    @overload
+    def __getitem__(self, index: int) -> Tuple[float, ...]: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Tuple[float, ...]]: ...
+
+    def __getitem__(
+        self, index: Union[int, slice]
+    ) -> Union[Tuple[float, ...], List[Tuple[float, ...]]]:
+        """Get one point, or a list of points for a slice."""
+        if isinstance(index, slice):
+            return [self._point(i) for i in range(*index.indices(self._length))]
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("scan grid index out of range")
+        return self._point(index)
+
+    def __iter__(self) -> Iterator[Tuple[float, ...]]:
+        """Generate each point in turn."""
+        return product(*self.axes)
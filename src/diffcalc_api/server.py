@@ -1,23 +1,49 @@
 """Startup script for the API server."""
 import logging
 import traceback
-from typing import Optional
+from typing import Any, Optional, Tuple
 
 from diffcalc.util import DiffcalcException
 from fastapi import Depends, FastAPI, Query, Request, responses
 
-from diffcalc_api import routes
+from diffcalc_api import executors, jobs, routes, scan_cache
 from diffcalc_api.config import Settings
+from diffcalc_api.errors.collections import responses as collections_responses
 from diffcalc_api.errors.constraints import responses as constraints_responses
 from diffcalc_api.errors.definitions import DiffcalcAPIException
 from diffcalc_api.errors.hkl import responses as hkl_responses
+from diffcalc_api.errors.jobs import responses as jobs_responses
 from diffcalc_api.errors.ub import responses as ub_responses
 from diffcalc_api.models.response import InfoResponse
-from diffcalc_api.stores.protocol import get_store, setup_store
+from diffcalc_api.stores import shared
+from diffcalc_api.stores.protocol import close_store, get_store, setup_store
 
 logger = logging.getLogger(__name__)
 config = Settings()
-setup_store("diffcalc_api.stores.mongo.MongoHklCalcStore")
+store_args: Tuple[Any, ...] = (
+    "diffcalc_api.stores.mongo.MongoHklCalcStore",
+    config.store_binary,
+)
+if config.shared_cache_url:
+    store_args = (
+        "diffcalc_api.stores.shared.SharedCachingHklCalcStore",
+        store_args[0],
+        config.shared_cache_url,
+        config.shared_cache_ttl,
+        *store_args[1:],
+    )
+    scan_cache.use_shared(
+        shared.connect(config.shared_cache_url), config.shared_cache_ttl
+    )
+if config.cache_max_size > 0:
+    store_args = (
+        "diffcalc_api.stores.caching.CachingHklCalcStore",
+        store_args[0],
+        config.cache_max_size,
+        config.cache_ttl,
+        *store_args[1:],
+    )
+setup_store(*store_args)
 
 app = FastAPI(
     responses=get_store().responses, title="diffcalc", version=config.api_version
@@ -26,6 +52,18 @@ app = FastAPI(
 app.include_router(routes.ub.router, responses=ub_responses)
 app.include_router(routes.constraints.router, responses=constraints_responses)
 app.include_router(routes.hkl.router, responses=hkl_responses)
+app.include_router(routes.jobs.router, responses=jobs_responses)
+app.include_router(routes.metrics.router)
+app.include_router(routes.collections.router, responses=collections_responses)
+
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    """Stop background jobs, worker processes and the store when the server stops."""
+    jobs.shutdown()
+    executors.shutdown()
+    close_store()
+
 
 #######################################################################################
 #                              Middleware for Exceptions                              #
@@ -1,5 +1,5 @@
 """Defines business logic for all endpoints, separately from the API logic."""
 
-from diffcalc_api.services import constraints, hkl, ub
+from diffcalc_api.services import collections, constraints, hkl, ub
 
-__all__ = ["ub", "hkl", "constraints"]
+__all__ = ["ub", "hkl", "constraints", "collections"]
@@ -0,0 +1,231 @@
+"""Business logic for handling requests from collections endpoints.
+
+Collections are exported as gzip compressed tar archives, holding one file per
+crystal, named after the crystal, in the format of diffcalc_api.stores.serialization.
+
+Imported archives are spooled to a temporary file rather than held in memory, and
+are rejected once they, or the crystals unpacked from them, exceed the
+import_max_size setting in bytes. Each crystal is also limited to
+import_max_member_size bytes.
+"""
+
+import io
+import tarfile
+from tempfile import SpooledTemporaryFile
+from typing import IO, AsyncIterable, AsyncIterator, List, Optional, Sequence, Tuple
+
+from diffcalc.hkl.calc import HklCalculation
+
+from diffcalc_api import executors
+from diffcalc_api.config import settings
+from diffcalc_api.errors.collections import ArchiveTooLargeError, InvalidArchiveError
+from diffcalc_api.models.collections import (
+    CollectionPage,
+    CrystalSummary,
+    ImportSummary,
+)
+from diffcalc_api.stores import serialization
+from diffcalc_api.stores.protocol import HklCalcStore
+
+# number of crystals loaded from the store at once while exporting
+EXPORT_PAGE_SIZE = 100
+# number of crystals written to the store at once while importing
+IMPORT_BATCH_SIZE = 100
+# number of bytes of an imported archive held in memory before spooling to disk
+IMPORT_SPOOL_SIZE = 1024 * 1024
+
+
+async def list_crystals(
+    store: HklCalcStore, collection: str, after: Optional[str], limit: int
+) -> CollectionPage:
+    """List a page of the crystals in a collection, in order of name.
+
+    Args:
+        store: accessor to the hkl objects
+        collection: the collection to list
+        after: only list crystals whose name comes after this one
+        limit: maximum number of crystals to list
+
+    Returns:
+        The page, with the cursor of the next page if there may be more crystals.
+    """
+    page = await store.list_ubcalcs(collection, after, limit)
+    crystals = [
+        CrystalSummary(
+            name=name,
+            revision=revision,
+            crystal=ubcalc.crystal.name if ubcalc.crystal is not None else None,
+            has_u_matrix=ubcalc.U is not None,
+        )
+        for name, ubcalc, revision in page
+    ]
+    return CollectionPage(
+        crystals=crystals, next=page[-1][0] if len(page) == limit else None
+    )
+
+
+def _drain(buffer: io.BytesIO) -> bytes:
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+def _archive_page(
+    archive: tarfile.TarFile,
+    buffer: io.BytesIO,
+    page: Sequence[Tuple[str, HklCalculation]],
+) -> bytes:
+    """Add a page of crystals to an archive, returning the compressed bytes so far."""
+    for name, hkl in page:
+        data = serialization.dumps(hkl)
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        archive.addfile(info, io.BytesIO(data))
+    return _drain(buffer)
+
+
+async def export_collection(
+    store: HklCalcStore, collection: str
+) -> AsyncIterator[bytes]:
+    """Export every crystal in a collection, as a compressed archive.
+
+    Crystals are loaded and compressed a page at a time, so the archive is never
+    held in memory as a whole.
+
+    Args:
+        store: accessor to the hkl objects
+        collection: the collection to export
+
+    Yields:
+        Successive chunks of the gzip compressed tar archive.
+    """
+    buffer = io.BytesIO()
+    archive = tarfile.open(fileobj=buffer, mode="w|gz")
+    after: Optional[str] = None
+    while True:
+        page = await store.load_many(collection, after, EXPORT_PAGE_SIZE)
+        chunk = await executors.run(
+            "collections.export",
+            _archive_page,
+            archive,
+            buffer,
+            page,
+            allow_process=False,
+        )
+        if chunk:
+            yield chunk
+        if len(page) < EXPORT_PAGE_SIZE:
+            break
+        after = page[-1][0]
+
+    archive.close()
+    yield _drain(buffer)
+
+
+async def spool_archive(chunks: AsyncIterable[bytes]) -> IO[bytes]:
+    """Spool an uploaded archive to a temporary file, kept in memory while small.
+
+    Args:
+        chunks: successive chunks of the archive, as they are received
+
+    Returns:
+        The temporary file, positioned at the start of the archive. The caller must
+        close it.
+    """
+    spooled = SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE)
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > settings.import_max_size:
+                raise ArchiveTooLargeError("archive", settings.import_max_size)
+            spooled.write(chunk)
+    except BaseException:
+        spooled.close()
+        raise
+
+    spooled.seek(0)
+    return spooled
+
+
+def _read_archive(fileobj: IO[bytes]) -> List[Tuple[str, bytes]]:
+    """Read the name and serialized crystal of every file in an archive."""
+    members = []
+    unpacked = 0
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r:*") as archive:
+            for member in archive:
+                name = member.name
+                if not member.isfile():
+                    raise InvalidArchiveError(f"{name} is not a file")
+                if not name or name.startswith(".") or "/" in name or "\\" in name:
+                    raise InvalidArchiveError(f"{name} is not a valid crystal name")
+                if member.size > settings.import_max_member_size:
+                    raise ArchiveTooLargeError(name, settings.import_max_member_size)
+                unpacked += member.size
+                if unpacked > settings.import_max_size:
+                    raise ArchiveTooLargeError(
+                        "unpacked archive", settings.import_max_size
+                    )
+
+                stream = archive.extractfile(member)
+                assert stream is not None
+                members.append((name, stream.read()))
+    except (tarfile.TarError, EOFError, OSError) as e:
+        raise InvalidArchiveError(str(e))
+    return members
+
+
+def _decode(members: Sequence[Tuple[str, bytes]]) -> List[Tuple[str, HklCalculation]]:
+    calcs = []
+    for name, data in members:
+        try:
+            hkl = serialization.loads(data)
+        except ValueError as e:
+            raise InvalidArchiveError(f"{name} is not a serialized crystal: {e}")
+        # crystals are renamed by renaming their file in the archive
+        hkl.ubcalc.name = name
+        calcs.append((name, hkl))
+    return calcs
+
+
+async def import_collection(
+    store: HklCalcStore, collection: str, fileobj: IO[bytes]
+) -> ImportSummary:
+    """Import every crystal in an archive produced by export_collection.
+
+    The archive is read and decoded in full before anything is imported, so that a
+    malformed archive imports nothing. Crystals are then written to the store in
+    batches, with one bulk write per batch. Each crystal takes the name of its file
+    in the archive.
+
+    Args:
+        store: accessor to the hkl objects
+        collection: the collection to import into
+        fileobj: the gzip compressed tar archive, as spooled by spool_archive
+
+    Returns:
+        The number of crystals imported, and the names of those which already
+        existed and were skipped.
+    """
+    members = await executors.run(
+        "collections.import", _read_archive, fileobj, allow_process=False
+    )
+
+    calcs: List[Tuple[str, HklCalculation]] = []
+    for start in range(0, len(members), IMPORT_BATCH_SIZE):
+        calcs += await executors.run(
+            "collections.import",
+            _decode,
+            members[start : start + IMPORT_BATCH_SIZE],
+            allow_process=False,
+        )
+
+    skipped: List[str] = []
+    for start in range(0, len(calcs), IMPORT_BATCH_SIZE):
+        skipped += await store.create_many(
+            collection, calcs[start : start + IMPORT_BATCH_SIZE]
+        )
+
+    return ImportSummary(imported=len(calcs) - len(skipped), skipped=skipped)
@@ -1,14 +1,50 @@
 """Defines business logic for handling requests from hkl endpoints."""
 
-from itertools import product
-from typing import Dict, List, Optional, Tuple
+import asyncio
+import io
+import pickle
+import time
+from functools import partial
+from math import ceil
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import numpy as np
+from diffcalc.hkl.calc import HklCalculation
 from diffcalc.hkl.geometry import Position
+from diffcalc.util import DiffcalcException
 
-from diffcalc_api.errors.hkl import InvalidMillerIndicesError, InvalidScanBoundsError
-from diffcalc_api.models.hkl import SolutionConstraints
+from diffcalc_api import admission, executors, scan_cache
+from diffcalc_api.config import settings
+from diffcalc_api.errors.hkl import (
+    InvalidBatchError,
+    InvalidMillerIndicesError,
+    InvalidScanBoundsError,
+    ScanTooLargeError,
+)
+from diffcalc_api.errors.ub import NoUbMatrixError
+from diffcalc_api.models.hkl import (
+    BatchLabPositionParams,
+    BatchMillerIndicesParams,
+    ColumnarMillerIndices,
+    ColumnarPositions,
+    ColumnarScan,
+    ScanTrajectory,
+    SolutionConstraints,
+)
 from diffcalc_api.models.ub import HklModel, PositionModel
+from diffcalc_api.scan_space import ScanAxis, ScanGrid
 from diffcalc_api.stores.protocol import HklCalcStore
 
 
@@ -33,17 +69,118 @@ async def lab_position_from_miller_indices(
     Returns:
         A list of all possible diffractometer positions
     """
-    hklcalc = await store.load(name, collection)
+    hklcalc = await store.load(name, collection, readonly=True)
 
     if all([idx == 0 for idx in miller_indices]):
         raise InvalidMillerIndicesError()
 
-    all_positions = hklcalc.get_position(*miller_indices.dict().values(), wavelength)
+    all_positions = await executors.run(
+        "hkl.position",
+        hklcalc.get_position,
+        *miller_indices.dict().values(),
+        wavelength,
+    )
     result = combine_lab_position_results(all_positions, solution_constraints)
 
     return result
 
 
+async def lab_positions_from_miller_indices_batch(
+    name: str,
+    params: BatchLabPositionParams,
+    solution_constraints: SolutionConstraints,
+    store: HklCalcStore,
+    collection: Optional[str],
+) -> ColumnarPositions:
+    """Convert many sets of miller indices to diffractometer positions.
+
+    The hkl object is loaded once for the whole batch. Miller indices which cannot
+    be converted are reported individually, without failing the rest of the batch.
+
+    Args:
+        name: the name of the hkl object to access within the store
+        params: miller indices to be converted, and their wavelengths
+        solution_constraints: object containings angles to constrain solutions by
+        store: accessor to the hkl object
+        collection: collection within which the hkl object resides
+
+    Returns:
+        All possible diffractometer positions, stored by column.
+    """
+    if (params.wavelength is None) == (params.wavelengths is None):
+        raise InvalidBatchError("provide exactly one of wavelength or wavelengths.")
+
+    wavelengths = (
+        params.wavelengths
+        if params.wavelengths is not None
+        else [params.wavelength] * len(params.hkl)
+    )
+    if len(wavelengths) != len(params.hkl):
+        raise InvalidBatchError("hkl and wavelengths are not the same length.")
+
+    hklcalc = await store.load(name, collection, readonly=True)
+
+    return await executors.run(
+        "hkl.batch",
+        solve_batch_lab_positions,
+        hklcalc,
+        params.hkl,
+        wavelengths,
+        solution_constraints,
+    )
+
+
+def solve_batch_lab_positions(
+    hklcalc: HklCalculation,
+    miller_indices_list: List[Tuple[float, float, float]],
+    wavelengths: List[float],
+    solution_constraints: SolutionConstraints,
+) -> ColumnarPositions:
+    """Convert many sets of miller indices, collecting solutions by column.
+
+    Args:
+        hklcalc: the hkl object to solve with
+        miller_indices_list: miller indices to be converted
+        wavelengths: wavelength to use for each set of miller indices
+        solution_constraints: object containings angles to constrain solutions by
+
+    Returns:
+        All possible diffractometer positions, stored by column.
+    """
+    index: List[int] = []
+    angles: Dict[str, List[float]] = {}
+    errors: Dict[int, str] = {}
+
+    solved: List[int] = []
+    results: List[List[Tuple[Position, Dict[str, float]]]] = []
+    for i, (miller_indices, wavelength) in enumerate(
+        zip(miller_indices_list, wavelengths)
+    ):
+        if all([idx == 0 for idx in miller_indices]):
+            errors[i] = InvalidMillerIndicesError().detail
+            continue
+
+        try:
+            results.append(hklcalc.get_position(*miller_indices, wavelength))
+        except DiffcalcException as e:
+            errors[i] = str(e)
+            continue
+        except Exception as e:  # numerical failures, e.g. a zero wavelength
+            errors[i] = f"{type(e).__name__}: {e}"
+            continue
+        solved.append(i)
+
+    for i, solutions in zip(
+        solved, filter_lab_position_results(results, solution_constraints)
+    ):
+        for solution in solutions:
+            index.append(i)
+            for angle, value in solution.items():
+                angles.setdefault(angle, []).append(value)
+
+    return ColumnarPositions(index=index, angles=angles, errors=errors)
+
+
 async def miller_indices_from_lab_position(
     name: str,
     pos: PositionModel,
@@ -63,11 +200,77 @@ async def miller_indices_from_lab_position(
     Returns:
         Object containing converted lab position
     """
-    hklcalc = await store.load(name, collection)
-    hkl = np.round(hklcalc.get_hkl(Position(**pos.dict()), wavelength), 16)
+    hklcalc = await store.load(name, collection, readonly=True)
+    hkl = np.round(
+        await executors.run(
+            "hkl.position", hklcalc.get_hkl, Position(**pos.dict()), wavelength
+        ),
+        16,
+    )
     return HklModel(h=hkl[0], k=hkl[1], l=hkl[2])
 
 
+async def miller_indices_from_lab_positions_batch(
+    name: str,
+    params: BatchMillerIndicesParams,
+    store: HklCalcStore,
+    collection: Optional[str],
+) -> ColumnarMillerIndices:
+    """Convert many diffractometer positions to miller indices at once.
+
+    Rather than converting each position through diffcalc-core, the rotation
+    matrices of every position are stacked and multiplied together in numpy,
+    following the same conventions as HklCalculation.get_hkl.
+
+    Args:
+        name: the name of the hkl object to access within the store
+        params: diffractometer positions to be converted, and their wavelengths
+        store: accessor to the hkl object.
+        collection: collection within which the hkl object resides.
+
+    Returns:
+        Object containing the miller indices of every position, stored by column.
+    """
+    angles = [params.mu, params.delta, params.nu, params.eta, params.chi, params.phi]
+    if len({len(values) for values in angles}) != 1:
+        raise InvalidBatchError("all diffractometer angles must be the same length.")
+
+    if (params.wavelength is None) == (params.wavelengths is None):
+        raise InvalidBatchError("provide exactly one of wavelength or wavelengths.")
+
+    wavelengths = np.asarray(
+        params.wavelengths if params.wavelengths is not None else params.wavelength,
+        dtype=float,
+    )
+    if wavelengths.ndim and len(wavelengths) != len(params.mu):
+        raise InvalidBatchError("angles and wavelengths are not the same length.")
+    if not np.all(wavelengths > 0):
+        raise InvalidBatchError("wavelengths must be greater than zero.")
+
+    hklcalc = await store.load(name, collection, readonly=True)
+    if hklcalc.ubcalc.UB is None:
+        raise NoUbMatrixError()
+
+    mu, delta, nu, eta, chi, phi = np.radians(np.array(angles, dtype=float))
+    hkl = await executors.run(
+        "hkl.batch",
+        hkl_from_angles,
+        mu,
+        delta,
+        nu,
+        eta,
+        chi,
+        phi,
+        wavelengths,
+        hklcalc.ubcalc.UB,
+    )
+    hkl = np.round(hkl, 16)
+
+    return ColumnarMillerIndices(
+        h=hkl[:, 0].tolist(), k=hkl[:, 1].tolist(), l=hkl[:, 2].tolist()
+    )
+
+
 async def scan_hkl(
     name: str,
     start: List[float],
@@ -94,31 +297,32 @@ async def scan_hkl(
         Dictionary of each set of miller indices and their possible diffractometer
         positions.
     """
-    hklcalc = await store.load(name, collection)
-
-    if (len(start) != 3) or (len(stop) != 3) or (len(inc) != 3):
-        raise InvalidMillerIndicesError(
-            "start, stop and inc must have three floats for each miller index."
-        )
-
-    axes_values = [
-        generate_axis(start[i], stop[i], inc[i]) if inc[i] != 0 else [0]
-        for i in range(3)
-    ]
-
-    results = {}
+    hklcalc = await store.load(name, collection, readonly=True)
+    points = generate_hkl_points(start, stop, inc)
 
-    for h, k, l in product(*axes_values):
-        if all([idx == 0 for idx in (h, k, l)]):
-            raise InvalidMillerIndicesError(
-                "choose a hkl range that does not cross through [0, 0, 0]"
-            )  # is this good enough? do people need scans through 0,0,0?
+    cache_key = scan_cache.key(
+        hklcalc,
+        name,
+        collection,
+        "hkl",
+        start,
+        stop,
+        inc,
+        wavelength,
+        solution_constraints,
+    )
+    cached = await scan_cache.fetch(cache_key)
+    if cached is not None:
+        return cached
 
-        all_positions = hklcalc.get_position(h, k, l, wavelength)
-        results[f"({h}, {k}, {l})"] = combine_lab_position_results(
-            all_positions, solution_constraints
-        )
+    started = time.perf_counter()
+    solutions = await solve_hkl_points(
+        hklcalc, points, wavelength, solution_constraints
+    )
+    admission.record(len(points), time.perf_counter() - started)
 
+    results = {hkl_key(point): positions for point, positions in zip(points, solutions)}
+    await scan_cache.keep(cache_key, results)
     return results
 
 
@@ -148,21 +352,43 @@ async def scan_wavelength(
         Dictionary of each wavelength and the corresponding possible diffractometer
         positions.
     """
-    hklcalc = await store.load(name, collection)
+    hklcalc = await store.load(name, collection, readonly=True)
 
-    if len(np.arange(start, stop + inc, inc)) == 0:
-        raise InvalidScanBoundsError(start, stop, inc)
+    wavelengths = generate_axis(start, stop, inc)
+    miller_indices = tuple(hkl.dict().values())
 
-    wavelengths = np.arange(start, stop + inc, inc)
-    result = {}
+    cache_key = scan_cache.key(
+        hklcalc,
+        name,
+        collection,
+        "wavelength",
+        start,
+        stop,
+        inc,
+        miller_indices,
+        solution_constraints,
+    )
+    cached = await scan_cache.fetch(cache_key)
+    if cached is not None:
+        return cached
 
-    for wavelength in wavelengths:
-        all_positions = hklcalc.get_position(*hkl.dict().values(), wavelength)
-        result[f"{wavelength}"] = combine_lab_position_results(
-            all_positions, solution_constraints
-        )
+    started = time.perf_counter()
+    solutions = await executors.run(
+        "hkl.scan",
+        solve_wavelength_points,
+        hklcalc,
+        miller_indices,
+        wavelengths,
+        solution_constraints,
+    )
+    admission.record(len(wavelengths), time.perf_counter() - started)
 
-    return result
+    results = {
+        f"{wavelength}": positions
+        for wavelength, positions in zip(wavelengths, solutions)
+    }
+    await scan_cache.keep(cache_key, results)
+    return results
 
 
 async def scan_constraint(
@@ -197,22 +423,595 @@ async def scan_constraint(
     """
     hklcalc = await store.load(name, collection)
 
-    if len(np.arange(start, stop + inc, inc)) == 0:
-        raise InvalidScanBoundsError(start, stop, inc)
+    values = generate_axis(start, stop, inc)
+    miller_indices = tuple(hkl.dict().values())
+
+    cache_key = scan_cache.key(
+        hklcalc,
+        name,
+        collection,
+        constraint,
+        start,
+        stop,
+        inc,
+        miller_indices,
+        wavelength,
+        solution_constraints,
+    )
+    cached = await scan_cache.fetch(cache_key)
+    if cached is not None:
+        return cached
+
+    started = time.perf_counter()
+    solutions = await executors.run(
+        "hkl.scan",
+        solve_constraint_points,
+        hklcalc,
+        constraint,
+        values,
+        miller_indices,
+        wavelength,
+        solution_constraints,
+    )
+    admission.record(len(values), time.perf_counter() - started)
+
+    results = {f"{value}": positions for value, positions in zip(values, solutions)}
+    await scan_cache.keep(cache_key, results)
+    return results
+
+
+async def scan_constraint_trajectory(
+    name: str,
+    constraint: str,
+    start: float,
+    stop: float,
+    inc: float,
+    hkl: HklModel,
+    wavelength: float,
+    solution_constraints: SolutionConstraints,
+    max_jump: float,
+    store: HklCalcStore,
+    collection: Optional[str],
+) -> ScanTrajectory:
+    """Follow one continuous diffractometer trajectory while scanning a constraint.
+
+    diffcalc-core solves each step analytically, so the previous step cannot seed
+    the next, and every step is solved in full as in scan_constraint. Instead, the
+    solution closest to the previous step is picked as each step is solved, and
+    only that solution is carried on, so the solutions of the whole scan are never
+    held at once.
 
-    result = {}
-    for value in np.arange(start, stop + inc, inc):
-        setattr(hklcalc, constraint, value)
-        all_positions = hklcalc.get_position(*hkl.dict().values(), wavelength)
-        result[f"{value}"] = combine_lab_position_results(
-            all_positions, solution_constraints
+    Args:
+        name: the name of the hkl object to access within the store
+        constraint: the name of the constraint to use.
+        start: constraint to start at
+        stop: constraint to stop at
+        inc: constraint to increment by
+        hkl: desired miller indices to use for the experiment
+        wavelength: wavelength of light used in the experiment
+        solution_constraints: object containings angles to constrain solutions by
+        max_jump: largest change in any physical angle, in degrees, between two
+            steps before the trajectory is flagged as switching branch
+        store: accessor to the hkl object.
+        collection: collection within which the hkl object resides.
+
+    Returns:
+        The trajectory, with one position per constraint value.
+    """
+    hklcalc = await store.load(name, collection)
+
+    values = generate_axis(start, stop, inc)
+    miller_indices = tuple(hkl.dict().values())
+
+    started = time.perf_counter()
+    trajectory = await executors.run(
+        "hkl.scan",
+        solve_constraint_trajectory,
+        hklcalc,
+        constraint,
+        values,
+        miller_indices,
+        wavelength,
+        solution_constraints,
+        max_jump,
+    )
+    admission.record(len(values), time.perf_counter() - started)
+    return trajectory
+
+
+def follow_trajectory(
+    results: Iterable[Tuple[str, List[Dict[str, float]]]], max_jump: float
+) -> ScanTrajectory:
+    """Pick the solution at each scan point closest to the one picked before it.
+
+    Distances are the largest change in any physical angle, wrapped to within
+    180 degrees. The first scan point with solutions starts from its first one.
+
+    Args:
+        results: each scan point and its possible positions, in order, which may
+            be generated as the trajectory is followed
+        max_jump: largest distance, in degrees, before flagging a branch switch
+
+    Returns:
+        The trajectory through the scan.
+    """
+    positions: Dict[str, Dict[str, float]] = {}
+    branch_switches: List[str] = []
+    previous: Optional[np.ndarray] = None
+
+    for key, solutions in results:
+        if not solutions:
+            continue
+
+        angles = np.array(
+            [[solution[angle] for angle in Position.fields] for solution in solutions]
         )
+        best = 0
+        if previous is not None:
+            jumps = np.abs((angles - previous + 180.0) % 360.0 - 180.0).max(axis=1)
+            best = int(np.argmin(jumps))
+            if jumps[best] > max_jump:
+                branch_switches.append(key)
 
-    return result
+        positions[key] = solutions[best]
+        previous = angles[best]
+
+    return ScanTrajectory(positions=positions, branch_switches=branch_switches)
+
+
+async def stream_scan_hkl(
+    name: str,
+    start: List[float],
+    stop: List[float],
+    inc: List[float],
+    wavelength: float,
+    solution_constraints: SolutionConstraints,
+    store: HklCalcStore,
+    collection: Optional[str],
+) -> "ScanStream":
+    """Retrieve possible diffractometer positions for a range of miller indices.
+
+    Same as scan_hkl, except each set of miller indices is solved and yielded in
+    turn. The scan is validated before this coroutine returns.
+
+    Args:
+        name: the name of the hkl object to access within the store
+        start: miller indices to start at
+        stop: miller indices to stop at
+        inc: miller indices to increment by
+        wavelength: wavelength of light used in the experiment
+        solution_constraints: object containings angles to constrain solutions by
+        store: accessor to the hkl object.
+        collection: collection within which the hkl object resides.
+
+    Returns:
+        ScanStream of each set of miller indices and their possible
+        diffractometer positions.
+    """
+    hklcalc = await store.load(name, collection, readonly=True)
+    points = generate_hkl_points(start, stop, inc)
+
+    return ScanStream(
+        points,
+        hkl_key,
+        partial(
+            solve_pickled_hkl_points,
+            hklcalc,
+            wavelength=wavelength,
+            solution_constraints=solution_constraints,
+        ),
+    )
+
+
+async def stream_scan_wavelength(
+    name: str,
+    start: float,
+    stop: float,
+    inc: float,
+    hkl: HklModel,
+    solution_constraints: SolutionConstraints,
+    store: HklCalcStore,
+    collection: Optional[str],
+) -> "ScanStream":
+    """Retrieve possible diffractometer positions for a range of wavelengths.
+
+    Same as scan_wavelength, except each wavelength is solved and yielded in turn.
+    The scan is validated before this coroutine returns.
+
+    Args:
+        name: the name of the hkl object to access within the store
+        start: wavelength to start at
+        stop: wavelength to stop at
+        inc: wavelength to increment by
+        hkl: desired miller indices to use for the experiment
+        solution_constraints: object containings angles to constrain solutions by
+        store: accessor to the hkl object.
+        collection: collection within which the hkl object resides.
+
+    Returns:
+        ScanStream of each wavelength and the corresponding possible
+        diffractometer positions.
+    """
+    hklcalc = await store.load(name, collection, readonly=True)
+    wavelengths = generate_axis(start, stop, inc)
+
+    return ScanStream(
+        wavelengths,
+        str,
+        partial(
+            solve_wavelength_points,
+            hklcalc,
+            tuple(hkl.dict().values()),
+            solution_constraints=solution_constraints,
+        ),
+    )
+
+
+async def stream_scan_constraint(
+    name: str,
+    constraint: str,
+    start: float,
+    stop: float,
+    inc: float,
+    hkl: HklModel,
+    wavelength: float,
+    solution_constraints: SolutionConstraints,
+    store: HklCalcStore,
+    collection: Optional[str],
+) -> "ScanStream":
+    """Retrieve possible diffractometer positions while scanning across a constraint.
+
+    Same as scan_constraint, except each constraint value is solved and yielded in
+    turn. The scan is validated before this coroutine returns.
+
+    Args:
+        name: the name of the hkl object to access within the store
+        constraint: the name of the constraint to use.
+        start: constraint to start at
+        stop: constraint to stop at
+        inc: constraint to increment by
+        hkl: desired miller indices to use for the experiment
+        wavelength: wavelength of light used in the experiment
+        solution_constraints: object containings angles to constrain solutions by
+        store: accessor to the hkl object.
+        collection: collection within which the hkl object resides.
+
+    Returns:
+        ScanStream of each constraint value and the corresponding
+        possible diffractometer positions.
+    """
+    hklcalc = await store.load(name, collection)
+    values = generate_axis(start, stop, inc)
+
+    return ScanStream(
+        values,
+        str,
+        partial(
+            solve_constraint_points,
+            hklcalc,
+            constraint,
+            miller_indices=tuple(hkl.dict().values()),
+            wavelength=wavelength,
+            solution_constraints=solution_constraints,
+        ),
+    )
+
+
+class ScanStream:
+    """Scan points which are solved one at a time, as they are iterated over.
+
+    Iterating yields each key and the corresponding possible diffractometer
+    positions, as soon as that point is solved.
+    """
+
+    def __init__(
+        self,
+        values: Sequence[Any],
+        key: Callable[[Any], str],
+        solve: Callable[[List[Any]], List[List[Dict[str, float]]]],
+    ) -> None:
+        """Set up the scan, without solving any points yet.
+
+        Args:
+            values: the scan points
+            key: function giving the key each scan point is reported under
+            solve: function solving a list of scan points
+        """
+        self.values = values
+        self.key = key
+        self.solve = solve
+
+    def __len__(self) -> int:
+        """Number of points in the scan."""
+        return len(self.values)
+
+    def _solve_timed(
+        self, values: List[Any]
+    ) -> Tuple[List[List[Dict[str, float]]], float]:
+        """Solve scan points, timed by the worker so that queueing is not counted."""
+        started = time.perf_counter()
+        positions = self.solve(values)
+        return positions, time.perf_counter() - started
+
+    async def __aiter__(self) -> AsyncIterator[Tuple[str, List[Dict[str, float]]]]:
+        """Solve each scan point in turn."""
+        for value in self.values:
+            positions, seconds = await executors.run(
+                "hkl.scan", self._solve_timed, [value], allow_process=False
+            )
+            admission.record(1, seconds)
+            yield self.key(value), positions[0]
+
+
+async def solve_hkl_points(
+    hklcalc: HklCalculation,
+    points: Sequence[Tuple[float, ...]],
+    wavelength: float,
+    solution_constraints: SolutionConstraints,
+) -> List[List[Dict[str, float]]]:
+    """Find diffractometer positions for many sets of miller indices.
+
+    If scans are routed to the process pool, large scans are partitioned into one
+    contiguous chunk per worker. Each worker receives the pickled hkl object once
+    per chunk. Anything else runs in a single call on the configured executor.
+
+    Args:
+        hklcalc: the hkl object to solve with
+        points: miller indices to convert
+        wavelength: wavelength of light used in the experiment
+        solution_constraints: object containings angles to constrain solutions by
+
+    Returns:
+        For each set of miller indices, in order, a list of possible positions.
+    """
+    executor = executors.resolve("hkl.scan")
+    if (
+        executor is None
+        or executor.kind != "process"
+        or len(points) < settings.scan_parallel_min_points
+    ):
+        return await executors.run(
+            "hkl.scan",
+            solve_pickled_hkl_points,
+            hklcalc,
+            points,
+            wavelength,
+            solution_constraints,
+            allow_process=False,
+        )
+
+    blob = pickle.dumps(hklcalc)
+    size = ceil(len(points) / executor.workers)
+
+    chunks = await asyncio.gather(
+        *[
+            executor.run(
+                solve_pickled_hkl_points,
+                blob,
+                points[i : i + size],
+                wavelength,
+                solution_constraints,
+            )
+            for i in range(0, len(points), size)
+        ]
+    )
+    return [positions for chunk in chunks for positions in chunk]
+
+
+def solve_pickled_hkl_points(
+    hklcalc: Union[HklCalculation, bytes],
+    points: Sequence[Tuple[float, ...]],
+    wavelength: float,
+    solution_constraints: SolutionConstraints,
+) -> List[List[Dict[str, float]]]:
+    """Find diffractometer positions for a chunk of miller indices.
+
+    May run inside worker processes, so must remain a module level function.
+
+    Args:
+        hklcalc: the hkl object to solve with, or its pickled form
+        points: miller indices to convert
+        wavelength: wavelength of light used in the experiment
+        solution_constraints: object containings angles to constrain solutions by
+
+    Returns:
+        For each set of miller indices, in order, a list of possible positions.
+    """
+    if isinstance(hklcalc, bytes):
+        hklcalc = pickle.loads(hklcalc)
+
+    return filter_lab_position_results(
+        [hklcalc.get_position(h, k, l, wavelength) for h, k, l in points],
+        solution_constraints,
+    )
+
+
+def solve_wavelength_points(
+    hklcalc: HklCalculation,
+    miller_indices: Tuple[float, float, float],
+    wavelengths: Sequence[float],
+    solution_constraints: SolutionConstraints,
+) -> List[List[Dict[str, float]]]:
+    """Find diffractometer positions for a set of miller indices at many wavelengths.
+
+    Args:
+        hklcalc: the hkl object to solve with
+        miller_indices: miller indices to convert
+        wavelengths: wavelengths of light to convert at
+        solution_constraints: object containings angles to constrain solutions by
+
+    Returns:
+        For each wavelength, in order, a list of possible positions.
+    """
+    return filter_lab_position_results(
+        [
+            hklcalc.get_position(*miller_indices, wavelength)
+            for wavelength in wavelengths
+        ],
+        solution_constraints,
+    )
+
+
+def solve_constraint_points(
+    hklcalc: HklCalculation,
+    constraint: str,
+    values: Sequence[float],
+    miller_indices: Tuple[float, float, float],
+    wavelength: float,
+    solution_constraints: SolutionConstraints,
+) -> List[List[Dict[str, float]]]:
+    """Find diffractometer positions for a set of miller indices across a constraint.
+
+    Args:
+        hklcalc: the hkl object to solve with, which is modified for each value
+        constraint: the name of the constraint to scan
+        values: values of the constraint to convert at
+        miller_indices: miller indices to convert
+        wavelength: wavelength of light used in the experiment
+        solution_constraints: object containings angles to constrain solutions by
+
+    Returns:
+        For each constraint value, in order, a list of possible positions.
+    """
+    results = []
+    for value in values:
+        setattr(hklcalc.constraints, constraint, value)
+        results.append(hklcalc.get_position(*miller_indices, wavelength))
+
+    return filter_lab_position_results(results, solution_constraints)
+
+
+def solve_constraint_trajectory(
+    hklcalc: HklCalculation,
+    constraint: str,
+    values: Sequence[float],
+    miller_indices: Tuple[float, float, float],
+    wavelength: float,
+    solution_constraints: SolutionConstraints,
+    max_jump: float,
+) -> ScanTrajectory:
+    """Follow one trajectory across a constraint, solving one value at a time.
+
+    Args:
+        hklcalc: the hkl object to solve with, which is modified for each value
+        constraint: the name of the constraint to scan
+        values: values of the constraint to convert at, in order
+        miller_indices: miller indices to convert
+        wavelength: wavelength of light used in the experiment
+        solution_constraints: object containings angles to constrain solutions by
+        max_jump: largest distance, in degrees, before flagging a branch switch
+
+    Returns:
+        The trajectory through the scan.
+    """
+
+    def steps() -> Iterator[Tuple[str, List[Dict[str, float]]]]:
+        for value in values:
+            setattr(hklcalc.constraints, constraint, value)
+            position = hklcalc.get_position(*miller_indices, wavelength)
+            yield f"{value}", filter_lab_position_results(
+                [position], solution_constraints
+            )[0]
 
+    return follow_trajectory(steps(), max_jump)
 
-def generate_axis(start: float, stop: float, inc: float):
-    """Attempt to generate a numpy range between values.
+
+def generate_hkl_points(
+    start: List[float], stop: List[float], inc: List[float]
+) -> ScanGrid:
+    """Generate every set of miller indices in a hkl scan.
+
+    Args:
+        start: miller indices to start at
+        stop: miller indices to stop at
+        inc: miller indices to increment by
+
+    Returns:
+        the cartesian product of the range of each miller index, generated lazily.
+
+    Throws an error if the scan is not three dimensional, crosses [0, 0, 0], or has
+    more points than the scan_max_points setting allows.
+    """
+    if (len(start) != 3) or (len(stop) != 3) or (len(inc) != 3):
+        raise InvalidMillerIndicesError(
+            "start, stop and inc must have three floats for each miller index."
+        )
+
+    points = ScanGrid(
+        *[
+            generate_axis(start[i], stop[i], inc[i]) if inc[i] != 0 else [0]
+            for i in range(3)
+        ]
+    )
+    check_scan_size(points.size)
+
+    # a point is [0, 0, 0] only if every axis passes through 0
+    if all(0 in axis for axis in points.axes):
+        raise InvalidMillerIndicesError(
+            "choose a hkl range that does not cross through [0, 0, 0]"
+        )  # is this good enough? do people need scans through 0,0,0?
+
+    return points
+
+
+def count_hkl_points(start: List[float], stop: List[float], inc: List[float]) -> int:
+    """Count the sets of miller indices in a hkl scan, without generating them.
+
+    Args:
+        start: miller indices to start at
+        stop: miller indices to stop at
+        inc: miller indices to increment by
+
+    Returns:
+        the number of points in the scan.
+
+    Throws the same errors as generate_hkl_points.
+    """
+    return generate_hkl_points(start, stop, inc).size
+
+
+def count_axis_points(start: float, stop: float, inc: float) -> int:
+    """Count the values in a wavelength or constraint scan, without generating them.
+
+    Args:
+        start: value to start at
+        stop: value to stop at
+        inc: value to increment by
+
+    Returns:
+        the number of points in the scan.
+
+    Throws the same errors as generate_axis.
+    """
+    return generate_axis(start, stop, inc).size
+
+
+def hkl_key(point: Tuple[float, ...]) -> str:
+    """Format a set of miller indices as the key it is reported under in scans.
+
+    Args:
+        point: the miller indices
+
+    Returns:
+        The miller indices, as "(h, k, l)".
+    """
+    return "({}, {}, {})".format(*point)
+
+
+def scan_point_values(key: str) -> Tuple[float, ...]:
+    """Read the values of a scan point back from the key it is reported under.
+
+    Args:
+        key: the key, as "(h, k, l)" for hkl scans or a single number otherwise
+
+    Returns:
+        The values making up the scan point.
+    """
+    return tuple(float(value) for value in key.strip("()").split(","))
+
+
+def generate_axis(start: float, stop: float, inc: float) -> ScanAxis:
+    """Generate the values of a scan between two values, lazily.
 
     Args:
         start: value to start at
@@ -220,15 +1019,140 @@ def generate_axis(start: float, stop: float, inc: float):
         inc: value to increment by
 
     Returns:
-        a numpy range.
+        the same values as numpy.arange(start, stop + inc, inc).
 
-    Throws an error if the numpy range is null, most likely due to non-logical
-    range like 0->1 in increments of a negative number.
+    Throws an error if the range is empty, most likely due to non-logical range
+    like 0->1 in increments of a negative number, or if it has more points than
+    the scan_max_points setting allows.
     """
-    if len(np.arange(start, stop + inc, inc)) == 0:
+    axis = ScanAxis(start, stop, inc)
+    if axis.size == 0:
         raise InvalidScanBoundsError(start, stop, inc)
 
-    return np.arange(start, stop + inc, inc)
+    check_scan_size(axis.size)
+    return axis
+
+
+def check_scan_size(points: int) -> None:
+    """Reject scans with more points than the scan_max_points setting allows.
+
+    Args:
+        points: number of points in the scan
+    """
+    if points > settings.scan_max_points:
+        raise ScanTooLargeError(points, settings.scan_max_points)
+
+
+def columnar_scan_results(
+    results: Dict[str, List[Dict[str, float]]], variables: Sequence[str]
+) -> ColumnarScan:
+    """Rearrange scan results into one list per scanned value and per angle.
+
+    Args:
+        results: dictionary of each scan point and its possible positions
+        variables: names of the values making up each scan point, e.g. h, k and l
+
+    Returns:
+        The same results, stored by column.
+    """
+    points: Dict[str, List[float]] = {variable: [] for variable in variables}
+    index: List[int] = []
+    angles: Dict[str, List[float]] = {}
+
+    for i, (key, positions) in enumerate(results.items()):
+        for variable, value in zip(variables, scan_point_values(key)):
+            points[variable].append(value)
+        for position in positions:
+            index.append(i)
+            for angle, value in position.items():
+                angles.setdefault(angle, []).append(value)
+
+    # the results are already validated, so skip doing so again
+    return ColumnarScan.construct(points=points, index=index, angles=angles)
+
+
+def npz_scan_results(columnar: ColumnarScan) -> bytes:
+    """Encode columnar scan results as a numpy .npz archive.
+
+    Args:
+        columnar: scan results stored by column
+
+    Returns:
+        Archive with one float64 array per angle, one float64 array named
+        points/<name> per value making up the scan points, and the array index.
+    """
+    arrays: Dict[str, Any] = {
+        angle: np.array(values, dtype="<f8")
+        for angle, values in columnar.angles.items()
+    }
+    for variable, values in columnar.points.items():
+        arrays[f"points/{variable}"] = np.array(values, dtype="<f8")
+    arrays["index"] = np.array(columnar.index, dtype="<i8")
+
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def stacked_rotations(angles: np.ndarray, axis: int) -> np.ndarray:
+    """Build rotation matrices about one of the cartesian axes for many angles.
+
+    Args:
+        angles: array of N angles, in radians
+        axis: 0, 1 or 2 to rotate about x, y or z respectively
+
+    Returns:
+        (N, 3, 3) array of rotation matrices.
+    """
+    i, j = (axis + 1) % 3, (axis + 2) % 3
+    cos, sin = np.cos(angles), np.sin(angles)
+
+    matrices = np.zeros((len(angles), 3, 3))
+    matrices[:, axis, axis] = 1
+    matrices[:, i, i] = cos
+    matrices[:, i, j] = -sin
+    matrices[:, j, i] = sin
+    matrices[:, j, j] = cos
+    return matrices
+
+
+def hkl_from_angles(
+    mu: np.ndarray,
+    delta: np.ndarray,
+    nu: np.ndarray,
+    eta: np.ndarray,
+    chi: np.ndarray,
+    phi: np.ndarray,
+    wavelength: np.ndarray,
+    ub: np.ndarray,
+) -> np.ndarray:
+    """Compute miller indices for many diffractometer positions at once.
+
+    Vectorised equivalent of diffcalc.hkl.calc.HklCalculation.get_hkl, using the
+    rotation conventions of diffcalc.hkl.geometry.
+
+    Args:
+        mu, delta, nu, eta, chi, phi: arrays of N diffractometer angles, in radians
+        wavelength: single wavelength, or array of N wavelengths
+        ub: the UB matrix
+
+    Returns:
+        (N, 3) array of miller indices.
+    """
+    detector = stacked_rotations(nu, 0) @ stacked_rotations(-delta, 2)
+    sample = (
+        stacked_rotations(mu, 0)
+        @ stacked_rotations(-eta, 2)
+        @ stacked_rotations(chi, 1)
+        @ stacked_rotations(-phi, 2)
+    )
+
+    # (NU @ DELTA - I) @ (0, 2pi / wavelength, 0)
+    q_lab = (detector[:, :, 1] - [0, 1, 0]) * (2 * np.pi / wavelength)[..., None]
+    # inverse of each rotation matrix is its transpose
+    q_phi = np.einsum("nji,nj->ni", sample, q_lab)
+
+    return q_phi @ np.linalg.inv(ub).T
 
 
 def combine_lab_position_results(
@@ -245,23 +1169,58 @@ def combine_lab_position_results(
         a list of angles, combined together into one dictionary.
 
     """
+    return filter_lab_position_results([positions], solution_constraints)[0]
+
+
+def filter_lab_position_results(
+    results: List[List[Tuple[Position, Dict[str, float]]]],
+    solution_constraints: SolutionConstraints,
+) -> List[List[Dict[str, float]]]:
+    """Combine physical and virtual angles for every point of a scan.
+
+    Solutions from all points are checked against the solution bounds at once, and
+    only those within the bounds are combined into dictionaries.
+
+    Args:
+        results: for each scan point, a list of each set of physical and virtual
+            angles.
+        solution_constraints: object containings angles to constrain solutions by
+
+    Returns:
+        For each scan point, a list of angles combined together into one dictionary.
+    """
     axes = solution_constraints.axes
     low_bound = solution_constraints.low_bound
     high_bound = solution_constraints.high_bound
 
-    result = []
-
-    for position in positions:
-        physical_angles, virtual_angles = position
-        if axes and low_bound and high_bound:
-            if all(
-                [
-                    low_bound[i] < getattr(physical_angles, angle) < high_bound[i]
-                    for i, angle in enumerate(axes)
-                ]
-            ):
-                result.append({**physical_angles.asdict, **virtual_angles})
-        else:
-            result.append({**physical_angles.asdict, **virtual_angles})
+    if not (axes and low_bound and high_bound):
+        return [
+            [
+                {**physical_angles.asdict, **virtual_angles}
+                for physical_angles, virtual_angles in positions
+            ]
+            for positions in results
+        ]
 
-    return result
+    solutions = [position for positions in results for position in positions]
+    angles = np.array(
+        [
+            [getattr(physical_angles, angle) for angle in axes]
+            for physical_angles, _ in solutions
+        ],
+        dtype=float,
+    ).reshape(len(solutions), len(axes))
+
+    low = np.array(low_bound[: len(axes)], dtype=float)
+    high = np.array(high_bound[: len(axes)], dtype=float)
+    within_bounds = iter(np.all((low < angles) & (angles < high), axis=1).tolist())
+
+    # zip stops at the end of each scan point before taking from within_bounds
+    return [
+        [
+            {**physical_angles.asdict, **virtual_angles}
+            for (physical_angles, virtual_angles), keep in zip(positions, within_bounds)
+            if keep
+        ]
+        for positions in results
+    ]
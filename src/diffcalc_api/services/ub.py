@@ -1,5 +1,6 @@
 """Business logic for handling requests from ub endpoints."""
 
+from functools import partial
 from typing import List, Literal, Optional, Tuple, Union, cast
 
 import numpy as np
@@ -7,6 +8,7 @@ from diffcalc.hkl.geometry import Position
 from diffcalc.ub.calc import UBCalculation
 from diffcalc.ub.reference import Orientation, Reflection
 
+from diffcalc_api import executors
 from diffcalc_api.errors.ub import (
     InvalidIndexError,
     NoCrystalError,
@@ -436,9 +438,9 @@ async def get_miscut(
     Returns:
         miscut angle and miscut axis as a list.
     """
-    hklcalc = await store.load(name, collection)
-
-    ubcalc: UBCalculation = hklcalc.ubcalc
+    ubcalc: UBCalculation = await store.load_ubcalc(
+        name, collection, ["u_matrix", "surface", "ub_matrix"]
+    )
     try:
         angle, axis = ubcalc.get_miscut()
     except ValueError:
@@ -470,8 +472,11 @@ async def get_miscut_from_hkl(
 
     ubcalc: UBCalculation = hklcalc.ubcalc
     try:
-        angle, axis = ubcalc.get_miscut_from_hkl(
-            (hkl.h, hkl.k, hkl.l), Position(**pos.dict())
+        angle, axis = await executors.run(
+            "ub.miscut",
+            ubcalc.get_miscut_from_hkl,
+            (hkl.h, hkl.k, hkl.l),
+            Position(**pos.dict()),
         )
     except ValueError:
         raise NoUbMatrixError()
@@ -517,7 +522,13 @@ async def calculate_ub(
     first_retrieve: Optional[Union[str, int]] = tag1 if tag1 else idx1
     second_retrieve: Optional[Union[str, int]] = tag2 if tag2 else idx2
 
-    hklcalc.ubcalc.calc_ub(first_retrieve, second_retrieve)
+    await executors.run(
+        "ub.calculate",
+        hklcalc.ubcalc.calc_ub,
+        first_retrieve,
+        second_retrieve,
+        allow_process=False,
+    )
 
     await store.save(name, hklcalc, collection)
     return np.round(hklcalc.ubcalc.UB, 6).tolist()
@@ -536,8 +547,7 @@ async def get_ub(
     Returns:
         a string with the current state of the UB object
     """
-    hklcalc = await store.load(name, collection)
-    ubcalc: UBCalculation = hklcalc.ubcalc
+    ubcalc: UBCalculation = await store.load_ubcalc(name, collection, ["ub_matrix"])
 
     if ubcalc.UB is not None:
         return ubcalc.UB.tolist()
@@ -560,8 +570,7 @@ async def get_u(
     Returns:
         a string with the current state of the UB object
     """
-    hklcalc = await store.load(name, collection)
-    ubcalc: UBCalculation = hklcalc.ubcalc
+    ubcalc: UBCalculation = await store.load_ubcalc(name, collection, ["u_matrix"])
 
     if ubcalc.U is not None:
         return ubcalc.U.tolist()
@@ -636,12 +645,17 @@ async def refine_ub(
     ubcalc: UBCalculation = hklcalc.ubcalc
     hkl: Tuple[float, float, float] = params.hkl.h, params.hkl.k, params.hkl.l
 
-    ubcalc.refine_ub(
+    await executors.run(
+        "ub.refine",
+        partial(
+            ubcalc.refine_ub,
+            refine_lattice=refine_lat,
+            refine_umatrix=refine_u,
+        ),
         hkl,
         Position(**params.position.dict()),
         params.wavelength,
-        refine_lattice=refine_lat,
-        refine_umatrix=refine_u,
+        allow_process=False,
     )
 
     await store.save(name, hklcalc, collection)
@@ -770,8 +784,9 @@ async def get_lab_reference_vector(
         Column vector in List[List[float]] format, or None
 
     """
-    hklcalc = await store.load(name, collection)
-    ubcalc: UBCalculation = hklcalc.ubcalc
+    ubcalc: UBCalculation = await store.load_ubcalc(
+        name, collection, ["reference", "ub_matrix"]
+    )
 
     n_phi = ubcalc.n_phi
     return n_phi.tolist() if n_phi is not None else None
@@ -793,8 +808,9 @@ async def get_miller_reference_vector(
         Column vector in List[List[float]] format, or None
 
     """
-    hklcalc = await store.load(name, collection)
-    ubcalc: UBCalculation = hklcalc.ubcalc
+    ubcalc: UBCalculation = await store.load_ubcalc(
+        name, collection, ["reference", "ub_matrix"]
+    )
 
     n_hkl = ubcalc.n_hkl
     return n_hkl.tolist() if n_hkl is not None else None
@@ -816,8 +832,9 @@ async def get_lab_surface_normal(
         Column vector in List[List[float]] format, or None
 
     """
-    hklcalc = await store.load(name, collection)
-    ubcalc: UBCalculation = hklcalc.ubcalc
+    ubcalc: UBCalculation = await store.load_ubcalc(
+        name, collection, ["surface", "ub_matrix"]
+    )
 
     surf_nphi = ubcalc.surf_nphi
     return surf_nphi.tolist() if surf_nphi is not None else None
@@ -839,8 +856,9 @@ async def get_miller_surface_normal(
         Column vector in List[List[float]] format, or None
 
     """
-    hklcalc = await store.load(name, collection)
-    ubcalc: UBCalculation = hklcalc.ubcalc
+    ubcalc: UBCalculation = await store.load_ubcalc(
+        name, collection, ["surface", "ub_matrix"]
+    )
 
     surf_nhkl = ubcalc.surf_nhkl
     return surf_nhkl.tolist() if surf_nhkl is not None else None
@@ -988,7 +1006,15 @@ async def hkl_solver_for_fixed_q(
 
     index_as_literal = cast(Literal["h", "k", "l"], index_name)
 
-    hkl_list = ubcalc.solve_for_hkl_given_fixed_index_and_q(
-        index_as_literal, index_value, q_value, a, b, c, d
+    hkl_list = await executors.run(
+        "ub.solve_fixed_q",
+        ubcalc.solve_for_hkl_given_fixed_index_and_q,
+        index_as_literal,
+        index_value,
+        q_value,
+        a,
+        b,
+        c,
+        d,
     )
     return hkl_list
@@ -5,11 +5,17 @@ which must be persisted.
 
 diffcalc_api.stores.pickling defines a class for persisting them on-file,
 diffcalc_api.stores.mongo defines a class for persisting them on mongodb.
+diffcalc_api.stores.caching defines a class which keeps recently used objects from
+any other store in memory.
+diffcalc_api.stores.shared defines a class which keeps objects from any other store
+in a cache shared between replicas of the API, such as a Redis server.
+diffcalc_api.stores.serialization defines a compact binary format for objects,
+which the file and mongo stores can be configured to use.
 
 This can be extended to any database or persistence model, so long as it follows
 the protocol defined in diffcalc_api.stores.protocol.
 """
 
-from . import pickling, protocol
+from . import caching, pickling, protocol, serialization, shared
 
-__all__ = ["pickling", "protocol"]
+__all__ = ["caching", "pickling", "protocol", "serialization", "shared"]
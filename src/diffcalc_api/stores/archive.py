@@ -0,0 +1,799 @@
+"""Defines a persistence layer packing every object of a collection into one file.
+
+Each collection is an append-only segment file, SAVE_PICKLES_FOLDER/collection.segment,
+holding a sequence of records. Each record is made of:
+
+- a header: magic number, kind of record, length of the name, length of the data,
+  revision, and a CRC32 checksum of the name and data
+- the name of the object, in UTF-8
+- the object, in the format of diffcalc_api.stores.serialization, or nothing if the
+  record marks a deletion.
+
+Saving an object appends a record, and deleting one appends an empty deletion
+record, leaving older records for the same name as dead space. Segments are
+memory-mapped, and an index of the live record of every name is built by scanning
+the segment when it is first used, so loads decode objects straight from the
+mapping without reading or copying the record. Each version of the file, from when
+it is opened until it is compacted or replaced, has one mapping, which is only
+made again once the file has doubled in size. Records appended since are read from
+the file instead. Records keep the version of the file they were found in, so a
+record looked up just before a compaction still reads its own data.
+
+A crash can leave at most one incomplete record at the end of a segment. Scanning
+stops at a record which is cut short by the end of the file, or is the last one and
+fails its checksum, and the next write truncates the segment there. A record in
+the middle of the segment which fails its checksum is skipped by its length, and
+logged. If the segment is too damaged to find the records after it, it is
+reported as corrupt rather than truncated, so that no later records are lost.
+
+Once dead records take up more than a given fraction of a segment, its live records
+are copied to a new segment which is renamed over the old one. A compacted segment
+starts with a mark record holding the highest revision it has seen, so that
+revisions keep increasing after the records of deleted objects are dropped.
+
+Several processes can share a segment. Writes and compactions hold a lock on it,
+and every operation first catches up with records appended by other processes,
+rescanning the segment if another process compacted it.
+"""
+
+import bisect
+import contextlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import weakref
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from weakref import WeakKeyDictionary
+
+import numpy as np
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_api import executors
+from diffcalc_api.config import SAVE_PICKLES_FOLDER
+from diffcalc_api.errors.definitions import (
+    ALL_RESPONSES,
+    DiffcalcAPIException,
+    ErrorCodesBase,
+)
+from diffcalc_api.stores import serialization
+from diffcalc_api.stores.pickling import _file_lock
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".segment"
+RECORD_MAGIC = b"DCAR"
+# magic number, kind, name length, data length, revision, checksum
+HEADER = struct.Struct("<4sBHIQI")
+
+# kinds of record
+_PUT = 0
+_DELETE = 1
+_MARK = 2
+
+
+class ErrorCodes(ErrorCodesBase):
+    """Codes which can be raised in the retrieval/storage of HklCalculation objects."""
+
+    OVERWRITE_ERROR = 405
+    RECORD_NOT_FOUND_ERROR = 404
+    REVISION_CONFLICT_ERROR = 409
+    CORRUPT_SEGMENT_ERROR = 500
+
+
+class OverwriteError(DiffcalcAPIException):
+    """Thrown if a HklCalculation object is created with a non-unique name."""
+
+    def __init__(self, name: str) -> None:
+        """Set detail and status code of the error."""
+        self.detail = (
+            f"Record already exists for crystal {name}!"
+            f"\nEither delete via DELETE request to this URL "
+            f"or change the existing properties. "
+        )
+        self.status_code = ErrorCodes.OVERWRITE_ERROR
+
+
+class RecordNotFoundError(DiffcalcAPIException):
+    """Thrown if the store cannot retrieve a HklCalculation object."""
+
+    def __init__(self, name: str, action: str) -> None:
+        """Set detail and status code of the error."""
+        self.detail = f"Record for crystal {name} not found! Cannot {action}."
+        self.status_code = ErrorCodes.RECORD_NOT_FOUND_ERROR
+
+
+class RevisionConflictError(DiffcalcAPIException):
+    """Thrown if a HklCalculation object was modified since it was loaded."""
+
+    def __init__(self, name: str, revision: int) -> None:
+        """Set detail and status code of the error."""
+        self.detail = (
+            f"Record for crystal {name} has changed since revision {revision}!"
+            f"\nAnother request modified it concurrently, please retry."
+        )
+        self.status_code = ErrorCodes.REVISION_CONFLICT_ERROR
+
+
+class CorruptSegmentError(DiffcalcAPIException):
+    """Thrown if the records of a segment cannot be found."""
+
+    def __init__(self, path: Path, offset: int) -> None:
+        """Set detail and status code of the error."""
+        self.detail = (
+            f"Segment {path.name} is corrupt at byte {offset}!"
+            f"\nNo record can be found there, so the segment is left untouched."
+        )
+        self.status_code = ErrorCodes.CORRUPT_SEGMENT_ERROR
+
+
+class Generation:
+    """One version of a segment file, and its mapping.
+
+    A version lasts from opening the file until it is compacted or replaced by
+    another process. The file is closed once nothing refers to the version.
+    """
+
+    def __init__(self, fd: int) -> None:
+        """Take ownership of an open segment file, without mapping it yet.
+
+        Args:
+            fd: file descriptor of the segment file
+        """
+        self.fd = fd
+        self.map: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+        weakref.finalize(self, os.close, fd)
+
+    def cover(self, size: int) -> None:
+        """Map the file again once it has grown to over twice the mapped size.
+
+        Args:
+            size: current size of the file
+        """
+        mapped = len(self.map) if self.map is not None else 0
+        if size > 2 * mapped:
+            # the old mapping is unmapped once no view of it is left
+            self.map = mmap.mmap(self.fd, size, access=mmap.ACCESS_READ)
+
+    def view(self, start: int, stop: int) -> memoryview:
+        """View a range of the file, from the mapping if it covers the range.
+
+        Args:
+            start: offset of the first byte
+            stop: offset after the last byte
+
+        Returns:
+            A view of the mapping, or of a copy of the range read from the file.
+        """
+        mapping = self.map
+        if mapping is not None and stop <= len(mapping):
+            return memoryview(mapping)[start:stop]
+        if hasattr(os, "pread"):
+            return memoryview(os.pread(self.fd, stop - start, start))
+        with self._lock:
+            os.lseek(self.fd, start, os.SEEK_SET)
+            return memoryview(os.read(self.fd, stop - start))
+
+    def write(self, offset: int, data: bytes) -> None:
+        """Write data at an offset, and flush it to disk.
+
+        Args:
+            offset: where to write the data
+            data: the data
+        """
+        with self._lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            os.write(self.fd, data)
+        os.fsync(self.fd)
+
+
+class Record(NamedTuple):
+    """Position of the live record of an object inside a segment."""
+
+    start: int
+    size: int
+    data_offset: int
+    data_length: int
+    revision: int
+    # version of the segment file the record was found in
+    generation: Generation
+
+
+class Segment:
+    """An append-only segment file, with the index of its live records.
+
+    Methods block on file access, and are safe to call from several threads.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Set up the segment, without opening its file yet.
+
+        Args:
+            path: location of the segment file
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.index: Dict[str, Record] = {}
+        self.generation: Optional[Generation] = None
+        self._inode: Optional[int] = None
+        # end of the last complete record
+        self.end = 0
+        # bytes taken up by records which are no longer live
+        self.dead = 0
+        self.revision = 0
+
+    def _open(self) -> None:
+        """Open the segment file, and index it from the start."""
+        # the previous version is closed once no record refers to it
+        self.generation, self._inode = None, None
+        self.index, self.end, self.dead = {}, 0, 0
+
+        try:
+            fd = os.open(self.path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        except FileNotFoundError:
+            return
+        self.generation = Generation(fd)
+        stat = os.fstat(fd)
+        self._inode = stat.st_ino
+        self._scan(stat.st_size)
+
+    def _scan(self, size: int) -> None:
+        """Index the complete records between the end of the index and a size."""
+        if size <= self.end:
+            return
+        generation = self.generation
+        assert generation is not None
+        generation.cover(size)
+        # offsets in the view are relative to the end of the index
+        base = self.end
+        with generation.view(base, size) as view:
+            self._index(generation, view, base, size)
+
+    def _index(
+        self, generation: Generation, view: memoryview, base: int, size: int
+    ) -> None:
+        while self.end + HEADER.size <= size:
+            magic, kind, name_length, data_length, revision, checksum = (
+                HEADER.unpack_from(view, self.end - base)
+            )
+            name_offset = self.end + HEADER.size
+            data_offset = name_offset + name_length
+            stop = data_offset + data_length
+            if magic != RECORD_MAGIC:
+                # a crash can leave the end of the file filled with zeros
+                if any(view[self.end - base :]):
+                    raise CorruptSegmentError(self.path, self.end)
+                break
+            if stop > size:
+                break
+            if zlib.crc32(view[name_offset - base : stop - base]) != checksum:
+                if stop == size:
+                    break
+                logger.warning(
+                    f"Skipping corrupt record at byte {self.end} of {self.path.name}"
+                )
+                self.dead += stop - self.end
+                self.end = stop
+                continue
+
+            name = bytes(view[name_offset - base : data_offset - base]).decode()
+            record = Record(
+                self.end,
+                stop - self.end,
+                data_offset,
+                data_length,
+                revision,
+                generation,
+            )
+            if kind != _MARK:
+                replaced = self.index.pop(name, None)
+                if replaced is not None:
+                    self.dead += replaced.size
+                if kind == _PUT:
+                    self.index[name] = record
+                else:
+                    self.dead += record.size
+
+            self.revision = max(self.revision, revision)
+            self.end = stop
+
+    def refresh(self) -> None:
+        """Catch up with records written to the segment by other processes."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self.generation is not None:
+                self._open()
+            return
+
+        if self.generation is None or stat.st_ino != self._inode:
+            self._open()
+        else:
+            self._scan(stat.st_size)
+
+    def get(self, name: str, action: str) -> Record:
+        """Find the live record of an object.
+
+        Args:
+            name: name of the object
+            action: what the record is needed for, reported if it is missing.
+
+        Returns:
+            The record.
+        """
+        with self.lock:
+            self.refresh()
+            record = self.index.get(name)
+            if record is None:
+                raise RecordNotFoundError(name, action)
+            return record
+
+    @staticmethod
+    def view(record: Record) -> memoryview:
+        """View the data of a record, without copying it.
+
+        The view is of the version of the file the record was found in, which stays
+        valid even if the segment has since been compacted.
+
+        Args:
+            record: a record returned by Segment.get
+
+        Returns:
+            A view of the data, inside the mapping of the segment if it covers the
+            record, or of a copy read from the file otherwise.
+        """
+        return record.generation.view(
+            record.data_offset, record.data_offset + record.data_length
+        )
+
+    def append(
+        self,
+        kind: int,
+        name: str,
+        data: bytes,
+        expected: Optional[int],
+        action: str,
+    ) -> int:
+        """Append a record, if the object is in the expected state.
+
+        Args:
+            kind: kind of the record
+            name: name of the object
+            data: serialized object, or nothing for a deletion
+            expected: the revision the object must be at, if any
+            action: the action the record makes, reported in errors.
+
+        Returns:
+            The revision of the new record.
+        """
+        with self.lock, _file_lock(self.path):
+            self.refresh()
+            current = self.index.get(name)
+            if action == "create":
+                if current is not None:
+                    raise OverwriteError(name)
+            elif current is None:
+                raise RecordNotFoundError(name, action)
+            elif expected is not None and current.revision != expected:
+                raise RevisionConflictError(name, expected)
+
+            return self._write([(kind, name, data)])[0]
+
+    def append_many(self, records: Sequence[Tuple[str, bytes]]) -> List[str]:
+        """Append records creating many objects at once, with a single write.
+
+        Args:
+            records: name and serialized data of each object
+
+        Returns:
+            The names which already existed, and were left untouched.
+        """
+        with self.lock, _file_lock(self.path):
+            self.refresh()
+            skipped, created, batch = [], set(), []
+            for name, data in records:
+                if name in self.index or name in created:
+                    skipped.append(name)
+                else:
+                    created.add(name)
+                    batch.append((_PUT, name, data))
+
+            if batch:
+                self._write(batch)
+            return skipped
+
+    def _write(self, records: Sequence[Tuple[int, str, bytes]]) -> List[int]:
+        """Write records at the end of the segment, holding its locks."""
+        if self.generation is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644))
+            self._open()
+        generation = self.generation
+        assert generation is not None
+
+        # drop an incomplete record left by a crash
+        if os.fstat(generation.fd).st_size != self.end:
+            os.ftruncate(generation.fd, self.end)
+
+        parts: List[bytes] = []
+        revisions = list(range(self.revision + 1, self.revision + 1 + len(records)))
+        for (kind, name, data), revision in zip(records, revisions):
+            encoded = name.encode()
+            checksum = zlib.crc32(data, zlib.crc32(encoded))
+            parts += [
+                HEADER.pack(
+                    RECORD_MAGIC, kind, len(encoded), len(data), revision, checksum
+                ),
+                encoded,
+                data,
+            ]
+        blob = b"".join(parts)
+
+        generation.write(self.end, blob)
+        self._scan(self.end + len(blob))
+        return revisions
+
+    def page(self, after: Optional[str], limit: int) -> List[Tuple[str, Record]]:
+        """Find the live records of a page of objects, in order of name.
+
+        Args:
+            after: only include objects whose name comes after this one
+            limit: maximum number of objects to include
+
+        Returns:
+            The name of each object, and its record.
+        """
+        with self.lock:
+            self.refresh()
+            names = sorted(self.index)
+            start = bisect.bisect_right(names, after) if after is not None else 0
+            return [(name, self.index[name]) for name in names[start : start + limit]]
+
+    def compact(self) -> None:
+        """Copy the live records to a new segment file, renamed over this one."""
+        with self.lock, _file_lock(self.path):
+            self.refresh()
+            if self.generation is None:
+                return
+
+            fd, temp = tempfile.mkstemp(
+                dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "wb") as stream:
+                    stream.write(
+                        HEADER.pack(RECORD_MAGIC, _MARK, 0, 0, self.revision, 0)
+                    )
+                    for record in sorted(
+                        self.index.values(), key=lambda record: record.start
+                    ):
+                        with record.generation.view(
+                            record.start, record.start + record.size
+                        ) as view:
+                            stream.write(view)
+                    stream.flush()
+                    os.fsync(stream.fileno())
+                os.replace(temp, self.path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.unlink(temp)
+                raise
+
+            self._open()
+
+    def needs_compaction(self, ratio: float, min_size: int) -> bool:
+        """Check whether enough of the segment is dead space to compact it.
+
+        Args:
+            ratio: fraction of the segment which must be dead space
+            min_size: size in bytes below which segments are never compacted.
+
+        Returns:
+            True if the segment should be compacted.
+        """
+        with self.lock:
+            return self.end >= min_size and self.dead > ratio * self.end
+
+
+class ArchiveHklCalcStore:
+    """Class to use memory-mapped segment files as a persistence layer for the API.
+
+    Every record carries a revision, taken from a counter which increases with each
+    record appended to the segment. The revision each HklCalculation object was
+    loaded at is remembered, so that saving it back only succeeds if nobody else
+    has saved the object in the meantime.
+
+    All file access runs on the "store.archive" executor route, off the event loop.
+    """
+
+    _root_directory: Path = Path(SAVE_PICKLES_FOLDER)
+
+    def __init__(
+        self, compact_ratio: float = 0.5, compact_min_size: int = 1 << 20
+    ) -> None:
+        """Set error codes that could be thrown during method excecution.
+
+        Error codes are purely for documentation purposes.
+
+        Args:
+            compact_ratio: fraction of a segment which must be dead records for it
+                to be compacted after a write.
+            compact_min_size: size in bytes below which segments are never compacted.
+        """
+        self.responses = {
+            code: ALL_RESPONSES[code] for code in np.unique(ErrorCodes.all_codes())
+        }
+        self.compact_ratio = compact_ratio
+        self.compact_min_size = compact_min_size
+        self._segments: Dict[Path, Segment] = {}
+        self._segments_lock = threading.Lock()
+        self._revisions: "WeakKeyDictionary[HklCalculation, int]" = WeakKeyDictionary()
+
+    def _segment(self, collection: Optional[str]) -> Segment:
+        path = self._root_directory / (
+            (collection if collection else "default") + SEGMENT_SUFFIX
+        )
+        with self._segments_lock:
+            segment = self._segments.get(path)
+            if segment is None:
+                segment = self._segments[path] = Segment(path)
+            return segment
+
+    def _append(
+        self,
+        collection: Optional[str],
+        kind: int,
+        name: str,
+        calc: Optional[HklCalculation],
+        expected: Optional[int],
+        action: str,
+    ) -> int:
+        segment = self._segment(collection)
+        data = serialization.dumps(calc) if calc is not None else b""
+        revision = segment.append(kind, name, data, expected, action)
+
+        if segment.needs_compaction(self.compact_ratio, self.compact_min_size):
+            segment.compact()
+        return revision
+
+    def _load(self, collection: Optional[str], name: str) -> Tuple[HklCalculation, int]:
+        segment = self._segment(collection)
+        record = segment.get(name, "load")
+        with segment.view(record) as data:
+            return serialization.loads(data), record.revision
+
+    def _load_many(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, HklCalculation, int]]:
+        segment = self._segment(collection)
+        page = []
+        for name, record in segment.page(after, limit):
+            with segment.view(record) as data:
+                page.append((name, serialization.loads(data), record.revision))
+        return page
+
+    def _append_many(
+        self, collection: Optional[str], calcs: Sequence[Tuple[str, HklCalculation]]
+    ) -> List[str]:
+        records = [(name, serialization.dumps(calc)) for name, calc in calcs]
+        return self._segment(collection).append_many(records)
+
+    def _get_revision(self, collection: Optional[str], name: str) -> int:
+        return self._segment(collection).get(name, "get revision").revision
+
+    async def create(self, name: str, collection: Optional[str]) -> None:
+        """Create a HklCalculation object.
+
+        Args:
+            name: the unique name to attribute to the object
+            collection: the collection to store it inside.
+        """
+        hkl = HklCalculation(UBCalculation(name=name), Constraints())
+        self._revisions[hkl] = await executors.run(
+            "store.archive",
+            self._append,
+            collection,
+            _PUT,
+            name,
+            hkl,
+            None,
+            "create",
+            allow_process=False,
+        )
+
+    async def delete(self, name: str, collection: Optional[str]) -> None:
+        """Delete a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+        """
+        await executors.run(
+            "store.archive",
+            self._append,
+            collection,
+            _DELETE,
+            name,
+            None,
+            None,
+            "delete",
+            allow_process=False,
+        )
+
+    async def save(
+        self,
+        name: str,
+        calc: HklCalculation,
+        collection: Optional[str],
+        revision: Optional[int] = None,
+    ) -> None:
+        """Update a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            calc: the HklCalculation object to persist
+            collection: the collection inside which it is stored.
+            revision: the revision the record must be at to be overwritten.
+                Defaults to the revision the object was loaded at.
+        """
+        expected = revision if revision is not None else self._revisions.get(calc)
+        self._revisions[calc] = await executors.run(
+            "store.archive",
+            self._append,
+            collection,
+            _PUT,
+            name,
+            calc,
+            expected,
+            "save",
+            allow_process=False,
+        )
+
+    async def load(
+        self, name: str, collection: Optional[str], readonly: bool = False
+    ) -> HklCalculation:
+        """Load a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+            readonly: whether the object won't be modified. Ignored, as every load
+                returns a new object.
+
+        Returns:
+            The HklCalculation object.
+        """
+        hkl, revision = await executors.run(
+            "store.archive", self._load, collection, name, allow_process=False
+        )
+        self._revisions[hkl] = revision
+        return hkl
+
+    async def load_ubcalc(
+        self, name: str, collection: Optional[str], fields: Iterable[str]
+    ) -> UBCalculation:
+        """Load some fields of the UB calculation of a HklCalculation object.
+
+        Records are decoded straight from the mapping of the segment, which is
+        cheap enough that the whole object is loaded.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+            fields: keys of UBCalculation.asdict to retrieve
+
+        Returns:
+            The UB calculation.
+        """
+        hkl, _ = await executors.run(
+            "store.archive", self._load, collection, name, allow_process=False
+        )
+        return hkl.ubcalc
+
+    async def get_revision(self, name: str, collection: Optional[str]) -> int:
+        """Get the current revision of a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+
+        Returns:
+            The revision of the live record of the object.
+        """
+        return await executors.run(
+            "store.archive", self._get_revision, collection, name, allow_process=False
+        )
+
+    async def compact(self, collection: Optional[str]) -> None:
+        """Compact the segment of a collection, whatever its share of dead records.
+
+        Args:
+            collection: the collection to compact.
+        """
+        await executors.run(
+            "store.archive",
+            self._segment(collection).compact,
+            allow_process=False,
+        )
+
+    async def list_ubcalcs(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, UBCalculation, int]]:
+        """List a page of the HklCalculation objects of a collection, by name.
+
+        Args:
+            collection: the collection to list
+            after: only list objects whose name comes after this one
+            limit: maximum number of objects to list
+
+        Returns:
+            The name, UB calculation and current revision of each object.
+        """
+        page = await executors.run(
+            "store.archive",
+            self._load_many,
+            collection,
+            after,
+            limit,
+            allow_process=False,
+        )
+        return [(name, hkl.ubcalc, revision) for name, hkl, revision in page]
+
+    async def load_many(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, HklCalculation]]:
+        """Load a page of the HklCalculation objects of a collection, by name.
+
+        Args:
+            collection: the collection to load from
+            after: only load objects whose name comes after this one
+            limit: maximum number of objects to load
+
+        Returns:
+            The name of each object, and the object.
+        """
+        page = await executors.run(
+            "store.archive",
+            self._load_many,
+            collection,
+            after,
+            limit,
+            allow_process=False,
+        )
+        for _, hkl, revision in page:
+            self._revisions[hkl] = revision
+        return [(name, hkl) for name, hkl, _ in page]
+
+    async def create_many(
+        self, collection: Optional[str], calcs: Sequence[Tuple[str, HklCalculation]]
+    ) -> List[str]:
+        """Create many HklCalculation objects at once, appending them in one write.
+
+        Args:
+            collection: the collection to store them inside
+            calcs: the name of each object, and the object.
+
+        Returns:
+            The names which already existed, and were left untouched.
+        """
+        return await executors.run(
+            "store.archive", self._append_many, collection, calcs, allow_process=False
+        )
+
+    def loaded_revision(self, calc: HklCalculation) -> Optional[int]:
+        """Get the revision a HklCalculation object was at when loaded or saved.
+
+        Args:
+            calc: an object previously returned by load, or passed to save.
+
+        Returns:
+            The revision, or None if the object didn't pass through this store.
+        """
+        return self._revisions.get(calc)
@@ -0,0 +1,272 @@
+"""Defines an in-memory caching layer in front of another persistence layer."""
+
+import pickle
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Sequence, Tuple
+from weakref import WeakKeyDictionary
+
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_api.stores.protocol import HklCalcStore, close_store, create_store
+
+# time the entry was last checked, revision of the object, pickled object
+CacheEntry = Tuple[float, Optional[int], bytes]
+
+
+class CachingHklCalcStore:
+    """Class to keep recently used HklCalculation objects in memory.
+
+    Wraps any other store following diffcalc_api.stores.protocol, so that repeated
+    loads of the same crystal do not go back to the persistence layer. Entries
+    older than the time to live are revalidated against the current revision of the
+    persisted object, and only reloaded if it has changed. Entries are evicted
+    when the cache grows past its maximum size, least recently used first, and are
+    invalidated whenever the underlying object is saved or deleted through this store,
+    or through any other replica if the wrapped store publishes invalidations.
+    """
+
+    def __init__(
+        self, store_location: str, max_size: int = 128, ttl: float = 30.0, *args
+    ) -> None:
+        """Create the wrapped store and an empty cache.
+
+        Args:
+            store_location: fully qualified class name of the store to wrap
+            max_size: maximum number of HklCalculation objects to keep in memory
+            ttl: number of seconds before a cached object must be revalidated
+            args: arguments used to instantiate the wrapped store
+        """
+        self._store: HklCalcStore = create_store(store_location, *args)
+        self.responses = self._store.responses
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache: "OrderedDict[Tuple[str, str], CacheEntry]" = OrderedDict()
+        self._invalidations = 0
+        self._revisions: "WeakKeyDictionary[HklCalculation, int]" = WeakKeyDictionary()
+
+        on_invalidate = getattr(self._store, "on_invalidate", None)
+        if on_invalidate is not None:
+            on_invalidate(self.invalidate)
+
+    @staticmethod
+    def _key(name: str, collection: Optional[str]) -> Tuple[str, str]:
+        return (collection if collection else "default", name)
+
+    def invalidate(self, name: str, collection: Optional[str]) -> None:
+        """Remove a HklCalculation object from the cache, if present.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+        """
+        self._invalidations += 1
+        self._cache.pop(self._key(name, collection), None)
+
+    def clear(self) -> None:
+        """Remove all HklCalculation objects from the cache."""
+        self._invalidations += 1
+        self._cache.clear()
+
+    async def create(self, name: str, collection: Optional[str]) -> None:
+        """Create a HklCalculation object.
+
+        Args:
+            name: the unique name to attribute to the object
+            collection: the collection to store it inside.
+        """
+        self.invalidate(name, collection)
+        await self._store.create(name, collection)
+
+    async def delete(self, name: str, collection: Optional[str]) -> None:
+        """Delete a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+        """
+        self.invalidate(name, collection)
+        try:
+            await self._store.delete(name, collection)
+        finally:
+            self.invalidate(name, collection)
+
+    async def save(
+        self,
+        name: str,
+        calc: HklCalculation,
+        collection: Optional[str],
+        revision: Optional[int] = None,
+    ) -> None:
+        """Update a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            calc: the HklCalculation object to persist
+            collection: the collection inside which it is stored.
+            revision: the revision the object must be at to be overwritten.
+                Defaults to the revision the object was loaded at.
+        """
+        if revision is None:
+            revision = self._revisions.pop(calc, None)
+
+        self.invalidate(name, collection)
+        try:
+            await self._store.save(name, calc, collection, revision)
+        finally:
+            self.invalidate(name, collection)
+
+    async def load(
+        self, name: str, collection: Optional[str], readonly: bool = False
+    ) -> HklCalculation:
+        """Load a HklCalculation object, from memory if possible.
+
+        Objects are cached in their pickled form, so that every caller receives its
+        own copy and can modify it freely before saving.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+            readonly: whether the object won't be modified. Ignored, as every load
+                returns a new object.
+
+        Returns:
+            The HklCalculation object.
+        """
+        key = self._key(name, collection)
+        now = time.monotonic()
+        invalidations = self._invalidations
+
+        entry = self._cache.get(key)
+        if entry is not None:
+            checked_at, revision, blob = entry
+            fresh = now - checked_at < self.ttl
+            if not fresh and revision is not None:
+                current = await self._store.get_revision(name, collection)
+                fresh = current == revision and invalidations == self._invalidations
+                if fresh:
+                    self._cache[key] = (now, revision, blob)
+
+            if fresh:
+                self._cache.move_to_end(key)
+                hkl: HklCalculation = pickle.loads(blob)
+                if revision is not None:
+                    self._revisions[hkl] = revision
+                return hkl
+            self._cache.pop(key, None)
+
+        hkl = await self._store.load(name, collection)
+        revision = self._store.loaded_revision(hkl)
+        if revision is not None:
+            self._revisions[hkl] = revision
+
+        # don't cache the object if it was modified while we were waiting for it
+        if self.max_size > 0 and invalidations == self._invalidations:
+            self._cache[key] = (now, revision, pickle.dumps(hkl))
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+        return hkl
+
+    async def load_ubcalc(
+        self, name: str, collection: Optional[str], fields: Iterable[str]
+    ) -> UBCalculation:
+        """Load some fields of the UB calculation of a HklCalculation object.
+
+        Objects cached within their time to live are read from memory. Otherwise only
+        the requested fields are loaded from the wrapped store, and nothing is cached.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+            fields: keys of UBCalculation.asdict to retrieve
+
+        Returns:
+            The UB calculation, with other fields possibly left at default values.
+        """
+        entry = self._cache.get(self._key(name, collection))
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return (await self.load(name, collection)).ubcalc
+
+        return await self._store.load_ubcalc(name, collection, fields)
+
+    async def get_revision(self, name: str, collection: Optional[str]) -> int:
+        """Get the current revision of a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+
+        Returns:
+            The current revision, as reported by the wrapped store.
+        """
+        return await self._store.get_revision(name, collection)
+
+    async def list_ubcalcs(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, UBCalculation, int]]:
+        """List a page of the HklCalculation objects of a collection, by name.
+
+        Args:
+            collection: the collection to list
+            after: only list objects whose name comes after this one
+            limit: maximum number of objects to list
+
+        Returns:
+            The name, UB calculation and current revision of each object, as
+            reported by the wrapped store.
+        """
+        return await self._store.list_ubcalcs(collection, after, limit)
+
+    async def load_many(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, HklCalculation]]:
+        """Load a page of the HklCalculation objects of a collection, by name.
+
+        Pages are always loaded from the wrapped store.
+
+        Args:
+            collection: the collection to load from
+            after: only load objects whose name comes after this one
+            limit: maximum number of objects to load
+
+        Returns:
+            The name of each object, and the object.
+        """
+        return await self._store.load_many(collection, after, limit)
+
+    async def create_many(
+        self, collection: Optional[str], calcs: Sequence[Tuple[str, HklCalculation]]
+    ) -> List[str]:
+        """Create many HklCalculation objects at once, in the wrapped store.
+
+        Nothing is cached, as the objects may never be loaded.
+
+        Args:
+            collection: the collection to store them inside
+            calcs: the name of each object, and the object.
+
+        Returns:
+            The names which already existed, and were left untouched.
+        """
+        for name, _ in calcs:
+            self.invalidate(name, collection)
+        return await self._store.create_many(collection, calcs)
+
+    def loaded_revision(self, calc: HklCalculation) -> Optional[int]:
+        """Get the revision a HklCalculation object was at when loaded or saved.
+
+        Args:
+            calc: an object previously returned by load, or passed to save.
+
+        Returns:
+            The revision, or None if it is not known.
+        """
+        revision = self._revisions.get(calc)
+        return revision if revision is not None else self._store.loaded_revision(calc)
+
+    def close(self) -> None:
+        """Close the wrapped store, if it holds anything open."""
+        close_store(self._store)
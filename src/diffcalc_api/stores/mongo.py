@@ -1,12 +1,19 @@
 """Defines interactions with mongo persistence layer."""
 
-from typing import Any, Dict, Optional
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from weakref import WeakKeyDictionary
 
 import numpy as np
 from diffcalc.hkl.calc import HklCalculation
 from diffcalc.hkl.constraints import Constraints
 from diffcalc.ub.calc import UBCalculation
 from motor.motor_asyncio import AsyncIOMotorCollection as Collection
+from motor.motor_asyncio import AsyncIOMotorCursor as Cursor
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 from pymongo.results import DeleteResult
 
 from diffcalc_api.database import database
@@ -15,6 +22,88 @@ from diffcalc_api.errors.definitions import (
     DiffcalcAPIException,
     ErrorCodesBase,
 )
+from diffcalc_api.stores import serialization
+from diffcalc_api.stores.protocol import LISTED_FIELDS, partial_ubcalc
+
+logger = logging.getLogger(__name__)
+
+# field holding objects saved in the compact binary format
+BINARY_FIELD = "binary"
+# unique index on the name of the UB calculation
+NAME_INDEX = "ubcalc_name"
+# number of loaded or saved documents remembered, to compute what a save changes
+SNAPSHOTS = 256
+# error code of writes rejected by a unique index
+DUPLICATE_KEY = 11000
+
+
+def _plain(value: Any) -> Any:
+    """Convert tuples to lists throughout a document, as mongo returns them."""
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+def _diff_list(
+    path: str, old: List[Any], new: List[Any], update: Dict[str, Dict[str, Any]]
+) -> None:
+    """Add the operators turning one array into another to an update."""
+    if len(new) >= len(old) and new[: len(old)] == old:
+        update["$push"][path] = {"$each": new[len(old) :]}
+        return
+
+    if len(new) == len(old):
+        for index, (before, after) in enumerate(zip(old, new)):
+            if before != after:
+                update["$set"][f"{path}.{index}"] = after
+        return
+
+    # $pull removes every equal element, so only use it for elements which are unique
+    removed = [item for item in old if item not in new]
+    if (
+        len(new) + len(removed) == len(old)
+        and [item for item in old if item in new] == new
+        and all(old.count(item) == 1 for item in removed)
+    ):
+        update["$pull"][path] = {"$in": removed}
+        return
+
+    update["$set"][path] = new
+
+
+def diff(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Compute the update operators turning one HklCalculation document into another.
+
+    Fields of the UB calculation are set individually, reflections and orientations
+    appended with $push or removed with $pull where possible, and anything else
+    which changed is set as a whole.
+
+    Args:
+        old: the document as it is stored
+        new: the document, as produced by HklCalculation.asdict, to store instead.
+
+    Returns:
+        Update operators, with only those fields which changed.
+    """
+    update: Dict[str, Dict[str, Any]] = {"$set": {}, "$push": {}, "$pull": {}}
+    old, new = _plain(old), _plain(new)
+
+    old_ubcalc: Dict[str, Any] = old.get("ubcalc", {})
+    for field, value in new["ubcalc"].items():
+        before = old_ubcalc.get(field)
+        if before == value:
+            continue
+        if isinstance(before, list) and field in ("reflist", "orientlist"):
+            _diff_list(f"ubcalc.{field}", before, value, update)
+        else:
+            update["$set"][f"ubcalc.{field}"] = value
+
+    if old.get("constraints") != new["constraints"]:
+        update["$set"]["constraints"] = new["constraints"]
+
+    return {operator: fields for operator, fields in update.items() if fields}
 
 
 class ErrorCodes(ErrorCodesBase):
@@ -26,6 +115,7 @@ class ErrorCodes(ErrorCodesBase):
 
     OVERWRITE_ERROR = 405
     DOCUMENT_NOT_FOUND_ERROR = 404
+    REVISION_CONFLICT_ERROR = 409
 
 
 class OverwriteError(DiffcalcAPIException):
@@ -50,19 +140,92 @@ class DocumentNotFoundError(DiffcalcAPIException):
         self.status_code = ErrorCodes.DOCUMENT_NOT_FOUND_ERROR
 
 
+class RevisionConflictError(DiffcalcAPIException):
+    """Thrown if a HklCalculation object was modified since it was loaded."""
+
+    def __init__(self, name: str, revision: int) -> None:
+        """Set detail and status code of the error."""
+        self.detail = (
+            f"Document for crystal {name} has changed since revision {revision}!"
+            f"\nAnother request modified it concurrently, please retry."
+        )
+        self.status_code = ErrorCodes.REVISION_CONFLICT_ERROR
+
+
 class MongoHklCalcStore:
-    """Class to use mongo db as a persistence layer for the API."""
+    """Class to use mongo db as a persistence layer for the API.
 
-    def __init__(
-        self,
-    ) -> None:
+    Every document carries a revision field, incremented on each save. The revision
+    each HklCalculation object was loaded at is remembered, so that saving it back
+    only succeeds if nobody else has saved the document in the meantime. New
+    documents start at a revision taken from the clock, so that an object loaded
+    before its crystal was deleted and re-created cannot be saved over the new one.
+
+    Objects are either stored as the nested document produced by
+    HklCalculation.asdict, or in the compact format of
+    diffcalc_api.stores.serialization under a binary field, next to the name of the
+    UB calculation. Documents in either format can always be loaded, and are
+    converted to the selected format the next time they are saved.
+
+    Each collection is given a unique index on the name of the UB calculation the
+    first time it is used, so that lookups by name don't scan the collection and
+    creating a crystal which already exists fails atomically.
+    """
+
+    def __init__(self, binary: bool = False) -> None:
         """Set error codes that could be thrown during method excecution.
 
-        Purely for documentation purposes.
+        Error codes are purely for documentation purposes.
+
+        Args:
+            binary: whether to save objects in the compact binary format.
         """
         self.responses = {
             code: ALL_RESPONSES[code] for code in np.unique(ErrorCodes.all_codes())
         }
+        self.binary = binary
+        self._revisions: "WeakKeyDictionary[HklCalculation, int]" = WeakKeyDictionary()
+        self._unique: Dict[str, bool] = {}
+        self._snapshots: "OrderedDict[Tuple[str, str, int], Dict[str, Any]]" = (
+            OrderedDict()
+        )
+
+    def _remember(
+        self, collection: Optional[str], name: str, revision: int, document: Any
+    ) -> None:
+        """Remember a document as stored at a revision, to diff later saves against."""
+        key = (collection if collection else "default", name, revision)
+        self._snapshots[key] = _plain(document)
+        self._snapshots.move_to_end(key)
+        while len(self._snapshots) > SNAPSHOTS:
+            self._snapshots.popitem(last=False)
+
+    def _forget(self, collection: Optional[str], name: str) -> None:
+        """Forget every document remembered for a name, at any revision."""
+        crystal = (collection if collection else "default", name)
+        for key in [key for key in self._snapshots if key[:2] == crystal]:
+            del self._snapshots[key]
+
+    async def _collection(self, collection: Optional[str]) -> Collection:
+        """Get a collection, making sure it is indexed by name.
+
+        Args:
+            collection: name of the collection, or None for the default one.
+
+        Returns:
+            The collection.
+        """
+        name = collection if collection else "default"
+        coll: Collection = database[name]
+        if name not in self._unique:
+            try:
+                await coll.create_index("ubcalc.name", unique=True, name=NAME_INDEX)
+                self._unique[name] = True
+            except OperationFailure as e:
+                # existing documents share a name, so the index can't be unique
+                logger.warning(f"Cannot index collection {name} by name: {e}")
+                self._unique[name] = False
+        return coll
 
     async def create(self, name: str, collection: Optional[str]) -> None:
         """Create a HklCalculation object.
@@ -71,16 +234,38 @@ class MongoHklCalcStore:
             name: the unique name to attribute to the object
             collection: the collection to store it inside.
         """
-        coll: Collection = database[collection if collection else "default"]
+        coll = await self._collection(collection)
 
-        if await coll.find_one({"ubcalc.name": name}):
-            raise OverwriteError(name)
+        if not self._unique[collection if collection else "default"]:
+            if await coll.find_one({"ubcalc.name": name}):
+                raise OverwriteError(name)
 
         ubcalc = UBCalculation(name=name)
         constraints = Constraints()
         hkl = HklCalculation(ubcalc, constraints)
 
-        await coll.insert_one(hkl.asdict)
+        try:
+            await coll.insert_one(
+                {**self._document(hkl), "revision": time.time_ns()}
+            )
+        except DuplicateKeyError:
+            raise OverwriteError(name)
+
+    def _document(self, hkl: HklCalculation) -> Dict[str, Any]:
+        if self.binary:
+            return {
+                "ubcalc": {"name": hkl.ubcalc.name},
+                BINARY_FIELD: serialization.dumps(hkl),
+            }
+        return hkl.asdict
+
+    @staticmethod
+    def _page(
+        coll: Collection, after: Optional[str], limit: int, projection: Any
+    ) -> Cursor:
+        """Find a page of documents, in order of name."""
+        query = {"ubcalc.name": {"$gt": after}} if after is not None else {}
+        return coll.find(query, projection).sort("ubcalc.name", 1).limit(limit)
 
     async def delete(self, name: str, collection: Optional[str]) -> None:
         """Delete a HklCalculation object.
@@ -89,36 +274,278 @@ class MongoHklCalcStore:
             name: the name by which to retrieve the object
             collection: the collection inside which it is stored.
         """
-        coll: Collection = database[collection if collection else "default"]
+        coll = await self._collection(collection)
         result: DeleteResult = await coll.delete_one({"ubcalc.name": name})
+        self._forget(collection, name)
         if result.deleted_count == 0:
             raise DocumentNotFoundError(name, "delete")
 
     async def save(
-        self, name: str, hkl: HklCalculation, collection: Optional[str]
+        self,
+        name: str,
+        hkl: HklCalculation,
+        collection: Optional[str],
+        revision: Optional[int] = None,
     ) -> None:
         """Update a HklCalculation object.
 
         Args:
             name: the name by which to retrieve the object
+            hkl: the HklCalculation object to persist
             collection: the collection inside which it is stored.
+            revision: the revision the document must be at to be overwritten.
+                Defaults to the revision the object was loaded at.
         """
-        coll: Collection = database[collection if collection else "default"]
-        await coll.find_one_and_update({"ubcalc.name": name}, {"$set": hkl.asdict})
+        coll = await self._collection(collection)
+        expected = revision if revision is not None else self._revisions.get(hkl)
+
+        query: Dict[str, Any] = {"ubcalc.name": name}
+        if expected is not None:
+            # documents created before revisions were introduced have no such field
+            query["revision"] = expected if expected else {"$in": [0, None]}
+
+        document = self._document(hkl)
+        snapshot = (
+            self._snapshots.pop(
+                (collection if collection else "default", name, expected), None
+            )
+            if expected is not None and not self.binary
+            else None
+        )
+        # only the changes are sent if the stored document is known
+        update: Dict[str, Any] = (
+            diff(snapshot, document)
+            if snapshot is not None
+            else {
+                "$set": document,
+                "$unset": {"constraints": ""} if self.binary else {BINARY_FIELD: ""},
+            }
+        )
+
+        result: Optional[Dict[str, Any]] = await coll.find_one_and_update(
+            query,
+            {**update, "$inc": {"revision": 1}},
+            projection={"revision": True},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not result:
+            if expected is not None and await coll.count_documents(
+                {"ubcalc.name": name}, limit=1
+            ):
+                raise RevisionConflictError(name, expected)
+            raise DocumentNotFoundError(name, "save")
+
+        self._revisions[hkl] = result["revision"]
+        if not self.binary:
+            self._remember(collection, name, result["revision"], document)
 
-    async def load(self, name: str, collection: Optional[str]) -> HklCalculation:
+    async def load(
+        self, name: str, collection: Optional[str], readonly: bool = False
+    ) -> HklCalculation:
         """Load a HklCalculation object.
 
         Args:
             name: the name by which to retrieve the object
             collection: the collection inside which it is stored.
+            readonly: whether the object won't be modified. Ignored, as every load
+                returns a new object.
 
         Returns:
             The HklCalculation object.
         """
-        coll: Collection = database[collection if collection else "default"]
+        coll = await self._collection(collection)
         hkl_json: Optional[Dict[str, Any]] = await coll.find_one({"ubcalc.name": name})
         if not hkl_json:
             raise DocumentNotFoundError(name, "load")
 
-        return HklCalculation.fromdict(hkl_json)
+        binary: Optional[bytes] = hkl_json.get(BINARY_FIELD)
+        hkl = (
+            serialization.loads(binary)
+            if binary is not None
+            else HklCalculation.fromdict(hkl_json)
+        )
+        self._revisions[hkl] = hkl_json.get("revision", 0)
+        if binary is None:
+            self._remember(
+                collection,
+                name,
+                self._revisions[hkl],
+                {"ubcalc": hkl_json["ubcalc"], "constraints": hkl_json["constraints"]},
+            )
+        return hkl
+
+    async def load_ubcalc(
+        self, name: str, collection: Optional[str], fields: Iterable[str]
+    ) -> UBCalculation:
+        """Load some fields of the UB calculation of a HklCalculation object.
+
+        Only the requested fields are retrieved, using a projection. Objects saved in
+        the binary format can't be projected, and are loaded in full.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+            fields: keys of UBCalculation.asdict to retrieve
+
+        Returns:
+            The UB calculation, with other fields left at their default values.
+        """
+        coll = await self._collection(collection)
+        projection = {f"ubcalc.{field}": True for field in fields}
+        result: Optional[Dict[str, Any]] = await coll.find_one(
+            {"ubcalc.name": name}, {"_id": False, BINARY_FIELD: True, **projection}
+        )
+        if result is None:
+            raise DocumentNotFoundError(name, "load")
+
+        binary: Optional[bytes] = result.get(BINARY_FIELD)
+        if binary is not None:
+            return serialization.loads(binary).ubcalc
+        return partial_ubcalc(result["ubcalc"])
+
+    async def get_revision(self, name: str, collection: Optional[str]) -> int:
+        """Get the current revision of a HklCalculation object.
+
+        Only the revision field is retrieved, which makes this much cheaper than
+        loading the object.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+
+        Returns:
+            The number of times the object has been saved.
+        """
+        coll = await self._collection(collection)
+        result: Optional[Dict[str, Any]] = await coll.find_one(
+            {"ubcalc.name": name}, {"_id": False, "revision": True}
+        )
+        if result is None:
+            raise DocumentNotFoundError(name, "get revision")
+
+        return result.get("revision", 0)
+
+    async def list_ubcalcs(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, UBCalculation, int]]:
+        """List a page of the HklCalculation objects of a collection, by name.
+
+        Only the listed fields are retrieved, using a projection, in the order of the
+        index on name. Objects saved in the binary format are loaded in full.
+
+        Args:
+            collection: the collection to list
+            after: only list objects whose name comes after this one
+            limit: maximum number of objects to list
+
+        Returns:
+            The name, UB calculation and current revision of each object.
+        """
+        coll = await self._collection(collection)
+        projection = {f"ubcalc.{field}": True for field in LISTED_FIELDS}
+        documents: List[Dict[str, Any]] = await self._page(
+            coll,
+            after,
+            limit,
+            {"_id": False, "revision": True, BINARY_FIELD: True, **projection},
+        ).to_list(length=limit)
+
+        page = []
+        for document in documents:
+            binary: Optional[bytes] = document.get(BINARY_FIELD)
+            ubcalc = (
+                serialization.loads(binary).ubcalc
+                if binary is not None
+                else partial_ubcalc(document["ubcalc"])
+            )
+            page.append(
+                (document["ubcalc"]["name"], ubcalc, document.get("revision", 0))
+            )
+        return page
+
+    async def load_many(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, HklCalculation]]:
+        """Load a page of the HklCalculation objects of a collection, by name.
+
+        Args:
+            collection: the collection to load from
+            after: only load objects whose name comes after this one
+            limit: maximum number of objects to load
+
+        Returns:
+            The name of each object, and the object.
+        """
+        coll = await self._collection(collection)
+        documents: List[Dict[str, Any]] = await self._page(
+            coll, after, limit, {"_id": False}
+        ).to_list(length=limit)
+
+        page = []
+        for document in documents:
+            binary: Optional[bytes] = document.get(BINARY_FIELD)
+            hkl = (
+                serialization.loads(binary)
+                if binary is not None
+                else HklCalculation.fromdict(document)
+            )
+            self._revisions[hkl] = document.get("revision", 0)
+            page.append((document["ubcalc"]["name"], hkl))
+        return page
+
+    async def create_many(
+        self, collection: Optional[str], calcs: Sequence[Tuple[str, HklCalculation]]
+    ) -> List[str]:
+        """Create many HklCalculation objects at once, with a single insert_many.
+
+        The insert is unordered, so that documents rejected by the unique index on
+        name don't stop the others from being inserted.
+
+        Args:
+            collection: the collection to store them inside
+            calcs: the name of each object, and the object.
+
+        Returns:
+            The names which already existed, and were left untouched.
+        """
+        coll = await self._collection(collection)
+        documents = []
+        revision = time.time_ns()
+        for name, hkl in calcs:
+            document = self._document(hkl)
+            document["ubcalc"] = {**document["ubcalc"], "name": name}
+            documents.append({**document, "revision": revision})
+
+        skipped: List[str] = []
+        if not self._unique[collection if collection else "default"]:
+            existing = {
+                document["ubcalc"]["name"]
+                for document in await coll.find(
+                    {"ubcalc.name": {"$in": [name for name, _ in calcs]}},
+                    {"_id": False, "ubcalc.name": True},
+                ).to_list(length=None)
+            }
+            skipped = [name for name, _ in calcs if name in existing]
+            documents = [d for d in documents if d["ubcalc"]["name"] not in existing]
+
+        if not documents:
+            return skipped
+        try:
+            await coll.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            errors: List[Dict[str, Any]] = e.details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            skipped += [documents[error["index"]]["ubcalc"]["name"] for error in errors]
+        return skipped
+
+    def loaded_revision(self, hkl: HklCalculation) -> Optional[int]:
+        """Get the revision a HklCalculation object was at when loaded or saved.
+
+        Args:
+            hkl: an object previously returned by load, or passed to save.
+
+        Returns:
+            The revision, or None if the object didn't pass through this store.
+        """
+        return self._revisions.get(hkl)
@@ -1,20 +1,123 @@
 """Defines interactions with a file system persistence layer."""
 
+import asyncio
+import bisect
+import contextlib
+import json
+import os
 import pickle
+import struct
+import tempfile
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+from weakref import WeakKeyDictionary, WeakValueDictionary
 
 import numpy as np
 from diffcalc.hkl.calc import HklCalculation
 from diffcalc.hkl.constraints import Constraints
 from diffcalc.ub.calc import UBCalculation
 
+from diffcalc_api import executors
 from diffcalc_api.config import SAVE_PICKLES_FOLDER
 from diffcalc_api.errors.definitions import (
     ALL_RESPONSES,
     DiffcalcAPIException,
     ErrorCodesBase,
 )
+from diffcalc_api.stores import serialization
+from diffcalc_api.stores.protocol import partial_ubcalc
+
+# directory inside each collection holding the summary of every file
+SUMMARY_DIRECTORY = ".summaries"
+# fields of UBCalculation.asdict kept in each summary
+SUMMARY_FIELDS = ("name", "crystal", "reference", "surface", "u_matrix", "ub_matrix")
+# directory inside each collection holding the lock file of every file
+LOCK_DIRECTORY = ".locks"
+
+# start of every file, followed by the revision of its contents
+REVISION_MAGIC = b"DCRV"
+REVISION_HEADER = struct.Struct("<4sQ")
+
+# revision of the file when read, the serialized object, and the object once decoded
+DecodeEntry = Tuple[int, bytes, Optional[HklCalculation]]
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where only this process is locked
+    fcntl = None  # type: ignore
+
+# the umask can only be read by setting it, so it is read once, before any threads
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+# mode of new files, as if created by open() rather than tempfile.mkstemp
+NEW_FILE_MODE = 0o666 & ~_UMASK
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    """Write a file by renaming a complete temporary file over it.
+
+    Readers see either the old or the new contents, never a partial write, even if
+    the process dies half way through. The file keeps its permissions, and new
+    files get those of any other new file.
+    """
+    try:
+        mode = path.stat().st_mode & 0o7777
+    except OSError:
+        mode = NEW_FILE_MODE
+
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as stream:
+            if hasattr(os, "fchmod"):
+                os.fchmod(stream.fileno(), mode)
+            else:  # not available on Windows
+                os.chmod(temp, mode)
+            stream.write(data)
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temp)
+        raise
+
+    # make the rename itself durable, where directories can be synced
+    with contextlib.suppress(OSError):
+        directory = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+def _split(data: bytes) -> Tuple[int, bytes]:
+    """Split the contents of a file into its revision and the serialized object.
+
+    Files written before revisions were kept in them are at revision 0.
+    """
+    if data[: len(REVISION_MAGIC)] != REVISION_MAGIC:
+        return 0, data
+    _, revision = REVISION_HEADER.unpack_from(data)
+    return revision, data[REVISION_HEADER.size :]
+
+
+@contextlib.contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock for a file, shared with other processes if possible."""
+    if fcntl is None:
+        yield
+        return
+
+    lock_path = path.parent / LOCK_DIRECTORY / path.name
+    lock_path.parent.mkdir(exist_ok=True)
+    with open(lock_path, "a") as stream:
+        fcntl.flock(stream.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(stream.fileno(), fcntl.LOCK_UN)
 
 
 class ErrorCodes(ErrorCodesBase):
@@ -22,6 +125,7 @@ class ErrorCodes(ErrorCodesBase):
 
     OVERWRITE_ERROR = 405
     FILE_NOT_FOUND_ERROR = 404
+    REVISION_CONFLICT_ERROR = 409
 
 
 class OverwriteError(DiffcalcAPIException):
@@ -51,19 +155,268 @@ class FileNotFoundError(DiffcalcAPIException):
         self.status_code = ErrorCodes.FILE_NOT_FOUND_ERROR
 
 
+class RevisionConflictError(DiffcalcAPIException):
+    """Thrown if a HklCalculation object was modified since it was loaded."""
+
+    def __init__(self, name):
+        """Set detail and status code."""
+        self.detail = (
+            f"File for crystal {name} has changed since it was loaded!"
+            f"\nAnother request modified it concurrently, please retry."
+        )
+        self.status_code = ErrorCodes.REVISION_CONFLICT_ERROR
+
+
 class PicklingHklCalcStore:
-    """Class to use the file system as a persistence layer for the API."""
+    """Class to use the file system as a persistence layer for the API.
+
+    Each file starts with its revision, a counter incremented by every save under
+    the file lock. Creating a file starts the counter at the current time in
+    nanoseconds, so that a crystal deleted and created again never repeats the
+    revisions of the one before.
+
+    Objects are either pickled, or saved in the compact format of
+    diffcalc_api.stores.serialization. Files in either format can always be loaded.
+
+    Next to each file, a small JSON summary holds the fields of the UB calculation
+    other than its reflections and orientations, with the revision they were
+    written at. Partial loads read the summary instead of the whole file, as long
+    as it is still at the revision of the file.
+
+    All file access runs on the "store.file" executor route, off the event loop.
+    Files are replaced atomically, and writes to the same file are serialised by a
+    lock, held across processes where the platform supports it.
+
+    The contents of recently used files are kept in a decode cache, validated on
+    every use against the revision of the file, which only takes reading its first
+    few bytes. Loads from the cache skip reading the file, but still decode
+    a private copy, as callers may modify it. Readonly loads and partial loads
+    don't modify the object, so they share one decoded object and skip decoding
+    too. Copying the decoded object would take longer than decoding it again.
+    """
 
     _root_directory: Path = Path(SAVE_PICKLES_FOLDER)
 
-    def __init__(self) -> None:
+    def __init__(self, binary: bool = False, cache_size: int = 128) -> None:
         """Set error codes that could be thrown during method excecution.
 
-        Purely for documentation purposes.
+        Error codes are purely for documentation purposes.
+
+        Args:
+            binary: whether to save objects in the compact binary format.
+            cache_size: maximum number of files in the decode cache.
         """
         self.responses = {
             code: ALL_RESPONSES[code] for code in np.unique(ErrorCodes.all_codes())
         }
+        self.binary = binary
+        self._revisions: "WeakKeyDictionary[HklCalculation, int]" = WeakKeyDictionary()
+        self._locks: "WeakValueDictionary[Path, asyncio.Lock]" = WeakValueDictionary()
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Path, DecodeEntry]" = OrderedDict()
+
+    def _directory(self, collection: Optional[str]) -> Path:
+        return self._root_directory / (collection if collection else "default")
+
+    def _path(self, name: str, collection: Optional[str]) -> Path:
+        return self._directory(collection) / name
+
+    @staticmethod
+    def _names(directory: Path, after: Optional[str], limit: int) -> List[str]:
+        """List a page of the files of a collection, in order of name.
+
+        Summaries, locks and temporary files are all hidden, and are skipped.
+        """
+        try:
+            with os.scandir(directory) as entries:
+                names = sorted(
+                    entry.name
+                    for entry in entries
+                    if not entry.name.startswith(".") and entry.is_file()
+                )
+        except OSError:
+            return []
+
+        start = bisect.bisect_right(names, after) if after is not None else 0
+        return names[start : start + limit]
+
+    def _lock(self, path: Path) -> asyncio.Lock:
+        lock = self._locks.get(path)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[path] = lock
+        return lock
+
+    @staticmethod
+    def _summary_path(file_path: Path) -> Path:
+        return file_path.parent / SUMMARY_DIRECTORY / file_path.name
+
+    def _write_summary(
+        self, file_path: Path, calc: HklCalculation, revision: int
+    ) -> None:
+        summary_path = self._summary_path(file_path)
+        summary_path.parent.mkdir(exist_ok=True)
+
+        ubcalc = calc.ubcalc.asdict
+        summary = {field: ubcalc[field] for field in SUMMARY_FIELDS}
+        _atomic_write(
+            summary_path, json.dumps({"revision": revision, "ubcalc": summary}).encode()
+        )
+
+    def _write(
+        self,
+        path: Path,
+        calc: HklCalculation,
+        expected: Optional[int],
+        exclusive: bool = False,
+    ) -> Tuple[int, bytes]:
+        data = serialization.dumps(calc) if self.binary else pickle.dumps(calc)
+        path.parent.mkdir(exist_ok=True)
+
+        with _file_lock(path):
+            try:
+                current: Optional[int] = self._read_revision(path)
+            except FileNotFoundError:
+                current = None
+
+            if current is not None and exclusive:
+                raise OverwriteError(path.name)
+            if current is not None and expected is not None and current != expected:
+                raise RevisionConflictError(path.name)
+
+            revision = current + 1 if current is not None else time.time_ns()
+            _atomic_write(path, REVISION_HEADER.pack(REVISION_MAGIC, revision) + data)
+            self._write_summary(path, calc, revision)
+
+        return revision, data
+
+    def _remove(self, path: Path) -> None:
+        # the lock directory is not created for collections which don't exist
+        if not path.is_file():
+            raise FileNotFoundError(path.name)
+
+        with _file_lock(path):
+            try:
+                path.unlink()
+            except OSError:
+                raise FileNotFoundError(path.name)
+            self._summary_path(path).unlink(missing_ok=True)
+
+    @staticmethod
+    def _read(path: Path) -> Tuple[int, bytes]:
+        try:
+            data = path.read_bytes()
+        except OSError:
+            raise FileNotFoundError(path.name)
+        return _split(data)
+
+    @staticmethod
+    def _read_revision(path: Path) -> int:
+        try:
+            with open(path, "rb") as stream:
+                header = stream.read(REVISION_HEADER.size)
+        except OSError:
+            raise FileNotFoundError(path.name)
+        return _split(header)[0]
+
+    @staticmethod
+    def _decode(data: bytes) -> HklCalculation:
+        return (
+            serialization.loads(data)
+            if serialization.is_binary(data)
+            else pickle.loads(data)
+        )
+
+    @staticmethod
+    def _read_summary(path: Path, fields: Iterable[str]) -> Optional[UBCalculation]:
+        try:
+            summary = json.loads(PicklingHklCalcStore._summary_path(path).read_text())
+            revision = PicklingHklCalcStore._read_revision(path)
+            if summary["revision"] == revision:
+                ubcalc = summary["ubcalc"]
+                return partial_ubcalc({field: ubcalc[field] for field in fields})
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def _list(
+        self, directory: Path, after: Optional[str], limit: int
+    ) -> List[Tuple[str, UBCalculation, int]]:
+        page = []
+        for name in self._names(directory, after, limit):
+            path = directory / name
+            try:
+                revision = self._read_revision(path)
+                ubcalc = self._read_summary(path, SUMMARY_FIELDS)
+                if ubcalc is None:
+                    revision, data = self._read(path)
+                    ubcalc = self._decode(data).ubcalc
+            except FileNotFoundError:  # deleted since the directory was listed
+                continue
+            page.append((name, ubcalc, revision))
+        return page
+
+    def _read_many(
+        self, directory: Path, after: Optional[str], limit: int
+    ) -> List[Tuple[str, int, HklCalculation]]:
+        page = []
+        for name in self._names(directory, after, limit):
+            try:
+                revision, data = self._read(directory / name)
+            except FileNotFoundError:  # deleted since the directory was listed
+                continue
+            page.append((name, revision, self._decode(data)))
+        return page
+
+    def _write_many(
+        self, directory: Path, calcs: Sequence[Tuple[str, HklCalculation]]
+    ) -> Tuple[List[str], List[Tuple[HklCalculation, int]]]:
+        skipped, written = [], []
+        for name, calc in calcs:
+            try:
+                revision, _ = self._write(directory / name, calc, None, True)
+            except OverwriteError:
+                skipped.append(name)
+                continue
+            written.append((calc, revision))
+        return skipped, written
+
+    def _remember(self, path: Path, entry: DecodeEntry) -> None:
+        if self.cache_size <= 0:
+            return
+        self._cache[path] = entry
+        self._cache.move_to_end(path)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _shared(self, path: Path, entry: DecodeEntry) -> HklCalculation:
+        """Get the decoded object of a decode cache entry, decoding it once."""
+        revision, data, hkl = entry
+        if hkl is not None:
+            return hkl
+
+        decoded: HklCalculation = await executors.run(
+            "store.file", self._decode, data, allow_process=False
+        )
+        if self._cache.get(path) is entry:
+            self._cache[path] = (revision, data, decoded)
+        return decoded
+
+    async def _cached(self, path: Path) -> Optional[DecodeEntry]:
+        """Get the decode cache entry of a file, if the file hasn't changed since."""
+        entry = self._cache.get(path)
+        if entry is None:
+            return None
+
+        revision = await executors.run(
+            "store.file", self._read_revision, path, allow_process=False
+        )
+        if self._cache.get(path) is not entry or entry[0] != revision:
+            self._cache.pop(path, None)
+            return None
+
+        self._cache.move_to_end(path)
+        return entry
 
     async def create(self, name: str, collection: Optional[str]) -> None:
         """Create a HklCalculation object.
@@ -72,21 +425,19 @@ class PicklingHklCalcStore:
             name: the unique name to attribute to the object
             collection: the collection to store it inside.
         """
-        pickled_file = (
-            Path(SAVE_PICKLES_FOLDER) / (collection if collection else "default") / name
-        )
-
-        if (pickled_file).is_file():
-            raise OverwriteError(name)
-
-        if not (pickled_file.parent).is_dir():
-            pickled_file.parent.mkdir()
+        path = self._path(name, collection)
 
         ubcalc = UBCalculation(name=name)
         constraints = Constraints()
         hkl = HklCalculation(ubcalc, constraints)
 
-        await self.save(name, hkl, collection)
+        async with self._lock(path):
+            revision, data = await executors.run(
+                "store.file", self._write, path, hkl, None, True, allow_process=False
+            )
+            self._remember(path, (revision, data, None))
+
+        self._revisions[hkl] = revision
 
     async def delete(self, name: str, collection: Optional[str]) -> None:
         """Delete a HklCalculation object.
@@ -95,46 +446,213 @@ class PicklingHklCalcStore:
             name: the name by which to retrieve the object
             collection: the collection inside which it is stored.
         """
-        pickled_file = (
-            Path(SAVE_PICKLES_FOLDER) / (collection if collection else "default") / name
-        )
-        if not pickled_file.is_file():
-            raise FileNotFoundError(name)
-
-        Path(pickled_file).unlink()
+        path = self._path(name, collection)
+        async with self._lock(path):
+            self._cache.pop(path, None)
+            await executors.run("store.file", self._remove, path, allow_process=False)
 
     async def save(
-        self, name: str, calc: HklCalculation, collection: Optional[str]
+        self,
+        name: str,
+        calc: HklCalculation,
+        collection: Optional[str],
+        revision: Optional[int] = None,
     ) -> None:
         """Update a HklCalculation object.
 
         Args:
             name: the name by which to retrieve the object
+            calc: the HklCalculation object to persist
             collection: the collection inside which it is stored.
+            revision: the revision the file must be at to be overwritten.
+                Defaults to the revision the object was loaded at.
         """
-        file_path = (
-            self._root_directory / (collection if collection else "default") / name
-        )
-        with open(file_path, "wb") as stream:
-            pickle.dump(obj=calc, file=stream)
+        path = self._path(name, collection)
+        expected = revision if revision is not None else self._revisions.get(calc)
+
+        async with self._lock(path):
+            self._cache.pop(path, None)
+            written, data = await executors.run(
+                "store.file", self._write, path, calc, expected, allow_process=False
+            )
+            self._remember(path, (written, data, None))
+
+        self._revisions[calc] = written
 
-    async def load(self, name: str, collection: Optional[str]) -> HklCalculation:
+    async def load(
+        self, name: str, collection: Optional[str], readonly: bool = False
+    ) -> HklCalculation:
         """Load a HklCalculation object.
 
         Args:
             name: the name by which to retrieve the object
             collection: the collection inside which it is stored.
+            readonly: whether the object won't be modified, in which case the
+                object decoded for the decode cache is shared with other callers.
 
         Returns:
             The HklCalculation object.
         """
-        file_path = (
-            self._root_directory / (collection if collection else "default") / name
+        path = self._path(name, collection)
+        entry = await self._cached(path)
+        if entry is None:
+            revision, data = await executors.run(
+                "store.file", self._read, path, allow_process=False
+            )
+            entry = (revision, data, None)
+            self._remember(path, entry)
+
+        hkl: HklCalculation = (
+            await self._shared(path, entry)
+            if readonly
+            else await executors.run(
+                "store.file", self._decode, entry[1], allow_process=False
+            )
         )
-        if not file_path.is_file():
-            raise FileNotFoundError(name)
+        self._revisions[hkl] = entry[0]
+        return hkl
 
-        with open(file_path, "rb") as stream:
-            hkl: HklCalculation = pickle.load(stream)
+    async def load_ubcalc(
+        self, name: str, collection: Optional[str], fields: Iterable[str]
+    ) -> UBCalculation:
+        """Load some fields of the UB calculation of a HklCalculation object.
 
-        return hkl
+        Files in the decode cache are read from it. Otherwise fields in the summary
+        are read from it, unless it is missing or out of date, in which case the whole
+        file is loaded and the summary rewritten.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+            fields: keys of UBCalculation.asdict to retrieve
+
+        Returns:
+            The UB calculation, with other fields left at their default values.
+        """
+        path = self._path(name, collection)
+        entry = await self._cached(path)
+        if entry is not None:
+            return (await self._shared(path, entry)).ubcalc
+
+        requested = set(fields)
+        if requested.issubset(SUMMARY_FIELDS):
+            ubcalc: Optional[UBCalculation] = await executors.run(
+                "store.file", self._read_summary, path, requested, allow_process=False
+            )
+            if ubcalc is not None:
+                return ubcalc
+
+        hkl = await self.load(name, collection, readonly=True)
+        async with self._lock(path):
+            await executors.run(
+                "store.file",
+                self._write_summary,
+                path,
+                hkl,
+                self._revisions[hkl],
+                allow_process=False,
+            )
+        return hkl.ubcalc
+
+    async def get_revision(self, name: str, collection: Optional[str]) -> int:
+        """Get the current revision of a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+
+        Returns:
+            The revision of the file.
+        """
+        return await executors.run(
+            "store.file",
+            self._read_revision,
+            self._path(name, collection),
+            allow_process=False,
+        )
+
+    async def list_ubcalcs(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, UBCalculation, int]]:
+        """List a page of the HklCalculation objects of a collection, by name.
+
+        The UB calculation of each object is read from its summary where possible.
+
+        Args:
+            collection: the collection to list
+            after: only list objects whose name comes after this one
+            limit: maximum number of objects to list
+
+        Returns:
+            The name, UB calculation and current revision of each object.
+        """
+        return await executors.run(
+            "store.file",
+            self._list,
+            self._directory(collection),
+            after,
+            limit,
+            allow_process=False,
+        )
+
+    async def load_many(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, HklCalculation]]:
+        """Load a page of the HklCalculation objects of a collection, by name.
+
+        Args:
+            collection: the collection to load from
+            after: only load objects whose name comes after this one
+            limit: maximum number of objects to load
+
+        Returns:
+            The name of each object, and the object.
+        """
+        page = await executors.run(
+            "store.file",
+            self._read_many,
+            self._directory(collection),
+            after,
+            limit,
+            allow_process=False,
+        )
+        for _, revision, hkl in page:
+            self._revisions[hkl] = revision
+        return [(name, hkl) for name, _, hkl in page]
+
+    async def create_many(
+        self, collection: Optional[str], calcs: Sequence[Tuple[str, HklCalculation]]
+    ) -> List[str]:
+        """Create many HklCalculation objects at once, in a single batch of writes.
+
+        The whole batch is written by one call to the executor. Each file is still
+        created exclusively under its file lock, like any other write.
+
+        Args:
+            collection: the collection to store them inside
+            calcs: the name of each object, and the object.
+
+        Returns:
+            The names which already existed, and were left untouched.
+        """
+        skipped, written = await executors.run(
+            "store.file",
+            self._write_many,
+            self._directory(collection),
+            calcs,
+            allow_process=False,
+        )
+        for calc, revision in written:
+            self._revisions[calc] = revision
+        return skipped
+
+    def loaded_revision(self, calc: HklCalculation) -> Optional[int]:
+        """Get the revision a HklCalculation object was at when loaded or saved.
+
+        Args:
+            calc: an object previously returned by load, or passed to save.
+
+        Returns:
+            The revision, or None if the object didn't pass through this store.
+        """
+        return self._revisions.get(calc)
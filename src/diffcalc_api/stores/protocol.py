@@ -5,9 +5,20 @@ must be provided by persistence methods for API services to access them.
 """
 
 from importlib import import_module
-from typing import Any, Dict, Optional, Protocol, Union
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Protocol,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from diffcalc.hkl.calc import HklCalculation
+from diffcalc.ub.calc import UBCalculation
 
 
 class HklCalcStore(Protocol):
@@ -24,18 +35,93 @@ class HklCalcStore(Protocol):
         ...
 
     async def save(
-        self, name: str, calc: HklCalculation, collection: Optional[str]
+        self,
+        name: str,
+        calc: HklCalculation,
+        collection: Optional[str],
+        revision: Optional[int] = None,
     ) -> None:
-        """Save a HklCalculation object."""
+        """Save a HklCalculation object.
+
+        If the persisted object is no longer at the expected revision, the save must
+        be rejected. The expected revision defaults to the one the object was loaded
+        at, if it was loaded through this store.
+        """
+        ...
+
+    async def load(
+        self, name: str, collection: Optional[str], readonly: bool = False
+    ) -> HklCalculation:
+        """Load a HklCalculation object.
+
+        Callers which won't modify the object can load it as readonly, and may then
+        be given an object shared with other callers.
+        """
         ...
 
-    async def load(self, name: str, collection: Optional[str]) -> HklCalculation:
-        """Load a HklCalculation object."""
+    async def load_ubcalc(
+        self, name: str, collection: Optional[str], fields: Iterable[str]
+    ) -> UBCalculation:
+        """Load some fields of the UB calculation of a HklCalculation object.
+
+        Fields are keys of UBCalculation.asdict. Any other field may be left at its
+        default value, so the object must only be read, never saved.
+        """
+        ...
+
+    async def get_revision(self, name: str, collection: Optional[str]) -> int:
+        """Get the current revision of a HklCalculation object, without loading it."""
+        ...
+
+    def loaded_revision(self, calc: HklCalculation) -> Optional[int]:
+        """Get the revision a HklCalculation object was at when loaded or saved."""
+        ...
+
+    async def list_ubcalcs(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, UBCalculation, int]]:
+        """List a page of the HklCalculation objects of a collection, by name.
+
+        Pages hold at most limit objects, named after the given name, each with its
+        name, UB calculation and current revision. The UB calculation must have at
+        least the fields in LISTED_FIELDS, any other field may be left at its
+        default value.
+        """
+        ...
+
+    async def load_many(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, HklCalculation]]:
+        """Load a page of the HklCalculation objects of a collection, by name.
+
+        Pages hold at most limit objects, named after the given name.
+        """
+        ...
+
+    async def create_many(
+        self, collection: Optional[str], calcs: Sequence[Tuple[str, HklCalculation]]
+    ) -> List[str]:
+        """Create many HklCalculation objects at once, with the given contents.
+
+        Names which already exist are left untouched, and returned.
+        """
         ...
 
 
 STORE: Optional[HklCalcStore] = None
 
+# fields of UBCalculation.asdict which listed objects must carry
+LISTED_FIELDS = ("name", "crystal", "u_matrix")
+
+
+def partial_ubcalc(data: Dict[str, Any]) -> UBCalculation:
+    """Build a UBCalculation object from some of the fields of UBCalculation.asdict.
+
+    Fields which are missing keep the values of a newly created UBCalculation.
+    """
+    defaults = UBCalculation(data.get("name", "")).asdict
+    return UBCalculation.fromdict({**defaults, **data})
+
 
 def get_store() -> HklCalcStore:
     """Retrieve the class which handles HklCalculation objects."""
@@ -44,8 +130,25 @@ def get_store() -> HklCalcStore:
     return STORE
 
 
+def create_store(store_location: str, *args) -> HklCalcStore:
+    """Instantiate a store from its fully qualified class location."""
+    path, clsname = store_location.rsplit(".", 1)
+    return getattr(import_module(path), clsname)(*args)
+
+
+def close_store(store: Optional[HklCalcStore] = None) -> None:
+    """Close a store, by default the one in use, if it holds anything open.
+
+    Stores holding connections or threads open may provide a close method, which is
+    called when the server stops.
+    """
+    store = store if store is not None else STORE
+    close = getattr(store, "close", None)
+    if close is not None:
+        close()
+
+
 def setup_store(store_location: str, *args) -> None:
     """Allow the server to select which store to use."""
     global STORE
-    path, clsname = store_location.rsplit(".", 1)
-    STORE = getattr(import_module(path), clsname)(*args)
+    STORE = create_store(store_location, *args)
@@ -0,0 +1,303 @@
+"""Compact, versioned binary serialization of HklCalculation objects.
+
+The format is much smaller than the document produced by HklCalculation.asdict, or
+a default pickle, and much faster to decode: numbers are kept as raw little-endian
+float64 buffers rather than nested documents, and are read back with
+numpy.frombuffer.
+
+Layout, after a 4 byte magic number and a 1 byte format version:
+
+- the name of the UB calculation
+- the crystal, if any: name, lattice system and six lattice parameters
+- the reference and surface vectors: three coordinates and a reciprocal flag each
+- the U and UB matrices, if any: nine float64 values each
+- the reflections: a count, a packed (count, 11) float64 array of miller indices,
+  diffractometer angles in radians, whether the angles are reported in degrees,
+  and energy, followed by every tag
+- the orientations: a count, a packed (count, 13) float64 array of miller indices,
+  laboratory coordinates, diffractometer angles in radians and degree flag,
+  followed by every tag
+- the constraints: whether they are reported in degrees, a count, then the name,
+  kind and value of each, with angles in radians
+
+Strings are stored as a uint32 length followed by UTF-8 bytes, with the largest
+length standing for None. Tags are stored as a packed uint32 array of lengths
+followed by all of their bytes.
+
+Only the public interface of diffcalc-core is used, as by HklCalculation.asdict
+and HklCalculation.fromdict. Angles are read in the units they are reported in
+and stored in radians, and objects are rebuilt in radians before switching back
+to the units they were reported in, so every reported angle is preserved exactly.
+"""
+
+import math
+import struct
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.hkl.geometry import Position
+from diffcalc.ub.calc import ReferenceVector, UBCalculation
+from diffcalc.ub.crystal import Crystal
+from diffcalc.ub.reference import (
+    Orientation,
+    OrientationList,
+    Reflection,
+    ReflectionList,
+)
+
+MAGIC = b"DCHK"
+VERSION = 1
+
+_NONE = 0xFFFFFFFF
+_F8 = np.dtype("<f8")
+_U4 = np.dtype("<u4")
+
+# kinds of constraint value
+_NUMBER = 0
+_FLAG = 1
+
+
+def is_binary(blob: Union[bytes, memoryview]) -> bool:
+    """Check whether bytes were produced by diffcalc_api.stores.serialization.dumps.
+
+    Args:
+        blob: the serialized object, in any format
+
+    Returns:
+        True if the bytes start with the magic number of this format.
+    """
+    return blob[: len(MAGIC)] == MAGIC
+
+
+class _Writer:
+    def __init__(self) -> None:
+        self.parts: List[bytes] = [MAGIC, struct.pack("<B", VERSION)]
+
+    def pack(self, fmt: str, *values: Any) -> None:
+        self.parts.append(struct.pack("<" + fmt, *values))
+
+    def string(self, value: Optional[str]) -> None:
+        if value is None:
+            self.pack("I", _NONE)
+            return
+        encoded = value.encode()
+        self.pack("I", len(encoded))
+        self.parts.append(encoded)
+
+    def strings(self, values: List[Optional[str]]) -> None:
+        encoded = [value.encode() if value is not None else None for value in values]
+        lengths = [len(value) if value is not None else _NONE for value in encoded]
+        self.parts.append(np.array(lengths, dtype=_U4).tobytes())
+        self.parts.extend(value for value in encoded if value is not None)
+
+    def array(self, values: np.ndarray) -> None:
+        self.parts.append(np.ascontiguousarray(values, dtype=_F8).tobytes())
+
+    def matrix(self, values: Optional[np.ndarray]) -> None:
+        self.pack("?", values is not None)
+        if values is not None:
+            self.array(values)
+
+
+class _Reader:
+    def __init__(self, blob: Union[bytes, memoryview]) -> None:
+        self.blob = memoryview(blob)
+        self.offset = 0
+
+    def unpack(self, fmt: str) -> Tuple[Any, ...]:
+        values = struct.unpack_from("<" + fmt, self.blob, self.offset)
+        self.offset += struct.calcsize("<" + fmt)
+        return values
+
+    def string(self) -> Optional[str]:
+        (length,) = self.unpack("I")
+        if length == _NONE:
+            return None
+        value = bytes(self.blob[self.offset : self.offset + length]).decode()
+        self.offset += length
+        return value
+
+    def strings(self, count: int) -> List[Optional[str]]:
+        lengths = np.frombuffer(self.blob, dtype=_U4, count=count, offset=self.offset)
+        self.offset += count * _U4.itemsize
+
+        values: List[Optional[str]] = []
+        for length in lengths.tolist():
+            if length == _NONE:
+                values.append(None)
+                continue
+            values.append(bytes(self.blob[self.offset : self.offset + length]).decode())
+            self.offset += length
+        return values
+
+    def array(self, *shape: int) -> np.ndarray:
+        count = math.prod(shape)
+        values = np.frombuffer(self.blob, dtype=_F8, count=count, offset=self.offset)
+        self.offset += count * _F8.itemsize
+        return values.reshape(shape)
+
+    def matrix(self) -> Optional[np.ndarray]:
+        (present,) = self.unpack("?")
+        return self.array(3, 3).copy() if present else None
+
+
+def _radians(value: float, indegrees: bool) -> float:
+    return math.radians(value) if indegrees else value
+
+
+def _position_values(pos: Position) -> List[float]:
+    angles = [_radians(getattr(pos, angle), pos.indegrees) for angle in Position.fields]
+    return angles + [float(pos.indegrees)]
+
+
+def _position(values: Sequence[float]) -> Position:
+    pos = Position(*values[:6], indegrees=False)
+    pos.indegrees = bool(values[6])
+    return pos
+
+
+def dumps(hkl: HklCalculation) -> bytes:
+    """Serialize a HklCalculation object.
+
+    Args:
+        hkl: the object to serialize
+
+    Returns:
+        The object in the binary format described in this module.
+    """
+    ubcalc: UBCalculation = hkl.ubcalc
+    writer = _Writer()
+    writer.string(ubcalc.name)
+
+    crystal: Optional[Crystal] = ubcalc.crystal
+    writer.pack("?", crystal is not None)
+    if crystal is not None:
+        lattice = crystal.asdict
+        writer.string(lattice["name"])
+        writer.string(lattice["system"])
+        writer.pack(
+            "6d", *(lattice[p] for p in ("a", "b", "c", "alpha", "beta", "gamma"))
+        )
+
+    for vector in (ubcalc.reference, ubcalc.surface):
+        writer.pack("3d?", *vector.n_ref, vector.rlv)
+
+    writer.matrix(ubcalc.U)
+    writer.matrix(ubcalc.UB)
+
+    reflections: List[Reflection] = ubcalc.reflist.reflections
+    writer.pack("I", len(reflections))
+    writer.array(
+        np.array(
+            [[r.h, r.k, r.l, *_position_values(r.pos), r.energy] for r in reflections],
+            dtype=_F8,
+        )
+    )
+    writer.strings([reflection.tag for reflection in reflections])
+
+    orientations: List[Orientation] = ubcalc.orientlist.orientations
+    writer.pack("I", len(orientations))
+    writer.array(
+        np.array(
+            [
+                [o.h, o.k, o.l, o.x, o.y, o.z, *_position_values(o.pos)]
+                for o in orientations
+            ],
+            dtype=_F8,
+        )
+    )
+    writer.strings([orientation.tag for orientation in orientations])
+
+    constraints: Constraints = hkl.constraints
+    active = constraints.asdict
+    writer.pack("?I", constraints.indegrees, len(active))
+    for name, value in active.items():
+        writer.string(name)
+        if isinstance(value, bool):
+            writer.pack("Bd", _FLAG, value)
+        else:
+            writer.pack("Bd", _NUMBER, _radians(value, constraints.indegrees))
+
+    return b"".join(writer.parts)
+
+
+def loads(blob: Union[bytes, memoryview]) -> HklCalculation:
+    """Deserialize a HklCalculation object.
+
+    Nothing is kept referring to the blob, so a view of it can be released as soon as
+    this returns.
+
+    Args:
+        blob: bytes produced by diffcalc_api.stores.serialization.dumps, or a view
+            of them
+
+    Returns:
+        The HklCalculation object.
+
+    Raises:
+        ValueError: if the bytes are not a complete, valid serialized object.
+    """
+    if not is_binary(blob) or len(blob) <= len(MAGIC):
+        raise ValueError("not a serialized HklCalculation object")
+
+    reader = _Reader(blob)
+    reader.offset = len(MAGIC)
+    (version,) = reader.unpack("B")
+    if version != VERSION:
+        raise ValueError(f"unsupported HklCalculation format version {version}")
+
+    try:
+        hkl = _read(reader)
+    except Exception as e:
+        raise ValueError(f"corrupt HklCalculation object: {e}") from e
+    if reader.offset != len(reader.blob):
+        raise ValueError("corrupt HklCalculation object: unexpected length")
+    return hkl
+
+
+def _read(reader: _Reader) -> HklCalculation:
+    ubcalc = UBCalculation(reader.string())
+
+    (has_crystal,) = reader.unpack("?")
+    if has_crystal:
+        name, system = reader.string(), reader.string()
+        ubcalc.crystal = Crystal(name, system, *reader.unpack("6d"))
+
+    x, y, z, rlv = reader.unpack("3d?")
+    ubcalc.reference = ReferenceVector((x, y, z), rlv)
+    x, y, z, rlv = reader.unpack("3d?")
+    ubcalc.surface = ReferenceVector((x, y, z), rlv)
+
+    ubcalc.U = reader.matrix()
+    ubcalc.UB = reader.matrix()
+
+    (count,) = reader.unpack("I")
+    rows = reader.array(count, 11).tolist()
+    ubcalc.reflist = ReflectionList(
+        [
+            Reflection(row[0], row[1], row[2], _position(row[3:10]), row[10], tag)
+            for row, tag in zip(rows, reader.strings(count))
+        ]
+    )
+
+    (count,) = reader.unpack("I")
+    rows = reader.array(count, 13).tolist()
+    ubcalc.orientlist = OrientationList(
+        [
+            Orientation(*row[:6], _position(row[6:13]), tag)
+            for row, tag in zip(rows, reader.strings(count))
+        ]
+    )
+
+    indegrees, count = reader.unpack("?I")
+    active: Dict[str, Union[float, bool]] = {}
+    for _ in range(count):
+        name = str(reader.string())
+        kind, value = reader.unpack("Bd")
+        active[name] = bool(value) if kind == _FLAG else value
+    constraints = Constraints(active, indegrees=False)
+    constraints.indegrees = indegrees
+
+    return HklCalculation(ubcalc, constraints)
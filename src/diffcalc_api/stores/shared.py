@@ -0,0 +1,498 @@
+"""Defines a cache tier shared between every replica of the API.
+
+A shared cache is a Redis-compatible key-value server, reachable by URL:
+
+- "redis://host:port/db", "rediss://..." or "unix://..." use a Redis server, and
+  need the optional redis package to be installed.
+- "memory://namespace" uses a stand-in held in the memory of this process. Caches
+  connected to the same namespace share their contents, like replicas connected to
+  the same Redis server would.
+
+SharedCachingHklCalcStore keeps serialized HklCalculation objects in the shared
+cache, and diffcalc_api.scan_cache can keep scan results there. Whenever an object
+is saved or deleted, an invalidation is published so that every replica can drop
+anything it has cached locally for it.
+
+Anything able to reach the server can write to it, so objects are kept in the
+format of diffcalc_api.stores.serialization and never pickled.
+"""
+
+import asyncio
+import json
+import logging
+import struct
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Protocol, Sequence, Tuple
+from weakref import WeakKeyDictionary
+
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_api.stores import serialization
+from diffcalc_api.stores.protocol import HklCalcStore, close_store, create_store
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "diffcalc:invalidate"
+
+# seconds to wait before subscribing again after losing a subscription
+RESUBSCRIBE_DELAY = 1.0
+
+# revision of a shared object, ahead of its serialized form
+REVISION_HEADER = struct.Struct("<q")
+
+
+class SharedCache(Protocol):
+    """Protocol of the Redis-compatible operations used by the shared cache tier."""
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Get the value of a key, or None if it is not set or has expired."""
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Set the value of a key, expiring after ttl seconds."""
+
+    async def delete(self, key: str) -> None:
+        """Remove a key, if it is set."""
+
+    async def publish(self, channel: str, message: str) -> None:
+        """Send a message to every subscriber of a channel, on every replica."""
+
+    async def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        """Call a callback with every message later published to a channel."""
+
+
+# expiry time, value
+_memory_data: Dict[str, Dict[str, Tuple[float, bytes]]] = {}
+_memory_subscribers: Dict[str, Dict[str, List[Callable[[str], None]]]] = {}
+
+
+class MemorySharedCache:
+    """In-process stand-in for a Redis server, for tests and single replicas."""
+
+    def __init__(self, namespace: str = "default") -> None:
+        """Connect to a namespace, creating it if it does not yet exist.
+
+        Args:
+            namespace: caches connected to the same namespace share their contents.
+        """
+        self.namespace = namespace
+        self._data = _memory_data.setdefault(namespace, {})
+        self._subscribers = _memory_subscribers.setdefault(namespace, {})
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Get the value of a key, or None if it is not set or has expired."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Set the value of a key, expiring after ttl seconds."""
+        self._data[key] = (time.monotonic() + ttl, value)
+
+    async def delete(self, key: str) -> None:
+        """Remove a key, if it is set."""
+        self._data.pop(key, None)
+
+    async def publish(self, channel: str, message: str) -> None:
+        """Call every callback subscribed to a channel in this namespace."""
+        for callback in list(self._subscribers.get(channel, [])):
+            callback(message)
+
+    async def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        """Call a callback with every message later published to a channel."""
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def flush(self) -> None:
+        """Remove every key and subscriber in this namespace."""
+        self._data.clear()
+        self._subscribers.clear()
+
+
+class RedisSharedCache:
+    """Shared cache on a Redis server, or anything speaking its protocol."""
+
+    def __init__(self, url: str) -> None:
+        """Create a client for the server, without connecting to it yet.
+
+        Args:
+            url: URL of the server, e.g. "redis://localhost:6379/0"
+        """
+        try:
+            import redis.asyncio
+        except ImportError as e:
+            raise ImportError(
+                f"the redis package is needed to use the shared cache at {url}"
+            ) from e
+
+        self._client = redis.asyncio.from_url(url)
+        self._listeners: List["asyncio.Task[None]"] = []
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Get the value of a key, or None if it is not set or has expired."""
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Set the value of a key, expiring after ttl seconds."""
+        await self._client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    async def delete(self, key: str) -> None:
+        """Remove a key, if it is set."""
+        await self._client.delete(key)
+
+    async def publish(self, channel: str, message: str) -> None:
+        """Send a message to every subscriber of a channel, on every replica."""
+        await self._client.publish(channel, message)
+
+    async def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        """Call a callback with every message later published to a channel.
+
+        Messages are received by a background task. If the subscription is lost,
+        the error is logged and the task subscribes again, so invalidations do not
+        silently stop. Errors raised by the callback are logged and skipped.
+        """
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(channel)
+
+        async def listen() -> None:
+            nonlocal pubsub
+            while True:
+                try:
+                    async for message in pubsub.listen():
+                        try:
+                            callback(message["data"].decode())
+                        except Exception:
+                            logger.exception(f"Cannot handle message on {channel}")
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception(f"Lost subscription to {channel}, resubscribing")
+
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
+                try:
+                    pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                    await pubsub.subscribe(channel)
+                except Exception:
+                    logger.exception(f"Cannot subscribe to {channel}")
+
+        self._listeners.append(asyncio.create_task(listen()))
+
+
+def connect(url: str) -> SharedCache:
+    """Connect to a shared cache.
+
+    Args:
+        url: "memory://namespace", or the URL of a Redis server.
+
+    Returns:
+        The shared cache.
+    """
+    scheme, _, rest = url.partition("://")
+    if scheme == "memory":
+        return MemorySharedCache(rest if rest else "default")
+    if scheme in ("redis", "rediss", "unix"):
+        return RedisSharedCache(url)
+    raise ValueError(f"shared cache URL {url} must start with memory:// or redis://")
+
+
+def invalidation(name: str, collection: Optional[str]) -> str:
+    """Build the message published when a HklCalculation object changes.
+
+    Args:
+        name: the name by which to retrieve the object
+        collection: the collection inside which it is stored.
+
+    Returns:
+        The message.
+    """
+    return json.dumps([collection if collection else "default", name])
+
+
+def parse_invalidation(message: str) -> Tuple[str, str]:
+    """Read a message built by diffcalc_api.stores.shared.invalidation.
+
+    Args:
+        message: the published message
+
+    Returns:
+        The name of the object which changed, and its collection.
+    """
+    collection, name = json.loads(message)
+    return name, collection
+
+
+class SharedCachingHklCalcStore:
+    """Class to keep HklCalculation objects in a cache shared between replicas.
+
+    Wraps any other store following diffcalc_api.stores.protocol. Loaded objects are
+    kept in the shared cache in serialized form, with the revision they were loaded
+    at, so that any replica can load them without decoding them from the
+    persistence layer. Saves and deletes drop the shared entry, and publish an
+    invalidation which callbacks registered through on_invalidate receive on every
+    replica.
+
+    Revisions are always checked against the wrapped store. A shared object is
+    only served while its revision is still current, however long ago it was
+    shared, and a save made with a stale object is rejected rather than silently
+    overwriting newer changes.
+    """
+
+    def __init__(
+        self, store_location: str, cache_url: str, ttl: float = 300.0, *args
+    ) -> None:
+        """Create the wrapped store and connect to the shared cache.
+
+        Args:
+            store_location: fully qualified class name of the store to wrap
+            cache_url: URL of the shared cache, see diffcalc_api.stores.shared.connect
+            ttl: number of seconds an object is kept in the shared cache
+            args: arguments used to instantiate the wrapped store
+        """
+        self._store: HklCalcStore = create_store(store_location, *args)
+        self.responses = self._store.responses
+
+        self.cache = connect(cache_url)
+        self.ttl = ttl
+        self._revisions: "WeakKeyDictionary[HklCalculation, int]" = WeakKeyDictionary()
+        self._callbacks: List[Callable[[str, str], None]] = []
+        self._subscribed = False
+
+    @staticmethod
+    def _key(name: str, collection: Optional[str]) -> str:
+        return "diffcalc:hkl:" + invalidation(name, collection)
+
+    def on_invalidate(self, callback: Callable[[str, str], None]) -> None:
+        """Register a callback for objects saved or deleted by any replica.
+
+        Args:
+            callback: called with the name and collection of the changed object.
+        """
+        self._callbacks.append(callback)
+
+    def _invalidated(self, message: str) -> None:
+        name, collection = parse_invalidation(message)
+        for callback in self._callbacks:
+            callback(name, collection)
+
+    async def _get_current(
+        self, name: str, collection: Optional[str]
+    ) -> Optional[Tuple[int, HklCalculation]]:
+        """Get a shared object and its revision, if it is still current."""
+        blob = await self.cache.get(self._key(name, collection))
+        if blob is None:
+            return None
+
+        try:
+            (revision,) = REVISION_HEADER.unpack_from(blob)
+            if revision != await self._store.get_revision(name, collection):
+                return None
+            hkl = serialization.loads(memoryview(blob)[REVISION_HEADER.size :])
+        except (ValueError, struct.error):
+            logger.warning(f"Ignoring unreadable shared object {name} in {collection}")
+            return None
+        return revision, hkl
+
+    async def _subscribe(self) -> None:
+        if not self._subscribed:
+            self._subscribed = True
+            await self.cache.subscribe(INVALIDATION_CHANNEL, self._invalidated)
+
+    async def invalidate(self, name: str, collection: Optional[str]) -> None:
+        """Remove a HklCalculation object from the shared cache on every replica.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+        """
+        await self._subscribe()
+        await self.cache.delete(self._key(name, collection))
+        await self.cache.publish(INVALIDATION_CHANNEL, invalidation(name, collection))
+
+    async def create(self, name: str, collection: Optional[str]) -> None:
+        """Create a HklCalculation object.
+
+        Args:
+            name: the unique name to attribute to the object
+            collection: the collection to store it inside.
+        """
+        await self._store.create(name, collection)
+        await self.invalidate(name, collection)
+
+    async def delete(self, name: str, collection: Optional[str]) -> None:
+        """Delete a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+        """
+        try:
+            await self._store.delete(name, collection)
+        finally:
+            await self.invalidate(name, collection)
+
+    async def save(
+        self,
+        name: str,
+        calc: HklCalculation,
+        collection: Optional[str],
+        revision: Optional[int] = None,
+    ) -> None:
+        """Update a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            calc: the HklCalculation object to persist
+            collection: the collection inside which it is stored.
+            revision: the revision the object must be at to be overwritten.
+                Defaults to the revision the object was loaded at.
+        """
+        if revision is None:
+            revision = self._revisions.pop(calc, None)
+
+        try:
+            await self._store.save(name, calc, collection, revision)
+        finally:
+            await self.invalidate(name, collection)
+
+    async def load(
+        self, name: str, collection: Optional[str], readonly: bool = False
+    ) -> HklCalculation:
+        """Load a HklCalculation object, from the shared cache if possible.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+            readonly: whether the object won't be modified. Ignored, as every load
+                returns a new object.
+
+        Returns:
+            The HklCalculation object.
+        """
+        await self._subscribe()
+        current = await self._get_current(name, collection)
+        if current is not None:
+            revision, hkl = current
+        else:
+            # stores which don't report the revision they loaded at are shared
+            # under the revision from before loading, which is never newer
+            before = await self._store.get_revision(name, collection)
+            hkl = await self._store.load(name, collection)
+            loaded = self._store.loaded_revision(hkl)
+            revision = loaded if loaded is not None else before
+            await self.cache.set(
+                self._key(name, collection),
+                REVISION_HEADER.pack(revision) + serialization.dumps(hkl),
+                self.ttl,
+            )
+
+        self._revisions[hkl] = revision
+        return hkl
+
+    async def load_ubcalc(
+        self, name: str, collection: Optional[str], fields: Iterable[str]
+    ) -> UBCalculation:
+        """Load some fields of the UB calculation of a HklCalculation object.
+
+        Current objects in the shared cache are read from it. Otherwise only the
+        requested fields are loaded from the wrapped store, and nothing is shared.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+            fields: keys of UBCalculation.asdict to retrieve
+
+        Returns:
+            The UB calculation, with other fields possibly left at default values.
+        """
+        await self._subscribe()
+        current = await self._get_current(name, collection)
+        if current is not None:
+            return current[1].ubcalc
+
+        return await self._store.load_ubcalc(name, collection, fields)
+
+    async def get_revision(self, name: str, collection: Optional[str]) -> int:
+        """Get the current revision of a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+
+        Returns:
+            The current revision, as reported by the wrapped store.
+        """
+        return await self._store.get_revision(name, collection)
+
+    async def list_ubcalcs(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, UBCalculation, int]]:
+        """List a page of the HklCalculation objects of a collection, by name.
+
+        Args:
+            collection: the collection to list
+            after: only list objects whose name comes after this one
+            limit: maximum number of objects to list
+
+        Returns:
+            The name, UB calculation and current revision of each object, as
+            reported by the wrapped store.
+        """
+        return await self._store.list_ubcalcs(collection, after, limit)
+
+    async def load_many(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, HklCalculation]]:
+        """Load a page of the HklCalculation objects of a collection, by name.
+
+        Pages are always loaded from the wrapped store.
+
+        Args:
+            collection: the collection to load from
+            after: only load objects whose name comes after this one
+            limit: maximum number of objects to load
+
+        Returns:
+            The name of each object, and the object.
+        """
+        return await self._store.load_many(collection, after, limit)
+
+    async def create_many(
+        self, collection: Optional[str], calcs: Sequence[Tuple[str, HklCalculation]]
+    ) -> List[str]:
+        """Create many HklCalculation objects at once, in the wrapped store.
+
+        Objects which were created are invalidated on every replica.
+
+        Args:
+            collection: the collection to store them inside
+            calcs: the name of each object, and the object.
+
+        Returns:
+            The names which already existed, and were left untouched.
+        """
+        skipped = await self._store.create_many(collection, calcs)
+        for name, _ in calcs:
+            if name not in skipped:
+                await self.invalidate(name, collection)
+        return skipped
+
+    def loaded_revision(self, calc: HklCalculation) -> Optional[int]:
+        """Get the revision a HklCalculation object was at when loaded or saved.
+
+        Args:
+            calc: an object previously returned by load, or passed to save.
+
+        Returns:
+            The revision, or None if it is not known.
+        """
+        revision = self._revisions.get(calc)
+        return revision if revision is not None else self._store.loaded_revision(calc)
+
+    def close(self) -> None:
+        """Close the wrapped store, if it holds anything open."""
+        close_store(self._store)
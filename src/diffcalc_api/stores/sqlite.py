@@ -0,0 +1,433 @@
+"""Defines interactions with an embedded SQLite persistence layer.
+
+Every object lives in a single table of one database file, keyed by its collection
+and name:
+
+    CREATE TABLE hkl (
+        collection TEXT NOT NULL,
+        name TEXT NOT NULL,
+        revision INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (collection, name)
+    ) WITHOUT ROWID
+
+Objects are stored in the format of diffcalc_api.stores.serialization. The database
+runs in write-ahead log mode, so that readers never block the writer, and several
+processes can share the file.
+"""
+
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple, TypeVar
+from weakref import WeakKeyDictionary
+
+import numpy as np
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_api.config import SAVE_PICKLES_FOLDER
+from diffcalc_api.errors.definitions import (
+    ALL_RESPONSES,
+    DiffcalcAPIException,
+    ErrorCodesBase,
+)
+from diffcalc_api.executors import Executor
+from diffcalc_api.stores import serialization
+
+T = TypeVar("T")
+
+DATABASE_FILE = "diffcalc.sqlite"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hkl (
+    collection TEXT NOT NULL,
+    name TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (collection, name)
+) WITHOUT ROWID
+"""
+
+
+class ErrorCodes(ErrorCodesBase):
+    """Codes which can be raised in the retrieval/storage of HklCalculation objects."""
+
+    OVERWRITE_ERROR = 405
+    ROW_NOT_FOUND_ERROR = 404
+    REVISION_CONFLICT_ERROR = 409
+
+
+class OverwriteError(DiffcalcAPIException):
+    """Thrown if a HklCalculation object is created with a non-unique name."""
+
+    def __init__(self, name: str) -> None:
+        """Set detail and status code of the error."""
+        self.detail = (
+            f"Row already exists for crystal {name}!"
+            f"\nEither delete via DELETE request to this URL "
+            f"or change the existing properties. "
+        )
+        self.status_code = ErrorCodes.OVERWRITE_ERROR
+
+
+class RowNotFoundError(DiffcalcAPIException):
+    """Thrown if the store cannot retrieve a HklCalculation object."""
+
+    def __init__(self, name: str, action: str) -> None:
+        """Set detail and status code of the error."""
+        self.detail = f"Row for crystal {name} not found! Cannot {action}."
+        self.status_code = ErrorCodes.ROW_NOT_FOUND_ERROR
+
+
+class RevisionConflictError(DiffcalcAPIException):
+    """Thrown if a HklCalculation object was modified since it was loaded."""
+
+    def __init__(self, name: str, revision: int) -> None:
+        """Set detail and status code of the error."""
+        self.detail = (
+            f"Row for crystal {name} has changed since revision {revision}!"
+            f"\nAnother request modified it concurrently, please retry."
+        )
+        self.status_code = ErrorCodes.REVISION_CONFLICT_ERROR
+
+
+class SqliteHklCalcStore:
+    """Class to use an SQLite database file as a persistence layer for the API.
+
+    Every row carries a revision, incremented on each save. The revision each
+    HklCalculation object was loaded at is remembered, so that saving it back only
+    succeeds if nobody else has saved the row in the meantime. New rows start at a
+    revision taken from the clock, so that an object loaded before its crystal was
+    deleted and re-created cannot be saved over the new one.
+
+    SQLite connections can only be used by the thread which opened them, so every
+    query runs on a worker thread dedicated to this store, off the event loop.
+    Queries are therefore serialised, which suits SQLite's single writer.
+    """
+
+    _root_directory: Path = Path(SAVE_PICKLES_FOLDER)
+
+    def __init__(self, path: str = "", timeout: float = 5.0) -> None:
+        """Set error codes that could be thrown during method excecution.
+
+        Error codes are purely for documentation purposes.
+
+        Args:
+            path: location of the database file, created if it does not exist.
+                Defaults to diffcalc.sqlite in the folder used for pickled files.
+            timeout: number of seconds to wait for other processes to release a lock
+                on the database.
+        """
+        self.responses = {
+            code: ALL_RESPONSES[code] for code in np.unique(ErrorCodes.all_codes())
+        }
+        self.path = Path(path) if path else self._root_directory / DATABASE_FILE
+        self.timeout = timeout
+        self._executor = Executor("thread", 1)
+        self._connection: Optional[sqlite3.Connection] = None
+        self._revisions: "WeakKeyDictionary[HklCalculation, int]" = WeakKeyDictionary()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database on first use, from the dedicated thread."""
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        return await self._executor.run(func, *args)
+
+    def _insert(self, collection: str, name: str, data: bytes) -> None:
+        try:
+            self._connect().execute(
+                "INSERT INTO hkl (collection, name, revision, data) "
+                "VALUES (?, ?, ?, ?)",
+                (collection, name, time.time_ns(), data),
+            )
+        except sqlite3.IntegrityError:
+            raise OverwriteError(name)
+
+    def _delete(self, collection: str, name: str) -> None:
+        cursor = self._connect().execute(
+            "DELETE FROM hkl WHERE collection = ? AND name = ?", (collection, name)
+        )
+        if cursor.rowcount == 0:
+            raise RowNotFoundError(name, "delete")
+
+    def _update(
+        self, collection: str, name: str, data: bytes, expected: Optional[int]
+    ) -> int:
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT revision FROM hkl WHERE collection = ? AND name = ?",
+                (collection, name),
+            ).fetchone()
+            if row is None:
+                raise RowNotFoundError(name, "save")
+            if expected is not None and row[0] != expected:
+                raise RevisionConflictError(name, expected)
+
+            connection.execute(
+                "UPDATE hkl SET revision = ?, data = ? "
+                "WHERE collection = ? AND name = ?",
+                (row[0] + 1, data, collection, name),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return row[0] + 1
+
+    def _select(self, collection: str, name: str, column: str, action: str) -> Any:
+        cursor = self._connect().execute(
+            f"SELECT {column} FROM hkl WHERE collection = ? AND name = ?",
+            (collection, name),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise RowNotFoundError(name, action)
+        return row
+
+    def _select_page(
+        self, collection: str, after: Optional[str], limit: int
+    ) -> List[Tuple[str, int, bytes]]:
+        cursor = self._connect().execute(
+            "SELECT name, revision, data FROM hkl "
+            "WHERE collection = ? AND name > ? ORDER BY name LIMIT ?",
+            (collection, after if after is not None else "", limit),
+        )
+        return cursor.fetchall()
+
+    def _insert_many(
+        self, collection: str, rows: Sequence[Tuple[str, bytes]]
+    ) -> List[str]:
+        connection = self._connect()
+        skipped = []
+        revision = time.time_ns()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for name, data in rows:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO hkl (collection, name, revision, data) "
+                    "VALUES (?, ?, ?, ?)",
+                    (collection, name, revision, data),
+                )
+                if cursor.rowcount == 0:
+                    skipped.append(name)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return skipped
+
+    async def create(self, name: str, collection: Optional[str]) -> None:
+        """Create a HklCalculation object.
+
+        Args:
+            name: the unique name to attribute to the object
+            collection: the collection to store it inside.
+        """
+        hkl = HklCalculation(UBCalculation(name=name), Constraints())
+        await self._run(
+            self._insert,
+            collection if collection else "default",
+            name,
+            serialization.dumps(hkl),
+        )
+        self._revisions[hkl] = 0
+
+    async def delete(self, name: str, collection: Optional[str]) -> None:
+        """Delete a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+        """
+        await self._run(self._delete, collection if collection else "default", name)
+
+    async def save(
+        self,
+        name: str,
+        calc: HklCalculation,
+        collection: Optional[str],
+        revision: Optional[int] = None,
+    ) -> None:
+        """Update a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            calc: the HklCalculation object to persist
+            collection: the collection inside which it is stored.
+            revision: the revision the row must be at to be overwritten.
+                Defaults to the revision the object was loaded at.
+        """
+        expected = revision if revision is not None else self._revisions.get(calc)
+        self._revisions[calc] = await self._run(
+            self._update,
+            collection if collection else "default",
+            name,
+            serialization.dumps(calc),
+            expected,
+        )
+
+    async def load(
+        self, name: str, collection: Optional[str], readonly: bool = False
+    ) -> HklCalculation:
+        """Load a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+            readonly: whether the object won't be modified. Ignored, as every load
+                returns a new object.
+
+        Returns:
+            The HklCalculation object.
+        """
+        revision, data = await self._run(
+            self._select,
+            collection if collection else "default",
+            name,
+            "revision, data",
+            "load",
+        )
+        hkl = serialization.loads(data)
+        self._revisions[hkl] = revision
+        return hkl
+
+    async def load_ubcalc(
+        self, name: str, collection: Optional[str], fields: Iterable[str]
+    ) -> UBCalculation:
+        """Load some fields of the UB calculation of a HklCalculation object.
+
+        Blobs can't be queried by field, and are cheap to decode, so the whole
+        object is loaded.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+            fields: keys of UBCalculation.asdict to retrieve
+
+        Returns:
+            The UB calculation.
+        """
+        (data,) = await self._run(
+            self._select, collection if collection else "default", name, "data", "load"
+        )
+        return serialization.loads(data).ubcalc
+
+    async def get_revision(self, name: str, collection: Optional[str]) -> int:
+        """Get the current revision of a HklCalculation object.
+
+        Args:
+            name: the name by which to retrieve the object
+            collection: the collection inside which it is stored.
+
+        Returns:
+            The number of times the object has been saved.
+        """
+        (revision,) = await self._run(
+            self._select,
+            collection if collection else "default",
+            name,
+            "revision",
+            "get revision",
+        )
+        return revision
+
+    async def list_ubcalcs(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, UBCalculation, int]]:
+        """List a page of the HklCalculation objects of a collection, by name.
+
+        Pages are read in the order of the primary key.
+
+        Args:
+            collection: the collection to list
+            after: only list objects whose name comes after this one
+            limit: maximum number of objects to list
+
+        Returns:
+            The name, UB calculation and current revision of each object.
+        """
+        rows = await self._run(
+            self._select_page, collection if collection else "default", after, limit
+        )
+        return [
+            (name, serialization.loads(data).ubcalc, revision)
+            for name, revision, data in rows
+        ]
+
+    async def load_many(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, HklCalculation]]:
+        """Load a page of the HklCalculation objects of a collection, by name.
+
+        Args:
+            collection: the collection to load from
+            after: only load objects whose name comes after this one
+            limit: maximum number of objects to load
+
+        Returns:
+            The name of each object, and the object.
+        """
+        rows = await self._run(
+            self._select_page, collection if collection else "default", after, limit
+        )
+        page = []
+        for name, revision, data in rows:
+            hkl = serialization.loads(data)
+            self._revisions[hkl] = revision
+            page.append((name, hkl))
+        return page
+
+    async def create_many(
+        self, collection: Optional[str], calcs: Sequence[Tuple[str, HklCalculation]]
+    ) -> List[str]:
+        """Create many HklCalculation objects at once, in a single transaction.
+
+        Args:
+            collection: the collection to store them inside
+            calcs: the name of each object, and the object.
+
+        Returns:
+            The names which already existed, and were left untouched.
+        """
+        rows = [(name, serialization.dumps(calc)) for name, calc in calcs]
+        return await self._run(
+            self._insert_many, collection if collection else "default", rows
+        )
+
+    def loaded_revision(self, calc: HklCalculation) -> Optional[int]:
+        """Get the revision a HklCalculation object was at when loaded or saved.
+
+        Args:
+            calc: an object previously returned by load, or passed to save.
+
+        Returns:
+            The revision, or None if the object didn't pass through this store.
+        """
+        return self._revisions.get(calc)
+
+    def close(self) -> None:
+        """Close the database, and stop the thread dedicated to this store.
+
+        Both are opened again if the store is used afterwards.
+        """
+        if self._connection is not None:
+            self._executor.pool.submit(self._disconnect).result()
+        self._executor.shutdown()
+
+    def _disconnect(self) -> None:
+        """Close the database, from the dedicated thread."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -1,6 +1,7 @@
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
 from diffcalc.hkl.calc import HklCalculation
+from diffcalc.ub.calc import UBCalculation
 
 
 class FakeHklCalcStore:
@@ -15,12 +16,44 @@ class FakeHklCalcStore:
         pass
 
     async def save(
-        self, name: str, calc: HklCalculation, collection: Optional[str]
+        self,
+        name: str,
+        calc: HklCalculation,
+        collection: Optional[str],
+        revision: Optional[int] = None,
     ) -> None:
         pass
 
-    async def load(self, name: str, collection: Optional[str]) -> HklCalculation:
+    async def load(
+        self, name: str, collection: Optional[str], readonly: bool = False
+    ) -> HklCalculation:
         return self.hkl
 
+    async def load_ubcalc(
+        self, name: str, collection: Optional[str], fields: Iterable[str]
+    ) -> UBCalculation:
+        return self.hkl.ubcalc
+
+    async def get_revision(self, name: str, collection: Optional[str]) -> int:
+        return 0
+
+    def loaded_revision(self, calc: HklCalculation) -> Optional[int]:
+        return None
+
+    async def list_ubcalcs(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, UBCalculation, int]]:
+        return [(self.hkl.ubcalc.name, self.hkl.ubcalc, 0)] if after is None else []
+
+    async def load_many(
+        self, collection: Optional[str], after: Optional[str], limit: int
+    ) -> List[Tuple[str, HklCalculation]]:
+        return [(self.hkl.ubcalc.name, self.hkl)] if after is None else []
+
+    async def create_many(
+        self, collection: Optional[str], calcs: Sequence[Tuple[str, HklCalculation]]
+    ) -> List[str]:
+        return []
+
     def use_hkl(self, hkl: HklCalculation):
         self.hkl = hkl
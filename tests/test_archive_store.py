@@ -0,0 +1,178 @@
+import asyncio
+import mmap
+import threading
+
+import pytest
+
+from diffcalc_api.stores.archive import (
+    HEADER,
+    ArchiveHklCalcStore,
+    CorruptSegmentError,
+    RecordNotFoundError,
+)
+
+
+def archive(root, **kwargs) -> ArchiveHklCalcStore:
+    store = ArchiveHklCalcStore(**kwargs)
+    store._root_directory = root
+    return store
+
+
+@pytest.fixture()
+def store(tmp_path) -> ArchiveHklCalcStore:
+    store = archive(tmp_path)
+    asyncio.run(store.create("test", "B07"))
+    return store
+
+
+def test_saves_of_deleted_crystals_are_not_found(store: ArchiveHklCalcStore):
+    hkl = asyncio.run(store.load("test", "B07"))
+    asyncio.run(store.delete("test", "B07"))
+
+    with pytest.raises(RecordNotFoundError):
+        asyncio.run(store.save("test", hkl, "B07"))
+
+
+def test_incomplete_records_are_dropped(store: ArchiveHklCalcStore, tmp_path):
+    hkl = asyncio.run(store.load("test", "B07"))
+    asyncio.run(store.save("test", hkl, "B07"))
+    path = tmp_path / "B07.segment"
+    complete = path.read_bytes()
+    path.write_bytes(complete[:-10])
+
+    recovered = archive(tmp_path)
+    revision = asyncio.run(recovered.get_revision("test", "B07"))
+    assert revision == asyncio.run(store.get_revision("test", "B07")) - 1
+
+    asyncio.run(recovered.create("new", "B07"))
+    assert asyncio.run(archive(tmp_path).load("test", "B07")).ubcalc.name == "test"
+    assert asyncio.run(archive(tmp_path).load("new", "B07")).ubcalc.name == "new"
+
+
+def corrupt_byte(path, offset):
+    data = bytearray(path.read_bytes())
+    data[offset] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+
+def test_corrupt_records_in_the_middle_are_skipped(tmp_path):
+    store = archive(tmp_path)
+    path = tmp_path / "B07.segment"
+    asyncio.run(store.create("a", "B07"))
+    start = path.stat().st_size
+    asyncio.run(store.create("b", "B07"))
+    asyncio.run(store.create("c", "B07"))
+    corrupt_byte(path, start + (path.stat().st_size - start) // 4)
+
+    recovered = archive(tmp_path)
+    asyncio.run(recovered.create("d", "B07"))
+    with pytest.raises(RecordNotFoundError):
+        asyncio.run(recovered.load("b", "B07"))
+
+    reopened = archive(tmp_path)
+    for name in ("a", "c", "d"):
+        assert asyncio.run(reopened.load(name, "B07")).ubcalc.name == name
+
+
+def test_segments_with_damaged_headers_are_left_untouched(tmp_path):
+    store = archive(tmp_path)
+    path = tmp_path / "B07.segment"
+    asyncio.run(store.create("a", "B07"))
+    start = path.stat().st_size
+    asyncio.run(store.create("b", "B07"))
+    corrupt_byte(path, start)
+    damaged = path.read_bytes()
+
+    recovered = archive(tmp_path)
+    with pytest.raises(CorruptSegmentError):
+        asyncio.run(recovered.create("c", "B07"))
+    assert path.read_bytes() == damaged
+
+
+def test_zero_filled_ends_are_dropped(store: ArchiveHklCalcStore, tmp_path):
+    path = tmp_path / "B07.segment"
+    with path.open("ab") as stream:
+        stream.write(bytes(HEADER.size + 10))
+
+    recovered = archive(tmp_path)
+    asyncio.run(recovered.create("new", "B07"))
+
+    assert asyncio.run(archive(tmp_path).load("test", "B07")).ubcalc.name == "test"
+    assert asyncio.run(archive(tmp_path).load("new", "B07")).ubcalc.name == "new"
+
+
+def test_loads_during_compaction_read_their_own_record(tmp_path):
+    store = archive(tmp_path, compact_ratio=0.3, compact_min_size=0)
+    names = [f"crystal{i}" for i in range(4)]
+    for name in names:
+        asyncio.run(store.create(name, "B07"))
+    stop = threading.Event()
+    errors = []
+
+    def load():
+        while not stop.is_set():
+            for name in names:
+                try:
+                    hkl, _ = store._load("B07", name)
+                    assert hkl.ubcalc.name == name
+                except Exception as e:
+                    errors.append(e)
+
+    readers = [threading.Thread(target=load) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for _ in range(15):
+            for name in names:
+                hkl, revision = store._load("B07", name)
+                store._append("B07", 0, name, hkl, revision, "save")
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+    assert errors == []
+
+
+def test_compaction_drops_dead_records(tmp_path):
+    store = archive(tmp_path, compact_ratio=0.5, compact_min_size=0)
+    path = tmp_path / "B07.segment"
+    asyncio.run(store.create("test", "B07"))
+    record_size = path.stat().st_size
+    asyncio.run(store.create("other", "B07"))
+    asyncio.run(store.delete("other", "B07"))
+
+    for _ in range(10):
+        hkl = asyncio.run(store.load("test", "B07"))
+        asyncio.run(store.save("test", hkl, "B07"))
+    assert path.stat().st_size < 3 * record_size
+
+    revision = asyncio.run(store.get_revision("test", "B07"))
+    asyncio.run(store.compact("B07"))
+    reopened = archive(tmp_path)
+    asyncio.run(reopened.create("other", "B07"))
+
+    assert asyncio.run(reopened.get_revision("test", "B07")) == revision
+    assert asyncio.run(reopened.get_revision("other", "B07")) > revision
+    assert asyncio.run(store.load("other", "B07")).ubcalc.name == "other"
+
+
+def test_appends_share_one_growing_mapping(tmp_path, monkeypatch):
+    store = archive(tmp_path)
+    mappings = []
+
+    def counting_mmap(*args, **kwargs):
+        mappings.append(real_mmap(*args, **kwargs))
+        return mappings[-1]
+
+    real_mmap = mmap.mmap
+    monkeypatch.setattr(mmap, "mmap", counting_mmap)
+    for i in range(100):
+        asyncio.run(store.create(f"crystal{i}", "B07"))
+        assert (
+            asyncio.run(store.load(f"crystal{i}", "B07")).ubcalc.name == f"crystal{i}"
+        )
+
+    segment = store._segment("B07")
+    assert len({id(record.generation) for record in segment.index.values()}) == 1
+    assert len(mappings) <= 8
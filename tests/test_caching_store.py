@@ -0,0 +1,121 @@
+import asyncio
+from typing import List, Optional
+
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_api.stores.caching import CachingHklCalcStore
+from tests.conftest import FakeHklCalcStore
+
+dummy_hkl = HklCalculation(UBCalculation(name="dummy"), Constraints())
+dummy_hkl.ubcalc.set_lattice("SiO2", 4.913, 5.405)
+
+
+class CountingHklCalcStore(FakeHklCalcStore):
+    def __init__(self, hkl: HklCalculation):
+        super().__init__(hkl)
+        self.loads = 0
+
+    async def load(self, name, collection, readonly=False):
+        self.loads += 1
+        return await super().load(name, collection)
+
+
+class RevisionedHklCalcStore(CountingHklCalcStore):
+    def __init__(self, hkl: HklCalculation):
+        super().__init__(hkl)
+        self.revision = 0
+        self.saved_with: List[Optional[int]] = []
+
+    async def save(self, name, calc, collection, revision=None):
+        self.saved_with.append(revision)
+        self.revision += 1
+
+    async def get_revision(self, name, collection):
+        return self.revision
+
+    def loaded_revision(self, calc):
+        return self.revision
+
+
+def caching_store(
+    max_size: int = 2, ttl: float = 30.0, store: str = "CountingHklCalcStore"
+) -> CachingHklCalcStore:
+    return CachingHklCalcStore(
+        f"tests.test_caching_store.{store}", max_size, ttl, dummy_hkl
+    )
+
+
+def test_repeated_loads_are_served_from_memory():
+    store = caching_store()
+
+    first = asyncio.run(store.load("test", "B07"))
+    second = asyncio.run(store.load("test", "B07"))
+
+    assert store._store.loads == 1
+    assert first is not second
+    assert second.ubcalc.crystal.name == "SiO2"
+
+
+def test_cached_objects_are_independent_copies():
+    store = caching_store()
+
+    asyncio.run(store.load("test", "B07"))
+    modified = asyncio.run(store.load("test", "B07"))
+    modified.ubcalc.set_lattice("Si", 5.43)
+
+    assert asyncio.run(store.load("test", "B07")).ubcalc.crystal.name == "SiO2"
+
+
+def test_save_and_delete_invalidate_the_cache():
+    store = caching_store()
+
+    hkl = asyncio.run(store.load("test", "B07"))
+    asyncio.run(store.save("test", hkl, "B07"))
+    asyncio.run(store.load("test", "B07"))
+    asyncio.run(store.delete("test", "B07"))
+    asyncio.run(store.load("test", "B07"))
+
+    assert store._store.loads == 3
+
+
+def test_least_recently_used_entries_are_evicted():
+    store = caching_store(max_size=2)
+
+    for name in ["a", "b", "a", "c", "a", "b"]:
+        asyncio.run(store.load(name, None))
+
+    assert store._store.loads == 4
+
+
+def test_expired_entries_are_reloaded():
+    store = caching_store(ttl=0)
+
+    asyncio.run(store.load("test", None))
+    asyncio.run(store.load("test", None))
+
+    assert store._store.loads == 2
+
+
+def test_expired_entries_are_kept_if_revision_is_unchanged():
+    store = caching_store(ttl=0, store="RevisionedHklCalcStore")
+
+    asyncio.run(store.load("test", None))
+    asyncio.run(store.load("test", None))
+    assert store._store.loads == 1
+
+    store._store.revision += 1
+    asyncio.run(store.load("test", None))
+    assert store._store.loads == 2
+
+
+def test_save_passes_on_loaded_revision():
+    store = caching_store(store="RevisionedHklCalcStore")
+
+    asyncio.run(store.load("test", None))
+    store._store.revision = 3
+    hkl = asyncio.run(store.load("test", None))
+    asyncio.run(store.save("test", hkl, None))
+
+    assert store._store.saved_with == [0]
@@ -0,0 +1,125 @@
+import asyncio
+import io
+import tarfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+from diffcalc_api.config import settings
+from diffcalc_api.server import app
+from diffcalc_api.stores import serialization
+from diffcalc_api.stores.pickling import PicklingHklCalcStore
+from diffcalc_api.stores.protocol import get_store
+
+
+@pytest.fixture()
+def store(tmp_path) -> PicklingHklCalcStore:
+    store = PicklingHklCalcStore()
+    store._root_directory = tmp_path
+    for name in ("c", "a", "b"):
+        asyncio.run(store.create(name, "B07"))
+    return store
+
+
+@pytest.fixture()
+def client(store: PicklingHklCalcStore):
+    previous = app.dependency_overrides.get(get_store)
+    app.dependency_overrides[get_store] = lambda: store
+    yield TestClient(app)
+    if previous is not None:
+        app.dependency_overrides[get_store] = previous
+    else:
+        app.dependency_overrides.pop(get_store)
+
+
+def test_crystals_are_listed_a_page_at_a_time(client: TestClient):
+    first = client.get("/collections/B07?limit=2").json()["payload"]
+    second = client.get(f"/collections/B07?limit=2&after={first['next']}").json()
+
+    assert [crystal["name"] for crystal in first["crystals"]] == ["a", "b"]
+    assert second["payload"]["crystals"][0]["name"] == "c"
+    assert second["payload"]["next"] is None
+    assert not first["crystals"][0]["has_u_matrix"]
+
+
+def test_listing_skips_hidden_files(client: TestClient, tmp_path):
+    (tmp_path / "B07" / ".c.1234.tmp").write_bytes(b"partial")
+
+    response = client.get("/collections/B07")
+
+    names = [crystal["name"] for crystal in response.json()["payload"]["crystals"]]
+    assert names == ["a", "b", "c"]
+
+
+def test_exported_collections_can_be_imported(
+    client: TestClient, store: PicklingHklCalcStore
+):
+    hkl = asyncio.run(store.load("a", "B07"))
+    hkl.ubcalc.set_lattice("SiO2", 4.913, 5.405)
+    asyncio.run(store.save("a", hkl, "B07"))
+
+    archive = client.get("/collections/B07/export").content
+    imported = client.post("/collections/B08/import", content=archive)
+    again = client.post("/collections/B08/import", content=archive)
+
+    assert imported.json()["payload"] == {"imported": 3, "skipped": []}
+    assert again.json()["payload"] == {"imported": 0, "skipped": ["a", "b", "c"]}
+    listed = client.get("/collections/B08").json()["payload"]["crystals"]
+    assert listed[0]["crystal"] == "SiO2"
+
+
+def make_archive(*members) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_invalid_archives_import_nothing(
+    client: TestClient, store: PicklingHklCalcStore
+):
+    data = serialization.dumps(asyncio.run(store.load("a", "B07")))
+    archive = make_archive(("ok", data), ("../escape", data))
+
+    response = client.post("/collections/B08/import", content=archive)
+    garbage = client.post("/collections/B08/import", content=b"not an archive")
+
+    assert response.status_code == 400
+    assert garbage.status_code == 400
+    assert client.get("/collections/B08").json()["payload"]["crystals"] == []
+
+
+def test_corrupt_crystals_import_nothing(
+    client: TestClient, store: PicklingHklCalcStore
+):
+    data = serialization.dumps(asyncio.run(store.load("a", "B07")))
+    archive = make_archive(("ok", data), ("corrupt", data + b"\0"))
+
+    response = client.post("/collections/B08/import", content=archive)
+
+    assert response.status_code == 400
+    assert "corrupt is not a serialized crystal" in response.json()["message"]
+    assert client.get("/collections/B08").json()["payload"]["crystals"] == []
+
+
+def test_oversized_archives_are_rejected(
+    client: TestClient, store: PicklingHklCalcStore, monkeypatch
+):
+    data = serialization.dumps(asyncio.run(store.load("a", "B07")))
+    archive = make_archive(("a", data), ("b", data))
+
+    monkeypatch.setattr(settings, "import_max_size", len(archive) - 1)
+    too_large = client.post("/collections/B08/import", content=archive)
+    monkeypatch.setattr(settings, "import_max_size", len(data) + 1)
+    too_large_unpacked = client.post("/collections/B08/import", content=archive)
+    monkeypatch.setattr(settings, "import_max_size", len(archive))
+    monkeypatch.setattr(settings, "import_max_member_size", len(data) - 1)
+    member_too_large = client.post("/collections/B08/import", content=archive)
+
+    for response in (too_large, too_large_unpacked, member_too_large):
+        assert response.status_code == 400
+        assert "exceeds the maximum" in response.json()["message"]
+    assert client.get("/collections/B08").json()["payload"]["crystals"] == []
@@ -0,0 +1,61 @@
+from fastapi.testclient import TestClient
+from pymongo import monitoring
+
+from diffcalc_api import database
+from diffcalc_api.server import app
+
+address = ("localhost", 27017)
+
+
+def test_client_options_come_from_settings(monkeypatch):
+    monkeypatch.setattr(database.settings, "mongo_max_pool_size", 10)
+    monkeypatch.setattr(database.settings, "mongo_socket_timeout", 2.5)
+    monkeypatch.setattr(database.settings, "mongo_read_preference", "nearest")
+    monkeypatch.setattr(database.settings, "mongo_write_concern", "2")
+
+    options = database.client_options()
+
+    assert options["maxPoolSize"] == 10
+    assert options["socketTimeoutMS"] == 2500
+    assert options["readPreference"] == "nearest"
+    assert options["w"] == 2
+    assert "waitQueueTimeoutMS" not in options
+
+
+def test_write_concern_can_be_named(monkeypatch):
+    monkeypatch.setattr(database.settings, "mongo_write_concern", "majority")
+
+    assert database.client_options()["w"] == "majority"
+
+
+def test_pool_metrics_count_connections_in_use():
+    metrics = database.PoolMetrics()
+
+    metrics.connection_created(monitoring.ConnectionCreatedEvent(address, 1))
+    for _ in range(3):
+        metrics.connection_check_out_started(
+            monitoring.ConnectionCheckOutStartedEvent(address)
+        )
+    metrics.connection_checked_out(
+        monitoring.ConnectionCheckedOutEvent(address, 1, 0.5)
+    )
+    metrics.connection_check_out_failed(
+        monitoring.ConnectionCheckOutFailedEvent(
+            address, monitoring.ConnectionCheckOutFailedReason.TIMEOUT, 1.5
+        )
+    )
+    stats = metrics.stats()
+
+    assert stats["open"] == 1
+    assert stats["in_use"] == 1
+    assert stats["waiting"] == 1
+    assert stats["checkout_failures"] == 1
+    assert stats["mean_wait"] == 1.0
+    assert stats["max_wait"] == 1.5
+
+
+def test_pool_metrics_are_served():
+    response = TestClient(app).get("/metrics/mongo")
+
+    assert response.status_code == 200
+    assert "in_use" in response.json()["payload"]["pool"]
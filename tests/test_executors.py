@@ -0,0 +1,69 @@
+import asyncio
+import threading
+
+import pytest
+
+from diffcalc_api import executors
+from diffcalc_api.config import settings
+
+
+def fail():
+    raise ValueError("failed in worker")
+
+
+@pytest.fixture(autouse=True)
+def fresh_executors():
+    executors.shutdown()
+    yield
+    executors.shutdown()
+
+
+def test_routes_fall_back_when_pools_have_no_workers(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "executor_routes", {"a": "process", "b": "inline"})
+    monkeypatch.setattr(settings, "process_workers", 0)
+
+    executor = executors.resolve("a")
+    assert executor is not None and executor.kind == "thread"
+    assert executors.resolve("b") is None
+
+    monkeypatch.setattr(settings, "thread_workers", 0)
+    executors.shutdown()
+    assert executors.resolve("a") is None
+
+
+def test_process_routes_run_on_threads_if_not_allowed(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "executor_routes", {"a": "process"})
+    monkeypatch.setattr(settings, "process_workers", 1)
+
+    executor = executors.resolve("a", allow_process=False)
+    assert executor is not None and executor.kind == "thread"
+
+
+def test_exceptions_are_reraised_and_counted():
+    with pytest.raises(ValueError, match="failed in worker"):
+        asyncio.run(executors.run("a", fail))
+
+    stats = executors.metrics()["thread"]
+    assert stats["submitted"] == stats["completed"] == stats["failed"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_counts_are_kept_across_event_loops():
+    def count(i: int) -> int:
+        return i
+
+    def submit_many():
+        async def submit():
+            await asyncio.gather(*(executors.run("a", count, i) for i in range(200)))
+
+        asyncio.run(submit())
+
+    threads = [threading.Thread(target=submit_many) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = executors.metrics()["thread"]
+    assert stats["submitted"] == stats["completed"] == 800
+    assert stats["in_flight"] == 0
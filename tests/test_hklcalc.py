@@ -1,4 +1,10 @@
 import ast
+import asyncio
+import io
+import json
+import pickle
+from copy import deepcopy
+from typing import Any, Dict, List
 
 import numpy as np
 import pytest
@@ -8,8 +14,17 @@ from diffcalc.hkl.geometry import Position
 from diffcalc.ub.calc import UBCalculation
 from fastapi.testclient import TestClient
 
+from diffcalc_api import admission, executors, scan_cache
+from diffcalc_api.config import settings
+from diffcalc_api.errors.constraints import ErrorCodes as ConstraintErrorCodes
 from diffcalc_api.errors.hkl import ErrorCodes
+from diffcalc_api.models.hkl import SolutionConstraints
+from diffcalc_api.routes.hkl import ndjson_response
 from diffcalc_api.server import app
+from diffcalc_api.services.hkl import (
+    filter_lab_position_results,
+    follow_trajectory,
+)
 from diffcalc_api.stores.protocol import HklCalcStore, get_store
 from tests.conftest import FakeHklCalcStore
 
@@ -27,12 +42,14 @@ dummy_hkl.constraints = Constraints({"qaz": 0, "alpha": 0, "eta": 0})
 
 
 def dummy_get_store() -> HklCalcStore:
-    return FakeHklCalcStore(dummy_hkl)
+    return FakeHklCalcStore(deepcopy(dummy_hkl))
 
 
 @pytest.fixture()
 def client() -> TestClient:
     app.dependency_overrides[get_store] = dummy_get_store
+    scan_cache.clear()
+    admission.reset()
 
     return TestClient(app)
 
@@ -80,6 +97,120 @@ def test_hkl_positions_constrained_by_angle_bounds(client: TestClient):
     assert len(ast.literal_eval(lab_positions.content.decode())["payload"]) == 1
 
 
+def test_batch_lab_positions_match_single_requests(client: TestClient):
+    batch = client.post(
+        "/hkl/test/position/lab",
+        json={"hkl": [[0, 0, 1], [1, 0, 1]], "wavelength": 1},
+    )
+
+    assert batch.status_code == 200
+    payload = batch.json()["payload"]
+    assert payload["errors"] == {}
+
+    for i, (h, k, l) in enumerate([(0, 0, 1), (1, 0, 1)]):
+        single = client.get(
+            "/hkl/test/position/lab",
+            params={"h": h, "k": k, "l": l, "wavelength": 1},
+        ).json()["payload"]
+        rows = [row for row, idx in enumerate(payload["index"]) if idx == i]
+
+        assert len(rows) == len(single)
+        for row, position in zip(rows, single):
+            for angle, value in position.items():
+                assert payload["angles"][angle][row] == value
+
+
+def test_batch_lab_positions_report_errors_per_item(client: TestClient):
+    batch = client.post(
+        "/hkl/test/position/lab",
+        json={"hkl": [[0, 0, 0], [0, 0, 1]], "wavelengths": [1, 1]},
+    )
+
+    assert batch.status_code == 200
+    payload = batch.json()["payload"]
+    assert list(payload["errors"].keys()) == ["0"]
+    assert set(payload["index"]) == {1}
+
+
+def test_batch_lab_positions_report_unexpected_errors_per_item(client: TestClient):
+    batch = client.post(
+        "/hkl/test/position/lab",
+        json={"hkl": [[0, 0, 1], [0, 0, 1]], "wavelengths": [0, 1]},
+    )
+
+    assert batch.status_code == 200
+    payload = batch.json()["payload"]
+    assert payload["errors"]["0"].startswith("ZeroDivisionError")
+    assert set(payload["index"]) == {1}
+
+
+def test_batch_lab_positions_need_consistent_wavelengths(client: TestClient):
+    batch = client.post(
+        "/hkl/test/position/lab",
+        json={"hkl": [[0, 0, 1], [1, 0, 1]], "wavelengths": [1]},
+    )
+
+    assert batch.status_code == ErrorCodes.INVALID_BATCH
+
+
+def test_batch_miller_indices_match_single_requests(client: TestClient):
+    rng = np.random.default_rng(0)
+    angles = {
+        angle: rng.uniform(-90, 90, 5).tolist()
+        for angle in ["mu", "delta", "nu", "eta", "chi", "phi"]
+    }
+    wavelengths = rng.uniform(0.5, 2, 5).tolist()
+
+    batch = client.post(
+        "/hkl/test/position/hkl", json={**angles, "wavelengths": wavelengths}
+    )
+
+    assert batch.status_code == 200
+    payload = batch.json()["payload"]
+
+    for i in range(5):
+        single = client.get(
+            "/hkl/test/position/hkl",
+            params={
+                **{angle: values[i] for angle, values in angles.items()},
+                "wavelength": wavelengths[i],
+            },
+        ).json()["payload"]
+
+        for index in "hkl":
+            assert np.isclose(payload[index][i], single[index])
+
+
+def test_batch_miller_indices_need_consistent_lengths(client: TestClient):
+    batch = client.post(
+        "/hkl/test/position/hkl",
+        json={
+            "mu": [0, 0],
+            "delta": [0],
+            "nu": [0],
+            "eta": [0],
+            "chi": [0],
+            "phi": [0],
+            "wavelength": 1,
+        },
+    )
+
+    assert batch.status_code == ErrorCodes.INVALID_BATCH
+
+
+def test_batch_miller_indices_need_positive_wavelengths(client: TestClient):
+    angles = {angle: [0, 0] for angle in ["mu", "delta", "nu", "eta", "chi", "phi"]}
+
+    for wavelengths in ([1, 0], [1, -1]):
+        batch = client.post(
+            "/hkl/test/position/hkl", json={**angles, "wavelengths": wavelengths}
+        )
+        assert batch.status_code == ErrorCodes.INVALID_BATCH
+
+    batch = client.post("/hkl/test/position/hkl", json={**angles, "wavelength": 0})
+    assert batch.status_code == ErrorCodes.INVALID_BATCH
+
+
 def test_scan_hkl(
     client: TestClient,
 ):
@@ -98,6 +229,240 @@ def test_scan_hkl(
     assert len(scan_results.keys()) == 9
 
 
+def test_scan_hkl_in_process_pool_matches_serial_scan(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    params: Dict[str, Any] = {
+        "start": [1, 0, 1],
+        "stop": [2, 0, 2],
+        "inc": [0.25, 0, 0.25],
+        "wavelength": 1,
+    }
+    serial = client.get("/hkl/test/scan/hkl", params=params).json()["payload"]
+
+    monkeypatch.setattr(settings, "process_workers", 2)
+    monkeypatch.setattr(settings, "scan_parallel_min_points", 0)
+    scan_cache.clear()
+    try:
+        parallel = client.get("/hkl/test/scan/hkl", params=params).json()["payload"]
+    finally:
+        executors.shutdown()
+
+    assert list(parallel.keys()) == list(serial.keys())
+    assert parallel == serial
+
+
+def test_executor_metrics_count_submitted_work(client: TestClient):
+    client.get(
+        "/hkl/test/position/lab",
+        params={"h": 0, "k": 0, "l": 1, "wavelength": 1},
+    )
+    metrics = client.get("/metrics/executors").json()["payload"]
+
+    assert metrics["thread"]["submitted"] >= 1
+    assert metrics["thread"]["queue_depth"] == 0
+
+
+def test_repeated_scans_are_served_from_cache(client: TestClient):
+    params: Dict[str, Any] = {
+        "start": [1, 0, 1],
+        "stop": [2, 0, 2],
+        "inc": [0.5, 0, 0.5],
+        "wavelength": 1,
+    }
+    first = client.get("/hkl/test/scan/hkl", params=params).json()["payload"]
+    second = client.get("/hkl/test/scan/hkl", params=params).json()["payload"]
+    client.get("/hkl/test/scan/hkl", params={**params, "inc": [1, 0, 1]})
+
+    metrics = client.get("/metrics/scans").json()["payload"]["cache"]
+
+    assert first == second
+    assert metrics["hits"] == 1
+    assert metrics["misses"] == 2
+    assert metrics["entries"] == 2
+    assert metrics["points"] == 13
+
+
+def test_scan_cache_evicts_least_recently_used_results(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(settings, "scan_cache_max_points", 10)
+    params: Dict[str, Any] = {"start": [1, 0, 1], "stop": [2, 0, 2], "wavelength": 1}
+
+    incs: List[List[float]] = [[1, 0, 1], [0.5, 0, 1], [1, 0, 1], [1, 0, 0.5]]
+    for inc in incs:
+        client.get("/hkl/test/scan/hkl", params={**params, "inc": inc})
+
+    metrics = client.get("/metrics/scans").json()["payload"]["cache"]
+
+    assert metrics["hits"] == 1
+    assert metrics["evictions"] == 1
+    assert metrics["points"] == 10
+
+
+def test_scan_cache_counts_points_of_replaced_results(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(settings, "scan_cache_max_points", 3)
+    scan_cache.clear()
+    first, second = ("B07", "test", "a", "1"), ("B07", "test", "a", "2")
+
+    scan_cache.put(first, {"1": []})
+    scan_cache.put(first, {"1": [], "2": []})
+    scan_cache.put(second, {"3": []})
+    assert scan_cache.points() == 3
+
+    scan_cache.put(second, {"3": [], "4": []})
+    assert scan_cache.points() == 2
+    assert scan_cache.get(first) is None
+
+
+def test_scans_of_changed_hkl_objects_are_not_served_from_cache(
+    client: TestClient,
+):
+    params: Dict[str, Any] = {"start": 1, "stop": 2, "inc": 0.5, "h": 0, "k": 0}
+    client.get("/hkl/test/scan/wavelength", params={**params, "l": 1})
+
+    changed_hkl = pickle.loads(pickle.dumps(dummy_hkl))
+    changed_hkl.constraints = Constraints({"qaz": 0, "alpha": 0, "phi": 0})
+    app.dependency_overrides[get_store] = lambda: FakeHklCalcStore(changed_hkl)
+    client.get("/hkl/test/scan/wavelength", params={**params, "l": 1})
+
+    metrics = client.get("/metrics/scans").json()["payload"]["cache"]
+
+    assert metrics["hits"] == 0
+    assert metrics["misses"] == 2
+    assert metrics["entries"] == 1
+
+
+def test_scan_hkl_streams_one_line_per_point(client: TestClient):
+    params: Dict[str, Any] = {
+        "start": [1, 0, 1],
+        "stop": [2, 0, 2],
+        "inc": [0.5, 0, 0.5],
+        "wavelength": 1,
+    }
+    payload = client.get("/hkl/test/scan/hkl", params=params).json()["payload"]
+
+    for response in [
+        client.get("/hkl/test/scan/hkl", params={**params, "stream": True}),
+        client.get(
+            "/hkl/test/scan/hkl",
+            params=params,
+            headers={"accept": "application/x-ndjson"},
+        ),
+    ]:
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert len(lines) == 9
+        assert {k: v for line in lines for k, v in line.items()} == payload
+
+
+def test_scan_hkl_in_columnar_formats_matches_json(client: TestClient):
+    params: Dict[str, Any] = {
+        "start": [1, 0, 1],
+        "stop": [2, 0, 2],
+        "inc": [0.5, 0, 0.5],
+        "wavelength": 1,
+    }
+    payload = client.get("/hkl/test/scan/hkl", params=params).json()["payload"]
+
+    columnar = client.get(
+        "/hkl/test/scan/hkl", params={**params, "format": "columnar"}
+    ).json()["payload"]
+    points = columnar["points"]
+    keys = list(payload.keys())
+    assert [ast.literal_eval(key) for key in keys] == list(
+        zip(points["h"], points["k"], points["l"])
+    )
+    for row, point in enumerate(columnar["index"]):
+        position = {angle: values[row] for angle, values in columnar["angles"].items()}
+        assert position in payload[keys[point]]
+
+    response = client.get("/hkl/test/scan/hkl", params={**params, "format": "npz"})
+    assert response.headers["content-type"] == "application/x-npz"
+    with np.load(io.BytesIO(response.content)) as arrays:
+        for axis in "hkl":
+            assert arrays[f"points/{axis}"].dtype == np.dtype("<f8")
+            assert arrays[f"points/{axis}"].tolist() == points[axis]
+        assert arrays["index"].dtype == np.dtype("<i8")
+        assert arrays["index"].tolist() == columnar["index"]
+        for angle, values in columnar["angles"].items():
+            assert arrays[angle].dtype == np.dtype("<f8")
+            assert arrays[angle].tolist() == values
+
+
+def test_columnar_scans_hold_the_scanned_values(client: TestClient):
+    params: Dict[str, Any] = {"start": 1, "stop": 2, "inc": 0.5, "h": 0, "k": 0}
+
+    columnar = client.get(
+        "/hkl/test/scan/wavelength", params={**params, "l": 1, "format": "columnar"}
+    ).json()["payload"]
+
+    assert columnar["points"] == {"wavelength": [1.0, 1.5, 2.0]}
+
+
+def test_scan_formats_are_documented(client: TestClient):
+    responses = app.openapi()["paths"]["/hkl/{name}/scan/hkl"]["get"]["responses"]
+
+    content = responses["200"]["content"]
+    json_schema = content["application/json"]["schema"]
+    schemas = [schema["$ref"] for schema in json_schema["anyOf"]]
+    assert schemas == [
+        "#/components/schemas/ScanResponse",
+        "#/components/schemas/ColumnarScanResponse",
+    ]
+    assert content["application/x-npz"]["schema"]["format"] == "binary"
+
+
+def test_streamed_scans_are_validated_before_streaming(client: TestClient):
+    response = client.get(
+        "/hkl/test/scan/wavelength",
+        params={"start": 1, "stop": 2, "inc": -0.5, "h": 1, "k": 0, "l": 1},
+        headers={"accept": "application/x-ndjson"},
+    )
+
+    assert response.status_code == ErrorCodes.INVALID_SCAN_BOUNDS
+
+
+def test_filtered_lab_positions_match_filtering_each_solution():
+    rng = np.random.default_rng(0)
+    results = [
+        [
+            (Position(*angles), {"qaz": float(angles[0])})
+            for angles in rng.choice([-90.0, 0.0, 10.0, 30.0, 45.0, 90.0], (n, 6))
+        ]
+        for n in [0, 3, 1, 5, 20]
+    ]
+    axes = ["mu", "nu", "phi"]
+    low_bound = [0.0, -90.0, 0.0]
+    high_bound = [90.0, 45.0, 90.0]
+
+    expected = [
+        [
+            {**physical.asdict, **virtual}
+            for physical, virtual in positions
+            if all(
+                low_bound[i] < getattr(physical, angle) < high_bound[i]
+                for i, angle in enumerate(axes)
+            )
+        ]
+        for positions in results
+    ]
+    filtered = filter_lab_position_results(
+        results, SolutionConstraints(axes, low_bound, high_bound)
+    )
+
+    assert filtered == expected
+    assert 0 < sum(map(len, filtered)) < sum(map(len, results))
+    assert filter_lab_position_results(results, SolutionConstraints()) == [
+        [{**physical.asdict, **virtual} for physical, virtual in positions]
+        for positions in results
+    ]
+
+
 def test_scan_hkl_raises_invalid_solution_bounds_error_for_wrong_inputs(
     client: TestClient,
 ):
@@ -162,6 +527,137 @@ def test_scan_hkl_raises_invalid_miller_indices_error_for_wrong_inputs(
     )
 
 
+def test_scans_larger_than_the_point_budget_are_rejected(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    huge = client.get(
+        "/hkl/test/scan/hkl",
+        params={
+            "start": [1, 0, 1],
+            "stop": [2, 0, 2],
+            "inc": [1e-9, 0, 1e-9],
+            "wavelength": 1,
+        },
+    )
+    assert huge.status_code == ErrorCodes.SCAN_TOO_LARGE
+    assert huge.json()["type"] == "<class 'diffcalc_api.errors.hkl.ScanTooLargeError'>"
+
+    monkeypatch.setattr(settings, "scan_max_points", 2)
+    wavelengths = client.get(
+        "/hkl/test/scan/wavelength",
+        params={"start": 1, "stop": 2, "inc": 0.5, "h": 1, "k": 0, "l": 1},
+    )
+    assert wavelengths.status_code == ErrorCodes.SCAN_TOO_LARGE
+
+
+def test_scans_with_tiny_increments_are_rejected(client: TestClient):
+    hkl = client.get(
+        "/hkl/test/scan/hkl",
+        params={
+            "start": [1, 0, 1],
+            "stop": [2, 0, 2],
+            "inc": [1e-30, 0, 1e-30],
+            "wavelength": 1,
+            "dry_run": True,
+        },
+    )
+    wavelengths = client.get(
+        "/hkl/test/scan/wavelength",
+        params={"start": 1, "stop": 2, "inc": 1e-30, "h": 1, "k": 0, "l": 1},
+    )
+    constraint = client.get(
+        "/hkl/test/scan/alpha",
+        params={
+            "start": 1,
+            "stop": 2,
+            "inc": 1e-30,
+            "h": 1,
+            "k": 0,
+            "l": 1,
+            "wavelength": 1,
+        },
+    )
+
+    for response in (hkl, wavelengths, constraint):
+        assert response.status_code == ErrorCodes.SCAN_TOO_LARGE
+
+
+def test_dry_run_scans_estimate_cost_without_solving(client: TestClient):
+    params: Dict[str, Any] = {
+        "start": [1, 0, 1],
+        "stop": [2, 0, 2],
+        "inc": [0.5, 0, 0.5],
+        "wavelength": 1,
+    }
+    response = client.get("/hkl/test/scan/hkl", params={**params, "dry_run": True})
+    estimate = response.json()["payload"]
+
+    assert response.status_code == 200
+    assert estimate["points"] == 9
+    assert estimate["seconds_per_point"] == settings.scan_point_cost
+    assert estimate["estimated_seconds"] == pytest.approx(9 * settings.scan_point_cost)
+    assert estimate["admitted"]
+    assert scan_cache.metrics()["misses"] == 0
+
+    client.get("/hkl/test/scan/hkl", params=params)
+    measured = client.get("/metrics/scans").json()["payload"]["admission"]
+    assert measured["admitted"] == 1
+    assert measured["seconds_per_point"] != settings.scan_point_cost
+
+
+def test_scans_over_the_collection_budget_are_rejected(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    params: Dict[str, Any] = {
+        "start": 1,
+        "stop": 2,
+        "inc": 0.5,
+        "h": 1,
+        "k": 0,
+        "l": 1,
+        "collection": "B07",
+    }
+    monkeypatch.setattr(settings, "scan_budget", 2.5 * settings.scan_point_cost)
+
+    rejected = client.get("/hkl/test/scan/wavelength", params=params)
+    assert rejected.status_code == ErrorCodes.SCAN_BUDGET_EXCEEDED
+
+    estimate = client.get(
+        "/hkl/test/scan/wavelength", params={**params, "dry_run": True}
+    ).json()["payload"]
+    assert not estimate["admitted"]
+
+    monkeypatch.setattr(settings, "scan_budget", 10.0)
+    for extra in [{}, {"stream": True}]:
+        response = client.get("/hkl/test/scan/wavelength", params={**params, **extra})
+        assert response.status_code == 200
+
+    metrics = client.get("/metrics/scans").json()["payload"]
+    assert metrics["admission"]["rejected"] == 1
+    assert metrics["admission"]["admitted"] == 2
+    assert metrics["in_flight"] == {}
+
+
+def test_streamed_scans_release_their_budget_when_sending_fails():
+    admission.reset()
+
+    async def points():
+        yield "1", []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("connection reset")
+
+    with admission.admit(1, "B07") as scan:
+        response = ndjson_response(points(), scan.detach())
+    with pytest.raises(OSError):
+        asyncio.run(response({"type": "http"}, receive, send))
+
+    assert admission.metrics()[1] == {}
+
+
 def test_scan_wavelength(
     client: TestClient,
 ):
@@ -203,6 +699,132 @@ def test_scan_constraint(
     assert len(scan_results.keys()) == 3
 
 
+def test_scan_constraint_leaves_the_stored_constraints_unchanged(
+    client: TestClient,
+):
+    before = dummy_hkl.constraints.asdict
+
+    response = client.get(
+        "/hkl/test/scan/alpha",
+        params={
+            "start": 1,
+            "stop": 2,
+            "inc": 0.5,
+            "h": 1,
+            "k": 0,
+            "l": 1,
+            "wavelength": 1.0,
+        },
+    )
+
+    assert response.status_code == 200
+    assert dummy_hkl.constraints.asdict == before
+
+
+def test_scans_of_unknown_constraints_are_rejected(client: TestClient):
+    params: Dict[str, Any] = {
+        "start": 1,
+        "stop": 2,
+        "inc": 0.5,
+        "h": 1,
+        "k": 0,
+        "l": 1,
+        "wavelength": 1.0,
+    }
+
+    for response in (
+        client.get("/hkl/test/scan/foo", params=params),
+        client.get("/hkl/test/scan/foo/trajectory", params=params),
+        client.post("/hkl/test/scan/foo", params=params),
+    ):
+        assert response.status_code == ConstraintErrorCodes.INVALID_CONSTRAINT
+        assert "foo does not exist" in response.json()["message"]
+
+
+def test_scan_constraint_trajectory_picks_one_solution_per_point(
+    client: TestClient,
+):
+    params: Dict[str, Any] = {
+        "start": 1,
+        "stop": 2,
+        "inc": 0.25,
+        "h": 1,
+        "k": 0,
+        "l": 1,
+        "wavelength": 1.0,
+    }
+    scan_results = client.get("/hkl/test/scan/alpha", params=params).json()["payload"]
+    response = client.get("/hkl/test/scan/alpha/trajectory", params=params)
+    trajectory = response.json()["payload"]
+
+    assert response.status_code == 200
+    assert list(trajectory["positions"]) == list(scan_results)
+    for key, position in trajectory["positions"].items():
+        assert position in scan_results[key]
+    assert trajectory["branch_switches"] == []
+
+    jumpy = client.get(
+        "/hkl/test/scan/alpha/trajectory", params={**params, "max_jump": 1e-9}
+    ).json()["payload"]
+    assert jumpy["branch_switches"] == list(scan_results)[1:]
+
+
+def test_trajectories_do_not_keep_the_whole_scan(client: TestClient):
+    params: Dict[str, Any] = {
+        "start": 1,
+        "stop": 2,
+        "inc": 0.5,
+        "h": 1,
+        "k": 0,
+        "l": 1,
+        "wavelength": 1.0,
+    }
+    response = client.get("/hkl/test/scan/alpha/trajectory", params=params)
+
+    assert response.status_code == 200
+    assert list(response.json()["payload"]["positions"]) == ["1.0", "1.5", "2.0"]
+    assert scan_cache.points() == 0
+
+
+def test_trajectories_follow_the_closest_solution():
+    def solution(phi: float, tag: float):
+        return {**Position(phi=phi).asdict, "tag": tag}
+
+    trajectory = follow_trajectory(
+        {
+            "1": [solution(170, 0), solution(0, 1)],
+            "2": [solution(10, 0), solution(179, 1)],
+            "3": [],
+            "4": [solution(-179, 0), solution(90, 1)],
+            "5": [solution(-90, 0), solution(45, 1)],
+        }.items(),
+        max_jump=20,
+    )
+
+    assert [p["tag"] for p in trajectory.positions.values()] == [0, 1, 0, 0]
+    assert list(trajectory.positions) == ["1", "2", "4", "5"]
+    assert trajectory.branch_switches == ["5"]
+
+
+def test_scan_constraint_streams_one_line_per_point(client: TestClient):
+    lab_positions = client.get(
+        "/hkl/test/scan/alpha",
+        params={
+            "start": 1,
+            "stop": 2,
+            "inc": 0.5,
+            "h": 1,
+            "k": 0,
+            "l": 1,
+            "wavelength": 1.0,
+            "stream": True,
+        },
+    )
+
+    assert lab_positions.status_code == 200
+    assert len(lab_positions.text.splitlines()) == 3
+
+
 def test_invalid_scans(client: TestClient):
     invalid_miller_indices = client.get(
         "/hkl/test/scan/hkl",
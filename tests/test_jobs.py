@@ -0,0 +1,189 @@
+import asyncio
+import time
+from typing import Any, Dict
+
+import pytest
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.hkl.geometry import Position
+from diffcalc.ub.calc import UBCalculation
+from diffcalc.util import DiffcalcException
+from fastapi.testclient import TestClient
+
+from diffcalc_api import jobs
+from diffcalc_api.config import settings
+from diffcalc_api.errors.jobs import ErrorCodes
+from diffcalc_api.server import app
+from diffcalc_api.stores.protocol import HklCalcStore, get_store
+from tests.conftest import FakeHklCalcStore
+
+dummy_hkl = HklCalculation(UBCalculation(name="dummy"), Constraints())
+
+dummy_hkl.ubcalc.set_lattice("SiO2", 4.913, 5.405)
+dummy_hkl.ubcalc.n_hkl = (1, 0, 0)
+dummy_hkl.ubcalc.add_reflection(
+    (0, 0, 1), Position(7.31, 0, 10.62, 0, 0, 0), 12.39842, "refl1"
+)
+dummy_hkl.ubcalc.add_orientation((0, 1, 0), (0, 1, 0), None, "plane")
+dummy_hkl.ubcalc.calc_ub("refl1", "plane")
+
+dummy_hkl.constraints = Constraints({"qaz": 0, "alpha": 0, "eta": 0})
+
+
+def dummy_get_store() -> HklCalcStore:
+    return FakeHklCalcStore(dummy_hkl)
+
+
+@pytest.fixture()
+def client() -> TestClient:
+    app.dependency_overrides[get_store] = dummy_get_store
+
+    return TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def fresh_jobs():
+    jobs.shutdown()
+    yield
+    jobs.shutdown()
+
+
+class SlowScan:
+    def __init__(self, total: int, delay: float):
+        self.total = total
+        self.delay = delay
+
+    async def __aiter__(self):
+        for i in range(self.total):
+            await asyncio.sleep(self.delay)
+            yield f"{i}", [{"mu": float(i)}]
+
+
+class FailingScan:
+    async def __aiter__(self):
+        yield "0", [{"mu": 0.0}]
+        raise DiffcalcException("no solution")
+
+
+def wait_for(job_id: str, client: TestClient) -> Dict[str, Any]:
+    for _ in range(500):
+        job = client.get(f"/jobs/{job_id}").json()["payload"]
+        if job["status"] not in ["pending", "running"]:
+            return job
+        time.sleep(0.01)
+
+    raise TimeoutError(job_id)
+
+
+def test_background_scan_matches_scan(client: TestClient):
+    params: Dict[str, Any] = {
+        "start": [1, 0, 1],
+        "stop": [2, 0, 2],
+        "inc": [0.5, 0, 0.5],
+        "wavelength": 1,
+    }
+    payload = client.get("/hkl/test/scan/hkl", params=params).json()["payload"]
+
+    response = client.post("/hkl/test/scan/hkl", params=params)
+    assert response.status_code == 202
+    job = response.json()["payload"]
+    assert job["total"] == 9
+
+    job = wait_for(job["id"], client)
+    assert job["status"] == "done"
+    assert job["done"] == 9
+
+    pages = [
+        client.get(
+            f"/jobs/{job['id']}/results", params={"offset": offset, "limit": 4}
+        ).json()["payload"]
+        for offset in range(0, 9, 4)
+    ]
+    assert [len(page) for page in pages] == [4, 4, 1]
+    assert {k: v for page in pages for k, v in page.items()} == payload
+
+
+def test_failed_background_scans_report_error(client: TestClient):
+    job = jobs.submit(FailingScan(), 2)
+    failed = wait_for(job.id, client)
+
+    assert failed["status"] == "failed"
+    assert "no solution" in failed["error"]
+    assert failed["done"] == 1
+
+
+def test_cancelled_jobs_keep_partial_results(client: TestClient):
+    job = jobs.submit(SlowScan(1000, 0.01), 1000)
+    while not job.results:
+        time.sleep(0.01)
+
+    response = client.delete(f"/jobs/{job.id}")
+    assert response.status_code == 200
+
+    cancelled = wait_for(job.id, client)
+    assert cancelled["status"] == "cancelled"
+    assert 0 < cancelled["done"] < 1000
+    assert list(job.page(0, 1)) == ["0"]
+
+
+def test_queued_jobs_are_cancelled_before_starting(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "job_workers", 1)
+
+    running = jobs.submit(SlowScan(1000, 0.01), 1000)
+    queued = jobs.submit(SlowScan(1, 0), 1)
+    queued.cancel()
+    running.cancel()
+
+    assert queued.status == "cancelled"
+    assert not queued.results
+
+
+def test_jobs_expire_after_retention(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    job = jobs.submit(SlowScan(1, 0), 1)
+    assert wait_for(job.id, client)["status"] == "done"
+
+    monkeypatch.setattr(settings, "job_retention", 0)
+    response = client.get(f"/jobs/{job.id}")
+
+    assert response.status_code == ErrorCodes.JOB_NOT_FOUND
+
+
+def test_only_the_latest_finished_jobs_are_kept(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(settings, "job_max_finished", 2)
+
+    submitted = []
+    for _ in range(3):
+        job = jobs.submit(SlowScan(1, 0), 1)
+        wait_for(job.id, client)
+        submitted.append(job.id)
+
+    statuses = [client.get(f"/jobs/{job_id}").status_code for job_id in submitted]
+    assert statuses == [ErrorCodes.JOB_NOT_FOUND, 200, 200]
+
+
+def test_submissions_are_rejected_while_too_many_jobs_are_unfinished(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(settings, "job_workers", 1)
+    monkeypatch.setattr(settings, "job_max_unfinished", 2)
+    params: Dict[str, Any] = {
+        "start": [1, 0, 1],
+        "stop": [2, 0, 2],
+        "inc": [0.5, 0, 0.5],
+        "wavelength": 1,
+    }
+
+    running = jobs.submit(SlowScan(1000, 0.01), 1000)
+    queued = client.post("/hkl/test/scan/hkl", params=params)
+    rejected = client.post("/hkl/test/scan/hkl", params=params)
+
+    assert queued.status_code == 202
+    assert rejected.status_code == ErrorCodes.TOO_MANY_JOBS
+
+    running.cancel()
+    wait_for(queued.json()["payload"]["id"], client)
+    assert client.post("/hkl/test/scan/hkl", params=params).status_code == 202
@@ -0,0 +1,252 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import mongomock
+import pytest
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.hkl.geometry import Position
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_api.stores import mongo
+from diffcalc_api.stores.mongo import MongoHklCalcStore, OverwriteError
+
+
+class AsyncCursor:
+    def __init__(self, cursor: Any):
+        self.cursor = cursor
+
+    def sort(self, *args) -> "AsyncCursor":
+        self.cursor.sort(*args)
+        return self
+
+    def limit(self, limit: int) -> "AsyncCursor":
+        self.cursor.limit(limit)
+        return self
+
+    async def to_list(self, length: Optional[int]) -> List[Dict[str, Any]]:
+        return list(self.cursor)
+
+
+class AsyncCollection:
+    """Awaitable wrapper around a mongomock collection, standing in for motor."""
+
+    def __init__(self, collection: mongomock.Collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs) -> AsyncCursor:
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class AsyncDatabase:
+    def __init__(self) -> None:
+        self.database: mongomock.Database = mongomock.MongoClient().db
+        self.collections: Dict[str, AsyncCollection] = {}
+
+    def __getitem__(self, name: str) -> AsyncCollection:
+        if name not in self.collections:
+            self.collections[name] = AsyncCollection(self.database[name])
+        return self.collections[name]
+
+
+@pytest.fixture()
+def database(monkeypatch) -> AsyncDatabase:
+    database = AsyncDatabase()
+    monkeypatch.setattr(mongo, "database", database)
+    return database
+
+
+def test_collections_are_indexed_by_name_on_first_use(database: AsyncDatabase):
+    store = MongoHklCalcStore()
+
+    asyncio.run(store.create("test", "B07"))
+
+    index = database.database["B07"].index_information()[mongo.NAME_INDEX]
+    assert index["key"] == [("ubcalc.name", 1)]
+    assert index["unique"]
+
+
+def test_duplicate_names_are_still_rejected_without_an_index(
+    database: AsyncDatabase,
+):
+    database.database["B07"].insert_many(
+        [{"ubcalc": {"name": "twin"}}, {"ubcalc": {"name": "twin"}}]
+    )
+    store = MongoHklCalcStore()
+
+    asyncio.run(store.create("test", "B07"))
+    with pytest.raises(OverwriteError):
+        asyncio.run(store.create("test", "B07"))
+
+    assert not store._unique["B07"]
+
+
+def test_partial_loads_project_requested_fields(database: AsyncDatabase):
+    store = MongoHklCalcStore()
+    asyncio.run(store.create("test", "B07"))
+    hkl = asyncio.run(store.load("test", "B07"))
+    hkl.ubcalc.set_lattice("SiO2", 4.913, 5.405)
+    hkl.ubcalc.set_u([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+    asyncio.run(store.save("test", hkl, "B07"))
+
+    ubcalc = asyncio.run(store.load_ubcalc("test", "B07", ["u_matrix"]))
+
+    assert ubcalc.U.tolist() == [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+    assert ubcalc.crystal is None
+
+
+def test_partial_loads_of_binary_documents(database: AsyncDatabase):
+    store = MongoHklCalcStore(binary=True)
+    asyncio.run(store.create("test", "B07"))
+
+    ubcalc = asyncio.run(store.load_ubcalc("test", "B07", ["name"]))
+
+    assert ubcalc.name == "test"
+
+
+def reflection(tag: str, eta: float = 0.0) -> Dict[str, Any]:
+    pos = {"mu": 7.31, "delta": 0, "nu": 10.62, "eta": eta, "chi": 0, "phi": 0}
+    return {"h": 0, "k": 0, "l": 1, "pos": pos, "energy": 12.4, "tag": tag}
+
+
+def document(*reflections: Dict[str, Any], u=None) -> Dict[str, Any]:
+    return {
+        "ubcalc": {"name": "test", "reflist": list(reflections), "u_matrix": u},
+        "constraints": {"qaz": 0},
+    }
+
+
+def test_diff_of_unchanged_documents_is_empty():
+    assert mongo.diff(document(reflection("a")), document(reflection("a"))) == {}
+
+
+def test_diff_pushes_added_reflections():
+    update = mongo.diff(
+        document(reflection("a")), document(reflection("a"), reflection("b"))
+    )
+
+    assert update == {"$push": {"ubcalc.reflist": {"$each": [reflection("b")]}}}
+
+
+def test_diff_pulls_deleted_reflections():
+    update = mongo.diff(
+        document(reflection("a"), reflection("b"), reflection("c")),
+        document(reflection("a"), reflection("c")),
+    )
+
+    assert update == {"$pull": {"ubcalc.reflist": {"$in": [reflection("b")]}}}
+
+
+def test_diff_sets_edited_reflections_and_fields():
+    update = mongo.diff(
+        document(reflection("a"), reflection("b")),
+        document(reflection("a"), reflection("b", eta=5), u=[[1, 0], [0, 1]]),
+    )
+
+    assert update == {
+        "$set": {
+            "ubcalc.reflist.1": reflection("b", eta=5),
+            "ubcalc.u_matrix": [[1, 0], [0, 1]],
+        }
+    }
+
+
+def test_diff_sets_lists_when_duplicates_are_removed():
+    update = mongo.diff(
+        document(reflection("a"), reflection("a"), reflection("b")),
+        document(reflection("a"), reflection("b")),
+    )
+
+    assert update == {"$set": {"ubcalc.reflist": [reflection("a"), reflection("b")]}}
+
+
+def test_saves_only_send_changes(database: AsyncDatabase, monkeypatch):
+    store = MongoHklCalcStore()
+    asyncio.run(store.create("test", "B07"))
+    hkl = asyncio.run(store.load("test", "B07"))
+    hkl.ubcalc.add_reflection((0, 0, 1), Position(7.31, 0, 10.62, 0, 0, 0), 12.4, "a")
+    asyncio.run(store.save("test", hkl, "B07"))
+
+    updates: List[Dict[str, Any]] = []
+    coll = database["B07"]
+    find_one_and_update = coll.find_one_and_update
+
+    async def spy(query, update, **kwargs):
+        updates.append(update)
+        return await find_one_and_update(query, update, **kwargs)
+
+    monkeypatch.setattr(coll, "find_one_and_update", spy, raising=False)
+    hkl.ubcalc.add_reflection((0, 1, 1), Position(7.31, 0, 10.62, 5, 0, 0), 12.4, "b")
+    hkl.ubcalc.del_reflection("a")
+    asyncio.run(store.save("test", hkl, "B07"))
+    hkl.ubcalc.add_reflection((1, 0, 1), Position(7.31, 0, 10.62, 9, 0, 0), 12.4, "c")
+    asyncio.run(store.save("test", hkl, "B07"))
+
+    assert set(updates[0]) == {"$set", "$inc"}
+    assert list(updates[1]) == ["$push", "$inc"]
+    stored = asyncio.run(MongoHklCalcStore().load("test", "B07"))
+    assert stored.asdict == hkl.asdict
+
+
+def test_saves_after_deleting_and_recreating_send_the_whole_document(
+    database: AsyncDatabase,
+):
+    store, other = MongoHklCalcStore(), MongoHklCalcStore()
+    asyncio.run(store.create("test", "B07"))
+    hkl = asyncio.run(store.load("test", "B07"))
+    hkl.ubcalc.add_reflection((0, 0, 1), Position(7.31, 0, 10.62, 0, 0, 0), 12.4, "a")
+    asyncio.run(store.save("test", hkl, "B07"))
+
+    asyncio.run(store.delete("test", "B07"))
+    asyncio.run(store.create("test", "B07"))
+    recreated = asyncio.run(other.load("test", "B07"))
+    recreated.ubcalc.add_reflection(
+        (0, 1, 1), Position(7.31, 0, 10.62, 5, 0, 0), 12.4, "b"
+    )
+    asyncio.run(other.save("test", recreated, "B07"))
+
+    revision = asyncio.run(store.get_revision("test", "B07"))
+    asyncio.run(store.save("test", hkl, "B07", revision))
+
+    stored = asyncio.run(MongoHklCalcStore().load("test", "B07"))
+    assert stored.asdict == hkl.asdict
+
+
+def test_collections_are_listed_in_pages(database: AsyncDatabase):
+    store = MongoHklCalcStore()
+    for name in ("c", "a", "b"):
+        asyncio.run(store.create(name, "B07"))
+    hkl = asyncio.run(store.load("a", "B07"))
+    hkl.ubcalc.set_u([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+    asyncio.run(store.save("a", hkl, "B07"))
+
+    first = asyncio.run(store.list_ubcalcs("B07", None, 2))
+    second = asyncio.run(store.load_many("B07", "b", 2))
+
+    assert [name for name, _, _ in first] == ["a", "b"]
+    assert first[0][2] == asyncio.run(store.get_revision("a", "B07"))
+    assert first[0][1].U.tolist() == [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+    assert [name for name, _ in second] == ["c"]
+
+
+def test_bulk_creation_skips_existing_names(database: AsyncDatabase):
+    store = MongoHklCalcStore(binary=True)
+    asyncio.run(store.create("a", "B07"))
+    calcs = [
+        (name, HklCalculation(UBCalculation(name=name), Constraints()))
+        for name in "abc"
+    ]
+
+    skipped = asyncio.run(store.create_many("B07", calcs))
+
+    assert skipped == ["a"]
+    assert asyncio.run(store.load("c", "B07")).ubcalc.name == "c"
+    assert database.database["B07"].count_documents({}) == 3
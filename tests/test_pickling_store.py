@@ -0,0 +1,200 @@
+import asyncio
+import os
+
+import pytest
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_api.stores import pickling
+from diffcalc_api.stores.pickling import (
+    REVISION_HEADER,
+    PicklingHklCalcStore,
+    RevisionConflictError,
+)
+
+
+@pytest.fixture()
+def store(tmp_path) -> PicklingHklCalcStore:
+    store = PicklingHklCalcStore()
+    store._root_directory = tmp_path
+    (tmp_path / "B07").mkdir()
+
+    hkl = HklCalculation(UBCalculation(name="test"), Constraints())
+    asyncio.run(store.save("test", hkl, "B07"))
+    return store
+
+
+def test_revisions_do_not_depend_on_modification_times(store: PicklingHklCalcStore):
+    path = store._root_directory / "B07" / "test"
+    mtime = path.stat().st_mtime_ns
+    revision = asyncio.run(store.get_revision("test", "B07"))
+    stale = asyncio.run(store.load("test", "B07"))
+
+    for _ in range(2):
+        hkl = asyncio.run(store.load("test", "B07"))
+        asyncio.run(store.save("test", hkl, "B07"))
+        os.utime(path, ns=(0, mtime))
+
+    assert asyncio.run(store.get_revision("test", "B07")) == revision + 2
+    with pytest.raises(RevisionConflictError):
+        asyncio.run(store.save("test", stale, "B07"))
+
+
+def test_recreated_files_do_not_repeat_revisions(store: PicklingHklCalcStore):
+    revision = asyncio.run(store.get_revision("test", "B07"))
+    asyncio.run(store.delete("test", "B07"))
+    asyncio.run(store.create("test", "B07"))
+
+    assert asyncio.run(store.get_revision("test", "B07")) > revision
+
+
+def test_files_without_a_revision_are_at_revision_zero(
+    store: PicklingHklCalcStore,
+):
+    path = store._root_directory / "B07" / "test"
+    path.write_bytes(path.read_bytes()[REVISION_HEADER.size :])
+
+    hkl = asyncio.run(store.load("test", "B07"))
+    asyncio.run(store.save("test", hkl, "B07"))
+
+    assert store.loaded_revision(hkl) == 1
+
+
+def test_partial_loads_read_the_summary(store: PicklingHklCalcStore, monkeypatch):
+    hkl = asyncio.run(store.load("test", "B07"))
+    hkl.ubcalc.set_u([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+    asyncio.run(store.save("test", hkl, "B07"))
+
+    async def full_load(name, collection):
+        raise AssertionError("whole file loaded")
+
+    monkeypatch.setattr(store, "load", full_load)
+    ubcalc = asyncio.run(store.load_ubcalc("test", "B07", ["u_matrix"]))
+
+    assert ubcalc.U.tolist() == [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+
+
+def test_stale_summaries_are_rewritten(store: PicklingHklCalcStore):
+    store._cache.clear()
+    path = store._root_directory / "B07" / "test"
+    summary = store._summary_path(path)
+    summary.unlink()
+
+    ubcalc = asyncio.run(store.load_ubcalc("test", "B07", ["reference"]))
+    assert ubcalc.reference.rlv
+    assert summary.is_file()
+
+    revision = asyncio.run(store.get_revision("test", "B07"))
+    summary.write_text(summary.read_text().replace(str(revision), str(revision - 1)))
+    store._cache.clear()
+    asyncio.run(store.load_ubcalc("test", "B07", ["reference"]))
+    assert f'"revision": {revision}' in summary.read_text()
+
+
+def test_concurrent_saves_of_one_revision_are_serialised(store: PicklingHklCalcStore):
+    first = asyncio.run(store.load("test", "B07"))
+    second = asyncio.run(store.load("test", "B07"))
+    revision = asyncio.run(store.get_revision("test", "B07"))
+
+    async def save_both():
+        return await asyncio.gather(
+            store.save("test", first, "B07", revision),
+            store.save("test", second, "B07", revision),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(save_both())
+
+    assert results[0] is None
+    assert isinstance(results[1], RevisionConflictError)
+
+
+def test_failed_writes_leave_the_file_intact(store: PicklingHklCalcStore, monkeypatch):
+    path = store._root_directory / "B07" / "test"
+    before = path.read_bytes()
+    hkl = asyncio.run(store.load("test", "B07"))
+    hkl.ubcalc.set_lattice("SiO2", 4.913, 5.405)
+
+    def crash(source, destination):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", crash)
+    with pytest.raises(OSError):
+        asyncio.run(store.save("test", hkl, "B07"))
+
+    assert path.read_bytes() == before
+    assert sorted(p.name for p in path.parent.iterdir()) == [
+        ".locks",
+        ".summaries",
+        "test",
+    ]
+
+
+def test_writes_keep_the_mode_of_the_file(store: PicklingHklCalcStore):
+    path = store._root_directory / "B07" / "test"
+    hkl = asyncio.run(store.load("test", "B07"))
+
+    assert path.stat().st_mode & 0o777 == pickling.NEW_FILE_MODE & 0o777
+    path.chmod(0o640)
+    asyncio.run(store.save("test", hkl, "B07"))
+
+    assert path.stat().st_mode & 0o777 == 0o640
+
+
+def test_unchanged_files_are_not_read_again(store: PicklingHklCalcStore, monkeypatch):
+    asyncio.run(store.load("test", "B07"))
+
+    def read(path):
+        raise AssertionError("file read again")
+
+    monkeypatch.setattr(store, "_read", read)
+    first = asyncio.run(store.load("test", "B07"))
+    second = asyncio.run(store.load("test", "B07"))
+    ubcalc = asyncio.run(store.load_ubcalc("test", "B07", ["name"]))
+
+    assert first is not second
+    assert ubcalc.name == "test"
+
+
+def test_readonly_loads_share_one_decoded_object(
+    store: PicklingHklCalcStore, monkeypatch
+):
+    first = asyncio.run(store.load("test", "B07", readonly=True))
+
+    def decode(data):
+        raise AssertionError("file decoded again")
+
+    monkeypatch.setattr(store, "_decode", decode)
+    second = asyncio.run(store.load("test", "B07", readonly=True))
+    ubcalc = asyncio.run(store.load_ubcalc("test", "B07", ["name"]))
+
+    assert first is second
+    assert ubcalc is first.ubcalc
+    assert store.loaded_revision(first) == asyncio.run(
+        store.get_revision("test", "B07")
+    )
+
+
+def test_files_changed_by_other_processes_are_read_again(
+    store: PicklingHklCalcStore,
+):
+    other = PicklingHklCalcStore()
+    other._root_directory = store._root_directory
+    asyncio.run(store.load("test", "B07"))
+
+    path = store._root_directory / "B07" / "test"
+    mtime = path.stat().st_mtime_ns
+
+    hkl = asyncio.run(other.load("test", "B07"))
+    hkl.ubcalc.set_u([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+    asyncio.run(other.save("test", hkl, "B07"))
+    os.utime(path, ns=(0, mtime))
+
+    loaded = asyncio.run(store.load("test", "B07"))
+    ubcalc = asyncio.run(store.load_ubcalc("test", "B07", ["u_matrix"]))
+    assert loaded.ubcalc.U.tolist() == [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+    assert ubcalc.U.tolist() == [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+    assert store.loaded_revision(loaded) == asyncio.run(
+        store.get_revision("test", "B07")
+    )
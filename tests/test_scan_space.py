@@ -0,0 +1,62 @@
+import sys
+from itertools import product
+
+import numpy as np
+import pytest
+
+from diffcalc_api.scan_space import ScanAxis, ScanGrid
+
+
+@pytest.mark.parametrize(
+    "start,stop,inc",
+    [
+        (1.0, 2.0, 0.1),
+        (0.0, 1.0, 1 / 3),
+        (-1.5, 2.25, 0.25),
+        (2.0, 1.0, -0.1),
+        (0.1, 0.3, 0.1),
+        (1.0, 0.0, 0.5),
+        (1.0, 1.0, 0.5),
+        (0.0, 1.0, 1e-3),
+    ],
+)
+def test_scan_axis_matches_numpy_arange(start: float, stop: float, inc: float):
+    expected = np.arange(start, stop + inc, inc)
+    axis = ScanAxis(start, stop, inc)
+
+    assert len(axis) == len(expected)
+    assert list(axis) == expected.tolist()
+    assert [str(value) for value in axis] == [f"{value}" for value in expected]
+    assert axis[2:5] == expected[2:5].tolist()
+    if len(axis):
+        assert axis[-1] == expected[-1]
+
+
+def test_scan_axis_without_increment_is_empty():
+    assert len(ScanAxis(0, 1, 0)) == 0
+
+
+def test_scan_grid_matches_itertools_product():
+    axes = [ScanAxis(1, 2, 0.25), [0], ScanAxis(0, 1, 0.5)]
+    grid = ScanGrid(*axes)
+    expected = list(product(*axes))
+
+    assert len(grid) == len(expected)
+    assert list(grid) == expected
+    assert [grid[i] for i in range(len(grid))] == expected
+    assert grid[4:11] == expected[4:11]
+
+
+def test_huge_scan_grids_are_sized_without_generating_points():
+    grid = ScanGrid(*[ScanAxis(0, 1, 1e-9)] * 3)
+
+    assert grid.size == (10**9 + 1) ** 3
+    assert grid[-1] == (1.0, 1.0, 1.0)
+
+
+def test_axes_too_large_for_len_are_sized():
+    axis = ScanAxis(0, 1, 1e-30)
+    grid = ScanGrid(axis, [0], axis)
+
+    assert axis.size > sys.maxsize
+    assert grid.size == axis.size**2
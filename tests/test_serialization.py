@@ -0,0 +1,118 @@
+import asyncio
+import pickle
+
+import pytest
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.hkl.geometry import Position
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_api.stores import serialization
+from diffcalc_api.stores.pickling import REVISION_HEADER, PicklingHklCalcStore
+
+
+def configured_hkl() -> HklCalculation:
+    hkl = HklCalculation(UBCalculation(name="test"), Constraints())
+    hkl.ubcalc.set_lattice("SiO2", 4.913, 5.405)
+    hkl.ubcalc.n_hkl = (1, 0, 0)
+    hkl.ubcalc.add_reflection(
+        (0, 0, 1), Position(7.31, 0, 10.62, 0, 0, 0), 12.39842, "refl1"
+    )
+    hkl.ubcalc.add_orientation((0, 1, 0), (0, 1, 0), None, "plane")
+    hkl.ubcalc.calc_ub("refl1", "plane")
+    hkl.constraints = Constraints({"qaz": 0, "a_eq_b": True, "eta": 5.5})
+    return hkl
+
+
+def test_round_trip_preserves_the_object():
+    hkl = configured_hkl()
+
+    decoded = serialization.loads(serialization.dumps(hkl))
+
+    assert decoded.asdict == hkl.asdict
+    assert decoded.ubcalc.UB.tolist() == hkl.ubcalc.UB.tolist()
+    assert decoded.constraints.asdict == hkl.constraints.asdict
+    assert decoded.constraints.indegrees
+
+
+def test_round_trip_of_an_empty_object():
+    hkl = HklCalculation(UBCalculation(name="empty"), Constraints())
+
+    decoded = serialization.loads(serialization.dumps(hkl))
+
+    assert decoded.asdict == hkl.asdict
+
+
+def test_positions_in_radians_are_preserved():
+    hkl = HklCalculation(UBCalculation(name="test"), Constraints())
+    hkl.ubcalc.add_reflection(
+        (0, 0, 1), Position(0.1, 0, 0.2, 0, 0, 0, indegrees=False), 12.4, None
+    )
+
+    decoded = serialization.loads(serialization.dumps(hkl))
+    pos = decoded.ubcalc.reflist.reflections[0].pos
+
+    assert not pos.indegrees
+    assert pos.mu == 0.1
+    assert decoded.ubcalc.reflist.reflections[0].tag is None
+
+
+def test_reported_angles_are_preserved_exactly():
+    angles = [0.1 * i + 0.013 for i in range(1, 400)]
+    hkl = HklCalculation(UBCalculation(name="test"), Constraints())
+    for angle in angles:
+        hkl.ubcalc.add_reflection((0, 0, 1), Position(angle, angle), 12.4, None)
+    hkl.constraints = Constraints({"qaz": angles[-1], "alpha": 1.1, "eta": 5.5})
+
+    decoded = serialization.loads(serialization.dumps(hkl))
+    decoded = serialization.loads(serialization.dumps(decoded))
+
+    assert [r.pos.asdict for r in decoded.ubcalc.reflist.reflections] == [
+        r.pos.asdict for r in hkl.ubcalc.reflist.reflections
+    ]
+    assert decoded.constraints.asdict == hkl.constraints.asdict
+
+
+def test_binary_format_is_smaller_than_a_pickle():
+    hkl = configured_hkl()
+
+    assert len(serialization.dumps(hkl)) < len(pickle.dumps(hkl)) / 2
+
+
+def test_unknown_versions_are_rejected():
+    blob = bytearray(serialization.dumps(configured_hkl()))
+    blob[len(serialization.MAGIC)] = serialization.VERSION + 1
+
+    with pytest.raises(ValueError):
+        serialization.loads(bytes(blob))
+
+
+def test_corrupt_objects_are_rejected():
+    blob = serialization.dumps(configured_hkl())
+    assert blob.count(b"qaz") == 1
+
+    for corrupt in (
+        blob[:-1],
+        blob + b"\0",
+        blob[: len(serialization.MAGIC)],
+        blob.replace(b"qaz", b"xyz"),
+    ):
+        with pytest.raises(ValueError):
+            serialization.loads(corrupt)
+
+
+def test_pickling_store_loads_files_in_either_format(tmp_path):
+    pickled = PicklingHklCalcStore()
+    binary = PicklingHklCalcStore(binary=True)
+    for store in (pickled, binary):
+        store._root_directory = tmp_path
+    (tmp_path / "B07").mkdir()
+
+    asyncio.run(pickled.save("old", configured_hkl(), "B07"))
+    asyncio.run(binary.save("new", configured_hkl(), "B07"))
+
+    data = (tmp_path / "B07" / "new").read_bytes()
+    assert serialization.is_binary(data[REVISION_HEADER.size :])
+    for name in ("old", "new"):
+        hkl = asyncio.run(binary.load(name, "B07"))
+        assert hkl.asdict == configured_hkl().asdict
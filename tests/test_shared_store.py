@@ -0,0 +1,188 @@
+import asyncio
+import logging
+
+import pytest
+
+from diffcalc_api import scan_cache
+from diffcalc_api.stores import serialization, shared
+from diffcalc_api.stores.caching import CachingHklCalcStore
+from diffcalc_api.stores.shared import (
+    MemorySharedCache,
+    RedisSharedCache,
+    SharedCachingHklCalcStore,
+    connect,
+)
+from tests.test_caching_store import dummy_hkl
+
+
+@pytest.fixture(autouse=True)
+def flush_shared_cache():
+    MemorySharedCache("test").flush()
+    scan_cache.clear()
+    yield
+    scan_cache.use_shared(None)
+    scan_cache.clear()
+
+
+def replica(
+    ttl: float = 300.0, store: str = "CountingHklCalcStore"
+) -> SharedCachingHklCalcStore:
+    return SharedCachingHklCalcStore(
+        f"tests.test_caching_store.{store}",
+        "memory://test",
+        ttl,
+        dummy_hkl,
+    )
+
+
+def test_objects_loaded_by_one_replica_are_shared_with_others():
+    first, second = replica(), replica()
+
+    asyncio.run(first.load("test", "B07"))
+    hkl = asyncio.run(second.load("test", "B07"))
+
+    assert first._store.loads == 1
+    assert second._store.loads == 0
+    assert hkl.ubcalc.crystal.name == "SiO2"
+
+
+def test_save_and_delete_drop_shared_objects():
+    first, second = replica(), replica()
+
+    hkl = asyncio.run(first.load("test", "B07"))
+    asyncio.run(second.save("test", hkl, "B07"))
+    asyncio.run(first.load("test", "B07"))
+    asyncio.run(second.delete("test", "B07"))
+    asyncio.run(first.load("test", "B07"))
+
+    assert first._store.loads == 3
+
+
+def test_shared_objects_are_not_pickled():
+    store = replica()
+
+    asyncio.run(store.load("test", "B07"))
+    blob = asyncio.run(store.cache.get(store._key("test", "B07")))
+
+    assert blob is not None
+    assert serialization.is_binary(blob[shared.REVISION_HEADER.size :])
+
+
+def test_shared_objects_of_an_old_revision_are_not_served():
+    store = replica(store="RevisionedHklCalcStore")
+
+    asyncio.run(store.load("test", "B07"))
+    store._store.revision += 1
+    hkl = asyncio.run(store.load("test", "B07"))
+    asyncio.run(store.load("test", "B07"))
+
+    assert store._store.loads == 2
+    assert store.loaded_revision(hkl) == 1
+
+
+def test_unreadable_shared_objects_are_reloaded():
+    store = replica()
+    asyncio.run(store.cache.set(store._key("test", "B07"), b"garbage", 300.0))
+
+    hkl = asyncio.run(store.load("test", "B07"))
+
+    assert store._store.loads == 1
+    assert hkl.ubcalc.crystal.name == "SiO2"
+
+
+def test_expired_shared_objects_are_reloaded():
+    store = replica(ttl=0)
+
+    asyncio.run(store.load("test", None))
+    asyncio.run(store.load("test", None))
+
+    assert store._store.loads == 2
+
+
+def test_invalidations_reach_local_caches_of_other_replicas():
+    local = CachingHklCalcStore(
+        "diffcalc_api.stores.shared.SharedCachingHklCalcStore",
+        2,
+        30.0,
+        "tests.test_caching_store.CountingHklCalcStore",
+        "memory://test",
+        300.0,
+        dummy_hkl,
+    )
+    other = replica()
+
+    asyncio.run(local.load("test", "B07"))
+    asyncio.run(local.load("test", "B07"))
+    assert local._store._store.loads == 1
+
+    hkl = asyncio.run(other.load("test", "B07"))
+    asyncio.run(other.save("test", hkl, "B07"))
+    asyncio.run(local.load("test", "B07"))
+
+    assert local._store._store.loads == 2
+
+
+def test_scan_results_are_shared_between_replicas():
+    scan_cache.use_shared(connect("memory://test"))
+    key = scan_cache.key(dummy_hkl, "test", "B07", "hkl", (0, 0, 1))
+    results = {"(0, 0, 1)": [{"mu": 1.0}]}
+
+    asyncio.run(scan_cache.keep(key, results))
+    scan_cache.clear()
+
+    assert asyncio.run(scan_cache.fetch(key)) == results
+    assert scan_cache.metrics()["shared_hits"] == 1
+
+
+def test_published_invalidations_drop_local_scan_results():
+    scan_cache.use_shared(connect("memory://test"))
+    key = scan_cache.key(dummy_hkl, "test", "B07", "hkl", (0, 0, 1))
+    asyncio.run(scan_cache.fetch(key))
+    scan_cache.put(key, {"(0, 0, 1)": []})
+
+    asyncio.run(replica().invalidate("test", "B07"))
+
+    assert scan_cache.get(key) is None
+
+
+class DroppingPubSub:
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def subscribe(self, channel):
+        pass
+
+    async def listen(self):
+        for message in self.messages.pop(0):
+            if isinstance(message, Exception):
+                raise message
+            yield {"data": message.encode()}
+        await asyncio.Event().wait()
+
+
+class DroppingRedis:
+    def __init__(self, *messages):
+        self.messages = list(messages)
+
+    def pubsub(self, ignore_subscribe_messages):
+        return DroppingPubSub(self.messages)
+
+
+def test_lost_subscriptions_are_logged_and_restored(monkeypatch, caplog):
+    monkeypatch.setattr(shared, "RESUBSCRIBE_DELAY", 0)
+    cache = RedisSharedCache.__new__(RedisSharedCache)
+    cache._client = DroppingRedis(["first", ConnectionError("dropped")], ["second"])
+    cache._listeners = []
+    received = []
+
+    async def listen():
+        await cache.subscribe("channel", received.append)
+        for _ in range(10):
+            await asyncio.sleep(0)
+        cache._listeners[0].cancel()
+
+    with caplog.at_level(logging.ERROR):
+        asyncio.run(listen())
+
+    assert received == ["first", "second"]
+    assert "Lost subscription to channel" in caplog.text
@@ -0,0 +1,38 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from diffcalc_api.stores.sqlite import RowNotFoundError, SqliteHklCalcStore
+
+
+@pytest.fixture()
+def store(tmp_path):
+    store = SqliteHklCalcStore(str(tmp_path / "test.sqlite"))
+    yield store
+    store.close()
+
+
+def test_database_uses_write_ahead_log(store: SqliteHklCalcStore):
+    asyncio.run(store.create("test", "B07"))
+
+    connection = sqlite3.connect(store.path)
+    assert connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_saves_of_deleted_crystals_are_not_found(store: SqliteHklCalcStore):
+    asyncio.run(store.create("test", "B07"))
+    hkl = asyncio.run(store.load("test", "B07"))
+    asyncio.run(store.delete("test", "B07"))
+
+    with pytest.raises(RowNotFoundError):
+        asyncio.run(store.save("test", hkl, "B07"))
+
+
+def test_closing_releases_the_connection_and_worker(store: SqliteHklCalcStore):
+    asyncio.run(store.create("test", "B07"))
+
+    store.close()
+
+    assert store._connection is None
+    assert store._executor._pool is None
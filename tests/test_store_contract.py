@@ -0,0 +1,211 @@
+"""Behaviour which every store following diffcalc_api.stores.protocol must share."""
+
+import asyncio
+from typing import Callable
+
+import pytest
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_api.errors.definitions import DiffcalcAPIException
+from diffcalc_api.stores import mongo
+from diffcalc_api.stores.archive import ArchiveHklCalcStore
+from diffcalc_api.stores.mongo import MongoHklCalcStore
+from diffcalc_api.stores.pickling import PicklingHklCalcStore
+from diffcalc_api.stores.protocol import HklCalcStore, close_store
+from diffcalc_api.stores.sqlite import SqliteHklCalcStore
+from tests.test_mongo_store import AsyncDatabase
+
+StoreFactory = Callable[[], HklCalcStore]
+
+
+def pickling_store(root) -> PicklingHklCalcStore:
+    store = PicklingHklCalcStore()
+    store._root_directory = root
+    return store
+
+
+def archive_store(root) -> ArchiveHklCalcStore:
+    store = ArchiveHklCalcStore()
+    store._root_directory = root
+    return store
+
+
+@pytest.fixture(params=["mongo", "pickling", "archive", "sqlite"])
+def new_store(request, tmp_path, monkeypatch) -> StoreFactory:
+    """Make stores of one kind, which all share the same persisted objects."""
+    if request.param == "mongo":
+        monkeypatch.setattr(mongo, "database", AsyncDatabase())
+        return MongoHklCalcStore
+    if request.param == "pickling":
+        return lambda: pickling_store(tmp_path)
+    if request.param == "archive":
+        return lambda: archive_store(tmp_path)
+
+    stores = []
+
+    def sqlite_store() -> SqliteHklCalcStore:
+        stores.append(SqliteHklCalcStore(str(tmp_path / "test.sqlite")))
+        return stores[-1]
+
+    def close_all() -> None:
+        for store in stores:
+            store.close()
+
+    request.addfinalizer(close_all)
+    return sqlite_store
+
+
+@pytest.fixture()
+def store(new_store: StoreFactory) -> HklCalcStore:
+    store = new_store()
+    asyncio.run(store.create("test", "B07"))
+    return store
+
+
+def status_code(error: pytest.ExceptionInfo) -> int:
+    assert isinstance(error.value, DiffcalcAPIException)
+    return error.value.status_code
+
+
+def test_objects_are_saved_and_loaded(store: HklCalcStore):
+    hkl = asyncio.run(store.load("test", "B07"))
+    hkl.ubcalc.set_lattice("SiO2", 4.913, 5.405)
+    asyncio.run(store.save("test", hkl, "B07"))
+
+    loaded = asyncio.run(store.load("test", "B07"))
+
+    assert loaded.asdict == hkl.asdict
+    assert store.loaded_revision(loaded) == asyncio.run(
+        store.get_revision("test", "B07")
+    )
+
+
+def test_readonly_loads_return_the_same_object(store: HklCalcStore):
+    hkl = asyncio.run(store.load("test", "B07"))
+    hkl.ubcalc.set_lattice("SiO2", 4.913, 5.405)
+    asyncio.run(store.save("test", hkl, "B07"))
+
+    loaded = asyncio.run(store.load("test", "B07", readonly=True))
+
+    assert loaded.asdict == hkl.asdict
+
+
+def test_saves_increment_the_revision(store: HklCalcStore):
+    hkl = asyncio.run(store.load("test", "B07"))
+    before = store.loaded_revision(hkl)
+
+    asyncio.run(store.save("test", hkl, "B07"))
+
+    after = asyncio.run(store.get_revision("test", "B07"))
+    assert before is not None and after > before
+    assert store.loaded_revision(hkl) == after
+
+
+def test_creating_an_existing_crystal_fails(store: HklCalcStore):
+    with pytest.raises(DiffcalcAPIException) as error:
+        asyncio.run(store.create("test", "B07"))
+
+    assert status_code(error) == 405
+    asyncio.run(store.create("test", "B08"))
+
+
+def test_missing_crystals_are_not_found(store: HklCalcStore):
+    asyncio.run(store.delete("test", "B07"))
+
+    with pytest.raises(DiffcalcAPIException) as error:
+        asyncio.run(store.load("test", "B07"))
+    assert status_code(error) == 404
+
+    with pytest.raises(DiffcalcAPIException) as error:
+        asyncio.run(store.delete("test", "B07"))
+    assert status_code(error) == 404
+
+
+def test_crystals_in_missing_collections_are_not_found(store: HklCalcStore):
+    with pytest.raises(DiffcalcAPIException) as error:
+        asyncio.run(store.load("test", "missing"))
+    assert status_code(error) == 404
+
+    with pytest.raises(DiffcalcAPIException) as error:
+        asyncio.run(store.delete("test", "missing"))
+    assert status_code(error) == 404
+
+
+def test_concurrent_saves_conflict(store: HklCalcStore):
+    first = asyncio.run(store.load("test", "B07"))
+    second = asyncio.run(store.load("test", "B07"))
+
+    asyncio.run(store.save("test", first, "B07"))
+
+    with pytest.raises(DiffcalcAPIException) as error:
+        asyncio.run(store.save("test", second, "B07"))
+    assert status_code(error) == 409
+
+
+def test_stale_objects_cannot_be_saved_over_recreated_crystals(
+    store: HklCalcStore,
+):
+    stale = asyncio.run(store.load("test", "B07"))
+    asyncio.run(store.delete("test", "B07"))
+    asyncio.run(store.create("test", "B07"))
+
+    with pytest.raises(DiffcalcAPIException) as error:
+        asyncio.run(store.save("test", stale, "B07"))
+    assert status_code(error) == 409
+
+
+def test_objects_are_shared_between_stores(
+    store: HklCalcStore, new_store: StoreFactory
+):
+    other = new_store()
+    hkl = asyncio.run(store.load("test", "B07"))
+
+    changed = asyncio.run(other.load("test", "B07"))
+    changed.ubcalc.set_u([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+    asyncio.run(other.save("test", changed, "B07"))
+    asyncio.run(other.create("new", "B07"))
+
+    loaded = asyncio.run(store.load("test", "B07"))
+    assert loaded.ubcalc.U.tolist() == [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+    assert asyncio.run(store.load("new", "B07")).ubcalc.name == "new"
+    with pytest.raises(DiffcalcAPIException) as error:
+        asyncio.run(store.save("test", hkl, "B07"))
+    assert status_code(error) == 409
+
+
+def test_partial_loads(store: HklCalcStore):
+    hkl = asyncio.run(store.load("test", "B07"))
+    hkl.ubcalc.set_u([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+    asyncio.run(store.save("test", hkl, "B07"))
+
+    ubcalc = asyncio.run(store.load_ubcalc("test", "B07", ["name", "u_matrix"]))
+
+    assert ubcalc.name == "test"
+    assert ubcalc.U.tolist() == [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+
+
+def test_bulk_creation_and_listing(store: HklCalcStore):
+    calcs = [
+        (name, HklCalculation(UBCalculation(name=name), Constraints()))
+        for name in ("b", "test", "a")
+    ]
+
+    skipped = asyncio.run(store.create_many("B07", calcs))
+    first = asyncio.run(store.list_ubcalcs("B07", None, 2))
+    second = asyncio.run(store.load_many("B07", first[-1][0], 2))
+
+    assert skipped == ["test"]
+    assert [name for name, _, _ in first] == ["a", "b"]
+    assert [revision for _, _, revision in first] == [
+        asyncio.run(store.get_revision(name, "B07")) for name in ("a", "b")
+    ]
+    assert [name for name, _ in second] == ["test"]
+    assert asyncio.run(store.list_ubcalcs("B08", None, 2)) == []
+
+
+def test_stores_can_be_used_after_closing(store: HklCalcStore):
+    close_store(store)
+
+    assert asyncio.run(store.load("test", "B07")).ubcalc.name == "test"